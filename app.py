@@ -35,7 +35,11 @@ glue_stack = GlueCatalogStack(
     data_lake_gold_bucket=data_lake_stack.data_lake_gold_bucket,
 )
 athena_stack = AthenaStack(app)
-emr_stack = EMRStack(app, common_stack)
+emr_stack = EMRStack(
+    app,
+    common_stack,
+    persistent_cluster=os.environ.get("EMR_PERSISTENT_CLUSTER") == "true",
+)
 
 redshift_stack = RedshiftStack(
     app,
@@ -0,0 +1,253 @@
+"""
+Compares the bytes Athena / Redshift Spectrum would scan from gold orders_obt
+when it is written unclustered, sorted or Z-ordered.
+
+Scanned bytes are computed the way those engines prune Parquet: partitions
+outside the filter are skipped, then row groups whose min/max statistics
+can't match, and only the compressed chunks of the queried columns are read.
+
+    python -m benchmarks.gold_layout --orders 200000
+"""
+import argparse
+import datetime
+import posixpath
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_platform.processing.bronze_to_silver import SILVER_TABLES, write_silver
+from data_platform.processing.silver_to_gold import (
+    LAYOUTS,
+    ORDERS_OBT,
+    PARTITION_COLUMN,
+    gold_files,
+    materialize_orders_obt,
+)
+from data_platform.processing.storage import (
+    SILVER_PREFIX,
+    GOLD_PREFIX,
+    resolve,
+    table_path,
+)
+
+CATEGORIES = 70
+FIRST_DAY = datetime.date(2016, 9, 1)
+DAYS = 790
+
+
+def silver_table(table_name: str, columns: dict) -> pa.Table:
+    schema = SILVER_TABLES[table_name].schema
+    return pa.Table.from_arrays(
+        [
+            pa.array(columns[field.name], field.type)
+            if field.name in columns
+            else pa.nulls(len(next(iter(columns.values()))), field.type)
+            for field in schema
+        ],
+        schema=schema,
+    )
+
+
+def generate_silver(silver_uri: str, orders: int, seed: int = 0) -> None:
+    """
+    Writes silver tables with skewed sellers and categories, like real
+    marketplace data: a few sellers and categories take most of the orders
+    """
+    random = np.random.default_rng(seed)
+    filesystem, root = resolve(silver_uri)
+    sellers = max(orders // 30, 10)
+    products = max(orders // 3, 10)
+
+    order_ids = np.char.add("o", np.arange(orders).astype(str))
+    purchase_days = random.integers(0, DAYS, orders)
+    purchase_dates = np.datetime64(FIRST_DAY) + purchase_days.astype("timedelta64[D]")
+    product_ids = np.char.add("p", np.arange(products).astype(str))
+    product_categories = np.char.add(
+        "category_", (random.zipf(1.3, products) % CATEGORIES).astype(str)
+    )
+
+    items_per_order = random.integers(1, 4, orders)
+    item_orders = np.repeat(np.arange(orders), items_per_order)
+    item_sequential = np.concatenate([np.arange(1, n + 1) for n in items_per_order])
+    item_products = random.zipf(1.2, len(item_orders)) % products
+    item_sellers = random.zipf(1.3, len(item_orders)) % sellers
+    prices = np.round(random.gamma(2.0, 60.0, len(item_orders)), 2)
+
+    payments_per_order = random.integers(1, 3, orders)
+    payment_orders = np.repeat(np.arange(orders), payments_per_order)
+    payment_sequential = np.concatenate(
+        [np.arange(1, n + 1) for n in payments_per_order]
+    )
+
+    tables = {
+        "orders": silver_table(
+            "orders",
+            {
+                "order_id": order_ids,
+                "customer_id": np.char.add("c", np.arange(orders).astype(str)),
+                "order_status": np.full(orders, "delivered"),
+                "order_purchase_timestamp": purchase_dates.astype("datetime64[us]"),
+                "order_purchase_date": purchase_dates,
+            },
+        ),
+        "products": silver_table(
+            "products",
+            {"product_id": product_ids, "product_category_name": product_categories},
+        ),
+        "order_items": silver_table(
+            "order_items",
+            {
+                "order_id": order_ids[item_orders],
+                "order_item_qty": item_sequential,
+                "product_id": product_ids[item_products],
+                "seller_id": np.char.add("s", item_sellers.astype(str)),
+                "shipping_limit_date": purchase_dates[item_orders]
+                + np.timedelta64(7, "D"),
+                "price": prices,
+                "freight_value": np.round(prices * 0.1, 2),
+                "order_item_id": np.char.add(
+                    np.char.add(order_ids[item_orders], "-"),
+                    item_sequential.astype(str),
+                ),
+            },
+        ),
+        "order_payments": silver_table(
+            "order_payments",
+            {
+                "order_id": order_ids[payment_orders],
+                "payment_sequential": payment_sequential,
+                "payment_type": random.choice(
+                    ["credit_card", "boleto", "voucher"], len(payment_orders)
+                ),
+                "payment_installments": random.integers(1, 10, len(payment_orders)),
+                "payment_value": np.round(
+                    random.gamma(2.0, 80.0, len(payment_orders)), 2
+                ),
+            },
+        ),
+        "order_reviews": silver_table(
+            "order_reviews",
+            {
+                "review_id": np.char.add("r", np.arange(orders).astype(str)),
+                "order_id": order_ids,
+                "review_score": random.integers(1, 6, orders),
+                "review_creation_date": purchase_dates + np.timedelta64(10, "D"),
+            },
+        ),
+    }
+    for table_name, table in tables.items():
+        write_silver(
+            table.to_batches(),
+            SILVER_TABLES[table_name],
+            filesystem,
+            table_path(root, SILVER_PREFIX, table_name),
+        )
+
+
+def may_match(statistics, low, high) -> bool:
+    if statistics is None or not statistics.has_min_max:
+        return True
+    return not (statistics.max < low or statistics.min > high)
+
+
+def scanned_bytes(filesystem, path: str, columns: list, predicates: dict) -> int:
+    """
+    Bytes of the queried columns in the row groups a filter can't rule out.
+    predicates maps a column to an inclusive (low, high) range.
+    """
+    scanned = 0
+    for file_path in gold_files(filesystem, path):
+        partition = posixpath.basename(posixpath.dirname(file_path))
+        year = int(partition.split("=")[1])
+        if "order_purchase_date" in predicates:
+            low, high = predicates["order_purchase_date"]
+            if not low.year <= year <= high.year:
+                continue
+        with filesystem.open_input_file(file_path) as source:
+            metadata = pq.ParquetFile(source).metadata
+        names = metadata.schema.names
+        for index in range(metadata.num_row_groups):
+            row_group = metadata.row_group(index)
+            if all(
+                may_match(row_group.column(names.index(column)).statistics, *bounds)
+                for column, bounds in predicates.items()
+            ):
+                scanned += sum(
+                    row_group.column(names.index(column)).total_compressed_size
+                    for column in columns
+                    if column != PARTITION_COLUMN
+                )
+    return scanned
+
+
+def queries(seller: str, category: str) -> dict:
+    """
+    Dashboard style filters, each reading gmv and the filtered columns
+    """
+    month = (datetime.date(2017, 11, 1), datetime.date(2017, 11, 30))
+    quarter = (datetime.date(2018, 1, 1), datetime.date(2018, 3, 31))
+    return {
+        "one month": {"order_purchase_date": month},
+        "one seller": {"seller_id": (seller, seller)},
+        "one category": {"product_category": (category, category)},
+        "seller in a quarter": {
+            "order_purchase_date": quarter,
+            "seller_id": (seller, seller),
+        },
+        "category in a month": {
+            "order_purchase_date": month,
+            "product_category": (category, category),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--row-group-size", type=int, default=16_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        silver = f"{directory}/silver"
+        generate_silver(silver, args.orders, seed=args.seed)
+        # a mid-sized seller and category, the common case for a dashboard
+        results = {}
+        for layout in LAYOUTS:
+            gold = f"{directory}/gold-{layout}"
+            stats = materialize_orders_obt(
+                silver, gold, layout=layout, row_group_size=args.row_group_size
+            )
+            filesystem, root = resolve(gold)
+            path = table_path(root, GOLD_PREFIX, ORDERS_OBT)
+            if not results:
+                obt = pq.read_table(gold_files(filesystem, path), filesystem=filesystem)
+                seller = obt["seller_id"].value_counts()[10]["values"].as_py()
+                category = obt["product_category"].value_counts()[5]["values"].as_py()
+            total = scanned_bytes(filesystem, path, ["gmv"], {})
+            results[layout] = {
+                name: scanned_bytes(filesystem, path, ["gmv", *predicates], predicates)
+                for name, predicates in queries(seller, category).items()
+            }
+            results[layout]["full scan"] = total
+            print(
+                f"{layout}: {stats['rows']} rows, {stats['files']} files, "
+                f"{stats['bytes'] / 1024 / 1024:.1f} MB in {stats['seconds']:.1f}s"
+            )
+
+    print(f"\n{'query':<22}" + "".join(f"{layout:>16}" for layout in LAYOUTS))
+    for name in results["none"]:
+        baseline = results["none"][name] or 1
+        print(
+            f"{name:<22}"
+            + "".join(
+                f"{results[layout][name] / 1024:>9.0f} KB {results[layout][name] / baseline:>4.0%}"
+                for layout in LAYOUTS
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,593 @@
+"""
+Runs the pipeline offline, stage by stage, on generated data at several
+scale factors, and records each stage's wall time, peak RSS, rows per
+second and bytes written as JSON.
+
+    python -m benchmarks.pipeline run --scale-factors 0.1 1 --output results.json
+
+Every stage runs its command line in a child process, so its peak RSS is
+measured on its own (the largest process of the stage, pool workers
+included). Stages:
+
+    generate        synthetic_data writes the source tables as Parquet
+    rds_load_default, rds_load  insert_to_rds loads them (as CSV) into
+                    PostgreSQL, creating tables with their constraints, then
+                    with --bulk-load, building the constraints afterwards
+    dms_emulation   writes them as DMS would: full load files, then CDC files
+    bronze_to_silver, cdc_merge, silver_to_gold  the processing jobs
+    redshift_copy   copy_loader loads silver into PostgreSQL standing in for Redshift
+    dbt_mart        dbt builds the mart from those tables
+
+The PostgreSQL stages need --postgres-dsn, and dbt_mart a profile with a
+target for that database (--dbt-target, see dbt_project/README.md); they
+are skipped otherwise. With --baseline, results are compared with a stored
+run and the command fails when a stage got slower, used more memory or
+wrote more bytes than the tolerance allows.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import posixpath
+import shutil
+import subprocess
+import sys
+import time
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from data_platform.definitions import db_name
+from data_platform.data_definitions import TABLES
+from data_platform.processing.storage import BRONZE_PREFIX, SILVER_PREFIX
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPOSITORY, "benchmarks", "pipeline_baseline.json")
+# metrics compared with the baseline (lower is better), with the differences
+# that are noise whatever the ratio. Rows are the same for the same seed and
+# scale factor, so rows per second follows seconds.
+METRICS = {"seconds": 1.0, "peak_rss_bytes": 64 * 1024**2, "bytes_written": 1024**2}
+# tables the dbt mart reads
+MART_TABLES = ("orders", "order_items", "order_payments", "order_reviews", "products")
+FULL_LOAD_AT = datetime.datetime(2021, 5, 20, 0, 0)
+CDC_AT = datetime.datetime(2021, 5, 21, 11, 0)
+
+
+def parquet_rows(directory: str, include=lambda path: True) -> int:
+    rows = 0
+    for path in files(directory, ".parquet"):
+        if include(path):
+            rows += pq.ParquetFile(path).metadata.num_rows
+    return rows
+
+
+def files(directory: str, suffix: str = "") -> list:
+    return sorted(
+        os.path.join(folder, name)
+        for folder, _, names in os.walk(directory)
+        for name in names
+        if name.endswith(suffix) and "/_state" not in folder
+    )
+
+
+def bytes_written_since(directories: tuple, since: float) -> int:
+    """
+    Size of the files created or rewritten under directories since a time
+    """
+    return sum(
+        os.path.getsize(path)
+        for directory in directories
+        for path in files(directory)
+        if os.path.getmtime(path) >= since
+    )
+
+
+def postgres_bytes(dsn: str, schema: str) -> int:
+    import psycopg2
+
+    with psycopg2.connect(dsn) as connection, connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT coalesce(sum(pg_total_relation_size(c.oid)), 0) "
+            "FROM pg_class AS c JOIN pg_namespace AS n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = %s AND c.relkind = 'r'",
+            (schema,),
+        )
+        return int(cursor.fetchone()[0])
+
+
+def drop_schema(dsn: str, schema: str) -> None:
+    import psycopg2
+
+    with psycopg2.connect(dsn) as connection, connection.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+
+
+def exit_code(status: int) -> int:
+    """
+    The exit code of a wait status, negative for the signal that killed
+    the process like Popen.returncode. os.waitstatus_to_exitcode only
+    exists from Python 3.9 on, so 3.7 and 3.8 decode the status here.
+    """
+    if hasattr(os, "waitstatus_to_exitcode"):
+        return os.waitstatus_to_exitcode(status)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_command(command: list, cwd: str = REPOSITORY) -> dict:
+    """
+    Runs a command, returning its wall time and the peak RSS of its
+    process tree
+    """
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [REPOSITORY, environment.get("PYTHONPATH")])
+    )
+    environment.setdefault("ENVIRONMENT", "DEVELOPMENT")
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, env=environment)
+    # wait4 reports the child's own usage, which covers the pool workers it waited for
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = exit_code(status)
+    seconds = time.perf_counter() - start
+    if process.returncode:
+        raise RuntimeError(f"{' '.join(command)} exited with {process.returncode}")
+    return {"seconds": seconds, "peak_rss_bytes": usage.ru_maxrss * 1024}
+
+
+def python_module(module: str, *arguments) -> list:
+    return [sys.executable, "-m", module, *[str(argument) for argument in arguments]]
+
+
+def change_rows(
+    random: np.random.Generator, table: pa.Table, table_name: str, fraction: float
+) -> pa.Table:
+    """
+    CDC rows for a sample of a table's rows: updates, deletes and inserts of
+    new keys for tables with a primary key, inserts only for the others
+    (DMS can't capture their updates and deletes)
+    """
+    size = int(table.num_rows * fraction)
+    if not size:
+        return None
+    sample = table.take(pa.array(random.choice(table.num_rows, size, replace=False)))
+    keys = TABLES[table_name].primary_key
+    if keys:
+        operations = random.choice(["U", "D", "I"], size, p=[0.8, 0.1, 0.1])
+        # inserted rows are new versions of sampled rows, under a new key
+        key = sample[keys[0]]
+        new_key = pc.binary_join_element_wise(key, pa.scalar("0"), "")
+        sample = sample.set_column(
+            sample.schema.get_field_index(keys[0]),
+            keys[0],
+            pc.if_else(pa.array(operations == "I"), new_key, key),
+        )
+    else:
+        operations = np.full(size, "I")
+    extracted_at = np.datetime64(CDC_AT, "us") + np.sort(
+        random.integers(0, 3600 * 10**6, size)
+    ).astype("timedelta64[us]")
+    return sample.append_column("Op", pa.array(operations)).append_column(
+        "extracted_at", pa.array(extracted_at, pa.timestamp("us"))
+    )
+
+
+def emulate_dms(
+    source: str, bronze: str, change_fraction: float = 0.01, seed: int = 0
+) -> dict:
+    """
+    Writes the generated source tables to bronze the way the replication
+    task does: full load files, then CDC files with an Op column in the
+    day's date folder. Reads and writes one source file at a time.
+    """
+    random = np.random.default_rng(seed)
+    written = {}
+    for table_name in TABLES:
+        target = posixpath.join(bronze, BRONZE_PREFIX, table_name)
+        cdc_folder = posixpath.join(target, CDC_AT.strftime("%Y/%m/%d"))
+        os.makedirs(cdc_folder, exist_ok=True)
+        rows = 0
+        for number, path in enumerate(files(os.path.join(source, table_name))):
+            table = pq.read_table(path)
+            full_load = table.append_column(
+                "extracted_at",
+                pa.array(
+                    np.full(table.num_rows, np.datetime64(FULL_LOAD_AT, "us")),
+                    pa.timestamp("us"),
+                ),
+            )
+            pq.write_table(
+                full_load, posixpath.join(target, f"LOAD{number + 1:08d}.parquet")
+            )
+            rows += full_load.num_rows
+            changes = change_rows(random, table, table_name, change_fraction)
+            if changes is None:
+                continue
+            name = f"{CDC_AT:%Y%m%d}-{CDC_AT:%H%M%S}{number:03d}.parquet"
+            pq.write_table(changes, posixpath.join(cdc_folder, name))
+            rows += changes.num_rows
+        written[table_name] = rows
+    return written
+
+
+class Stage(NamedTuple):
+    """
+    A pipeline stage: how it's run, how many rows it processed, and where
+    it writes (directories, or a PostgreSQL schema). setup runs before the
+    stage, outside its measures.
+    """
+
+    name: str
+    run: Callable
+    rows: Callable
+    outputs: tuple = ()
+    schema: Optional[str] = None
+    setup: Optional[Callable] = None
+
+
+def pipeline_stages(args, scale_factor: float, work: str) -> list:
+    source = os.path.join(work, "source")
+    source_csv = os.path.join(work, "source_csv")
+    bronze = os.path.join(work, "bronze")
+    silver = os.path.join(work, "silver")
+    gold = os.path.join(work, "gold")
+    bronze_tables = os.path.join(bronze, BRONZE_PREFIX)
+    silver_tables = os.path.join(silver, SILVER_PREFIX)
+
+    def generate(file_format: str, output: str):
+        return lambda: run_command(
+            python_module(
+                "data_platform.synthetic_data",
+                "--output",
+                output,
+                "--scale-factor",
+                scale_factor,
+                "--seed",
+                args.seed,
+                "--format",
+                file_format,
+                "--workers",
+                args.workers,
+            )
+        )
+
+    def silver_rows(tables=TABLES):
+        return sum(
+            parquet_rows(os.path.join(silver_tables, table_name))
+            for table_name in tables
+        )
+
+    stages = [
+        Stage(
+            "generate",
+            generate("parquet", source),
+            lambda: parquet_rows(source),
+            outputs=(source,),
+        )
+    ]
+    if args.postgres_dsn:
+        stages += [
+            Stage(
+                "generate_csv",
+                generate("csv", source_csv),
+                lambda: parquet_rows(source),
+                outputs=(source_csv,),
+            ),
+        ]
+        # both load modes start from an empty schema
+        stages += [
+            Stage(
+                name,
+                lambda options=options: run_command(
+                    python_module(
+                        "data_platform.insert_to_rds",
+                        "--dsn",
+                        args.postgres_dsn,
+                        "--data",
+                        source_csv,
+                        "--workers",
+                        args.workers,
+                        *options,
+                    )
+                ),
+                lambda: parquet_rows(source),
+                schema=db_name,
+                setup=lambda: drop_schema(args.postgres_dsn, db_name),
+            )
+            for name, options in [
+                ("rds_load_default", []),
+                ("rds_load", ["--bulk-load"]),
+            ]
+        ]
+    stages += [
+        Stage(
+            "dms_emulation",
+            lambda: run_command(
+                python_module(
+                    "benchmarks.pipeline",
+                    "emulate-dms",
+                    "--source",
+                    source,
+                    "--bronze",
+                    bronze,
+                    "--change-fraction",
+                    args.change_fraction,
+                    "--seed",
+                    args.seed,
+                )
+            ),
+            lambda: parquet_rows(bronze),
+            outputs=(bronze,),
+        ),
+        Stage(
+            "bronze_to_silver",
+            lambda: run_command(
+                python_module(
+                    "data_platform.processing.bronze_to_silver",
+                    "--bronze",
+                    bronze,
+                    "--silver",
+                    silver,
+                    "--workers",
+                    args.workers,
+                )
+            ),
+            silver_rows,
+            outputs=(silver,),
+        ),
+        Stage(
+            "cdc_merge",
+            lambda: run_command(
+                python_module(
+                    "data_platform.processing.cdc_merge",
+                    "--bronze",
+                    bronze,
+                    "--silver",
+                    silver,
+                    "--workers",
+                    args.workers,
+                )
+            ),
+            lambda: parquet_rows(
+                bronze_tables,
+                include=lambda path: not os.path.basename(path).startswith("LOAD"),
+            ),
+            outputs=(silver,),
+        ),
+        Stage(
+            "silver_to_gold",
+            lambda: run_command(
+                python_module(
+                    "data_platform.processing.silver_to_gold",
+                    "--silver",
+                    silver,
+                    "--gold",
+                    gold,
+                )
+            ),
+            lambda: parquet_rows(gold),
+            outputs=(gold,),
+        ),
+    ]
+    if args.postgres_dsn:
+        stages.append(
+            Stage(
+                "redshift_copy",
+                lambda: run_command(
+                    python_module(
+                        "data_platform.redshift.copy_loader",
+                        "--silver",
+                        silver,
+                        "--dsn",
+                        args.postgres_dsn,
+                        "--iam-role",
+                        "local",
+                        "--full",
+                        "--local",
+                    )
+                ),
+                silver_rows,
+                schema="silver",
+            )
+        )
+    if args.postgres_dsn and args.dbt_target and shutil.which("dbt"):
+        stages.append(
+            Stage(
+                "dbt_mart",
+                lambda: run_command(
+                    [
+                        "dbt",
+                        "run",
+                        "--target",
+                        args.dbt_target,
+                        "--full-refresh",
+                        "--vars",
+                        "{silver_schema: silver}",
+                    ]
+                    + (
+                        ["--profiles-dir", args.dbt_profiles_dir]
+                        if args.dbt_profiles_dir
+                        else []
+                    ),
+                    cwd=os.path.join(REPOSITORY, "dbt_project"),
+                ),
+                lambda: silver_rows(MART_TABLES),
+                schema=args.dbt_schema,
+            )
+        )
+    return stages
+
+
+def run_stage(stage: Stage, dsn: str = None) -> dict:
+    if stage.setup:
+        stage.setup()
+    start = time.time()
+    if stage.schema:
+        before = postgres_bytes(dsn, stage.schema)
+    measured = stage.run()
+    if stage.schema:
+        written = postgres_bytes(dsn, stage.schema) - before
+    else:
+        written = bytes_written_since(stage.outputs, start)
+    rows = stage.rows()
+    return dict(
+        measured,
+        rows=rows,
+        rows_per_second=rows / max(measured["seconds"], 1e-9),
+        bytes_written=written,
+    )
+
+
+def run_benchmarks(args) -> dict:
+    results = {
+        "started_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "runs": {},
+    }
+    for scale_factor in args.scale_factors:
+        work = os.path.join(args.work_dir, f"sf{scale_factor:g}")
+        shutil.rmtree(work, ignore_errors=True)
+        if args.postgres_dsn:
+            for schema in [db_name, "silver", "data_lake_silver", args.dbt_schema]:
+                drop_schema(args.postgres_dsn, schema)
+        stages = {}
+        for stage in pipeline_stages(args, scale_factor, work):
+            print(f"\n=== scale factor {scale_factor:g}: {stage.name}", flush=True)
+            stages[stage.name] = run_stage(stage, args.postgres_dsn)
+        results["runs"][f"{scale_factor:g}"] = stages
+        if not args.keep_data:
+            shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Stages of the runs the baseline also ran, whose metrics are worse than
+    the baseline's by more than the tolerance (and than noise)
+    """
+    found = []
+    for scale_factor, stages in results["runs"].items():
+        for stage_name, measured in stages.items():
+            reference = baseline["runs"].get(scale_factor, {}).get(stage_name)
+            if not reference:
+                continue
+            for metric, noise in METRICS.items():
+                value, expected = measured[metric], reference[metric]
+                if value - expected > max(noise, tolerance * expected):
+                    found.append(
+                        f"scale factor {scale_factor}, {stage_name}: {metric} "
+                        f"{value:,.1f} vs {expected:,.1f} in the baseline"
+                    )
+    return found
+
+
+def print_results(results: dict) -> None:
+    for scale_factor, stages in results["runs"].items():
+        print(f"\nscale factor {scale_factor}")
+        for stage_name, measured in stages.items():
+            print(
+                f"  {stage_name:<17} {measured['seconds']:8.1f}s "
+                f"{measured['peak_rss_bytes'] / 1e6:8.0f} MB peak "
+                f"{measured['rows']:>13,} rows {measured['rows_per_second']:>12,.0f} rows/s "
+                f"{measured['bytes_written'] / 1e6:10.1f} MB written"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages offline on generated data"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "--scale-factors", nargs="+", type=float, default=[0.1, 1.0]
+    )
+    run_parser.add_argument("--work-dir", default="/tmp/pipeline-benchmark")
+    run_parser.add_argument("--output", help="Where to write the results JSON")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    run_parser.add_argument(
+        "--change-fraction",
+        type=float,
+        default=0.01,
+        help="Rows of each table changed by the emulated CDC",
+    )
+    run_parser.add_argument(
+        "--postgres-dsn",
+        default=os.environ.get("BENCHMARK_POSTGRES_DSN"),
+        help="Local PostgreSQL for the RDS, Redshift and dbt stages "
+        "(default: $BENCHMARK_POSTGRES_DSN, skipped without one)",
+    )
+    run_parser.add_argument(
+        "--dbt-target", help="dbt target of that database, for the dbt_mart stage"
+    )
+    run_parser.add_argument("--dbt-profiles-dir")
+    run_parser.add_argument(
+        "--dbt-schema", default="analytics_gold", help="Schema of the dbt target"
+    )
+    run_parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE,
+        help="Results of a previous run to compare with",
+    )
+    run_parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the baseline instead of comparing",
+    )
+    run_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Relative change of a metric tolerated before it's a regression",
+    )
+    run_parser.add_argument(
+        "--keep-data", action="store_true", help="Keep the generated lake"
+    )
+    emulate_parser = commands.add_parser(
+        "emulate-dms", help="Write source tables to bronze as DMS would"
+    )
+    emulate_parser.add_argument("--source", required=True)
+    emulate_parser.add_argument("--bronze", required=True)
+    emulate_parser.add_argument("--change-fraction", type=float, default=0.01)
+    emulate_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "emulate-dms":
+        written = emulate_dms(
+            args.source, args.bronze, args.change_fraction, seed=args.seed
+        )
+        for table_name, rows in written.items():
+            print(f"{table_name}: {rows} rows")
+        return
+
+    results = run_benchmarks(args)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nBaseline stored in {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        if found:
+            raise SystemExit("Regressions against the baseline:\n" + "\n".join(found))
+        print(f"\nNo regressions against {args.baseline}")
+    else:
+        print(f"\nNo baseline at {args.baseline}, run with --update-baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 from airflow import DAG
 
-from airflow.contrib.operators.emr_create_job_flow_operator import EmrCreateJobFlowOperator
+from airflow.contrib.operators.emr_create_job_flow_operator import (
+    EmrCreateJobFlowOperator,
+)
 from airflow.contrib.operators.emr_add_steps_operator import EmrAddStepsOperator
-from airflow.contrib.sensors.emr_step_sensor import EmrStepSensor
+from airflow.contrib.operators.emr_terminate_job_flow_operator import (
+    EmrTerminateJobFlowOperator,
+)
+from airflow.operators.python_operator import PythonOperator
 
 # from airflow.providers.amazon.aws.operators.emr_create_job_flow import EmrCreateJobFlowOperator
 # from airflow.providers.amazon.aws.operators.emr_add_steps import EmrAddStepsOperator
@@ -11,134 +16,183 @@ from airflow.contrib.sensors.emr_step_sensor import EmrStepSensor
 from airflow.utils.dates import days_ago
 from datetime import timedelta
 import os
-import boto3
+
+from data_platform.data_definitions import table_names_list
+from data_platform.emr.spark_profile import SparkProfile
+from data_platform.instrumentation import airflow_task_callback, start_trace
+from emr_steps import EmrRetryStepSensor, find_job_flow, python_step, terminate_job_flow
+from stack_resources import macros
 
 DAG_ID = os.path.basename(__file__).replace(".py", "")
 
-# Get Resources
-# Cloudformation client
-cf = boto3.client('cloudformation')
-# Get subnets
-common_stack = cf.describe_stack_resources(
-    StackName='production-common-stack'
+# Resources are looked up through Jinja macros when a task runs. The EMR
+# stack uploads the data_platform package the steps run and the bootstrap
+# script installing its libraries to the script bucket.
+package_path = "s3://{{ script_bucket() }}/data_platform.zip"
+bootstrap_file = "s3://{{ script_bucket() }}/bootstrap_emr.sh"
+bronze_uri = "s3://{{ bronze_bucket() }}"
+silver_uri = "s3://{{ silver_bucket() }}"
+
+# One step per table, running side by side on the cluster
+TABLES = [table_name.split(".")[-1] for table_name in table_names_list]
+STEP_CONCURRENCY = int(os.environ.get("EMR_STEP_CONCURRENCY", 4))
+STEP_ATTEMPTS = int(os.environ.get("EMR_STEP_ATTEMPTS", 2))
+
+# same Spark settings as the persistent cluster, sized for the core nodes below
+SPARK_PROFILE = SparkProfile(instance_type="m5.xlarge", instance_count=2)
+
+# 'transient' creates a cluster per run, 'persistent' submits the steps to
+# the long lived cluster of the EMR stack (EMR_PERSISTENT_CLUSTER=true)
+CLUSTER_MODE = os.environ.get("EMR_CLUSTER_MODE", "transient")
+PERSISTENT_CLUSTER_NAME = os.environ.get("EMR_CLUSTER_NAME", "emr-cluster-production")
+PERSISTENT_CLUSTER_STATES = ["STARTING", "BOOTSTRAPPING", "RUNNING", "WAITING"]
+JOB_FLOW_TASK_ID = (
+    "find_job_flow" if CLUSTER_MODE == "persistent" else "create_job_flow"
 )
-common_resources = common_stack['StackResources']
-subnets = [resource for resource in common_resources if resource['ResourceType'] == 'AWS::EC2::Subnet' if 'PublicSubnet' in resource['LogicalResourceId']]
-public_subnet = subnets[0]['PhysicalResourceId']
-
-# Get pyspark script bucket
-buckets = [resource for resource in common_resources if resource['ResourceType'] == 'AWS::S3::Bucket' if 'script-bucket-production-' in resource['PhysicalResourceId']]
-bucket = buckets[0]['PhysicalResourceId']
-
-spark_script_path = f's3://{bucket}/' + 'bronze_to_silver_processing.py'
-bootstrap_file = f's3://{bucket}/' + 'bronze_to_silver_processing.py'
-
-# EMR Roles
-emr_stack = cf.describe_stack_resources(
-    StackName='production-emr-stack'
+JOB_FLOW_ID = (
+    "{{ task_instance.xcom_pull(task_ids='%s', key='return_value') }}"
+    % JOB_FLOW_TASK_ID
 )
-emr_resources = emr_stack['StackResources']
-emr_roles = [resource for resource in emr_resources if resource['ResourceType'] == 'AWS::IAM::Role']
-
-# EMR ServiceRole
-service_roles = [role for role in emr_roles if 'emrservicerole' in role['LogicalResourceId']]
-service_role = service_roles[0]['PhysicalResourceId']
-
-# EMR JobFlowRole
-job_flow_roles = [role for role in emr_roles if 'emrjobflowrole' in role['LogicalResourceId']]
-job_flow_role = job_flow_roles[0]['PhysicalResourceId']
 
 
 DEFAULT_ARGS = {
-    'owner': 'airflow',
-    'depends_on_past': False,
-    'email': ['airflow@example.com'],
-    'email_on_failure': False,
-    'email_on_retry': False,
+    "owner": "airflow",
+    "depends_on_past": False,
+    "email": ["airflow@example.com"],
+    "email_on_failure": False,
+    "email_on_retry": False,
+    # every task is logged as a span of the run's trace (see start_trace)
+    "on_success_callback": airflow_task_callback,
+    "on_failure_callback": airflow_task_callback,
 }
 
 JOB_FLOW_OVERRIDES = {
-    'Name': 'emr-demo-bronze-silver-cluster',
-    'ReleaseLabel': 'emr-5.30.1',
-    'Applications': [
-        {
-            'Name': 'Spark'
-        },
+    "Name": "emr-demo-bronze-silver-cluster",
+    "ReleaseLabel": SPARK_PROFILE.release_label,
+    "Applications": [
+        {"Name": "Spark"},
     ],
-    'Instances': {
-        'InstanceGroups': [
+    "Instances": {
+        "InstanceGroups": [
             {
-                'Name': "Master nodes",
-                'Market': 'ON_DEMAND',
-                'InstanceRole': 'MASTER',
-                'InstanceType': 'm5.xlarge',
-                'InstanceCount': 1,
+                "Name": "Master nodes",
+                "Market": "ON_DEMAND",
+                "InstanceRole": "MASTER",
+                "InstanceType": "m5.xlarge",
+                "InstanceCount": 1,
             },
             {
-                'Name': "Slave nodes",
-                'Market': 'ON_DEMAND',
-                'InstanceRole': 'CORE',
-                'InstanceType': 'm5.xlarge',
-                'InstanceCount': 2,
-            }
+                "Name": "Slave nodes",
+                "Market": "ON_DEMAND",
+                "InstanceRole": "CORE",
+                "InstanceType": SPARK_PROFILE.instance_type,
+                "InstanceCount": SPARK_PROFILE.instance_count,
+            },
         ],
-        'KeepJobFlowAliveWhenNoSteps': False,
-        'TerminationProtected': False,
-        'Ec2SubnetId': public_subnet,
+        # kept alive so failed steps can be resubmitted, terminated by the DAG
+        # (by remove_cluster, or by terminate_job_flow if the run times out)
+        "KeepJobFlowAliveWhenNoSteps": True,
+        "TerminationProtected": False,
+        "Ec2SubnetId": "{{ public_subnet() }}",
     },
-    'BootstrapActions': [
+    "BootstrapActions": [
         {
-            'BootstrapActionConfig': {
-                'Name': 'install_python_libraries',
-                'ScriptBootstrapAction': {
-                    'Path': bootstrap_file
-                }
+            "BootstrapActionConfig": {
+                "Name": "install_python_libraries",
+                "ScriptBootstrapAction": {"Path": bootstrap_file},
             }
         },
     ],
-    'VisibleToAllUsers': True,
-    'JobFlowRole': job_flow_role,
-    'ServiceRole': service_role
+    "Configurations": SPARK_PROFILE.configurations(),
+    "StepConcurrencyLevel": STEP_CONCURRENCY,
+    "VisibleToAllUsers": True,
+    "JobFlowRole": "{{ emr_job_flow_role() }}",
+    "ServiceRole": "{{ emr_service_role() }}",
 }
 
-SPARK_STEPS = [
-    {
-        'Name': 'bronze_to_silver_processing',
-        'ActionOnFailure': 'CONTINUE',
-        'HadoopJarStep': {
-            'Jar': 'command-runner.jar',
-            'Args': ['spark-submit', '--deploy-mode', 'cluster', spark_script_path],
-        },
-    }
-]
+# each step processes one table on the master node, in a single process
+BRONZE_TO_SILVER_STEPS = {
+    table: python_step(
+        f"bronze_to_silver_{table}",
+        "data_platform.processing.bronze_to_silver",
+        "--tables",
+        table,
+        "--bronze",
+        bronze_uri,
+        "--silver",
+        silver_uri,
+        "--workers",
+        "1",
+        package_path=package_path,
+    )
+    for table in TABLES
+}
 
 with DAG(
     dag_id=DAG_ID,
     default_args=DEFAULT_ARGS,
-    dagrun_timeout=timedelta(minutes=15),
+    # cluster startup alone takes about 10 minutes
+    dagrun_timeout=timedelta(hours=2),
+    # a timed out run skips remove_cluster, so the callback terminates it
+    on_failure_callback=terminate_job_flow if CLUSTER_MODE == "transient" else None,
     start_date=days_ago(1),
-    schedule_interval='@once',
-    tags=['emr'],
+    schedule_interval="@once",
+    tags=["emr"],
+    user_defined_macros=macros,
 ) as dag:
 
-    cluster_creator = EmrCreateJobFlowOperator(
-        task_id='create_job_flow',
-        emr_conn_id='aws_default',
-        job_flow_overrides=JOB_FLOW_OVERRIDES
+    # pushes the trace context the spans of the other tasks join
+    trace_starter = PythonOperator(
+        task_id="start_trace",
+        python_callable=start_trace,
+        provide_context=True,
     )
 
-    step_adder = EmrAddStepsOperator(
-        task_id='add_steps',
-        job_flow_id="{{ task_instance.xcom_pull(task_ids='create_job_flow', key='return_value') }}",
-        aws_conn_id='aws_default',
-        steps=SPARK_STEPS,
-    )
-
-    step_checker = EmrStepSensor(
-        task_id='watch_step',
-        job_flow_id="{{ task_instance.xcom_pull('create_job_flow', key='return_value') }}",
-        step_id="{{ task_instance.xcom_pull(task_ids='add_steps', key='return_value')[0] }}",
-        aws_conn_id='aws_default',
-    )
-
-    cluster_creator >> step_adder >> step_checker
+    if CLUSTER_MODE == "persistent":
+        cluster_finder = PythonOperator(
+            task_id=JOB_FLOW_TASK_ID,
+            python_callable=find_job_flow,
+            op_kwargs={
+                "cluster_name": PERSISTENT_CLUSTER_NAME,
+                "cluster_states": PERSISTENT_CLUSTER_STATES,
+                "aws_conn_id": "aws_default",
+            },
+        )
+        # the cluster outlives the run, managed scaling shrinks it when idle
+        cluster_remover = None
+    else:
+        cluster_finder = EmrCreateJobFlowOperator(
+            task_id=JOB_FLOW_TASK_ID,
+            emr_conn_id="aws_default",
+            job_flow_overrides=JOB_FLOW_OVERRIDES,
+        )
+        cluster_remover = EmrTerminateJobFlowOperator(
+            task_id="remove_cluster",
+            job_flow_id=JOB_FLOW_ID,
+            aws_conn_id="aws_default",
+            trigger_rule="all_done",
+        )
+
+    trace_starter >> cluster_finder
+
+    for table, step in BRONZE_TO_SILVER_STEPS.items():
+        step_adder = EmrAddStepsOperator(
+            task_id=f"add_step_{table}",
+            job_flow_id=JOB_FLOW_ID,
+            aws_conn_id="aws_default",
+            steps=[step],
+        )
+
+        step_checker = EmrRetryStepSensor(
+            task_id=f"watch_step_{table}",
+            job_flow_id=JOB_FLOW_ID,
+            step_id="{{ task_instance.xcom_pull(task_ids='add_step_%s', key='return_value')[0] }}"
+            % table,
+            step=step,
+            step_attempts=STEP_ATTEMPTS,
+            aws_conn_id="aws_default",
+        )
+
+        cluster_finder >> step_adder >> step_checker
+        if cluster_remover:
+            step_checker >> cluster_remover
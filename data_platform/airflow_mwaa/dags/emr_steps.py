@@ -0,0 +1,101 @@
+from airflow.exceptions import AirflowException
+from airflow.contrib.hooks.emr_hook import EmrHook
+from airflow.contrib.sensors.emr_step_sensor import EmrStepSensor
+from airflow.utils.decorators import apply_defaults
+
+
+# downloads the package zip ($0) and runs the module with its arguments ($@)
+PYTHON_STEP_SCRIPT = (
+    'package=$(mktemp --suffix .zip) && aws s3 cp --quiet "$0" "$package" || exit 1; '
+    'PYTHONPATH="$package" python3 -m "$@"; status=$?; rm -f "$package"; exit $status'
+)
+
+
+def python_step(name, module, *module_args, package_path):
+    """
+    Returns an EMR step running a module with python3 on the master node,
+    importing the data_platform package from package_path (a zip on S3).
+    The processing jobs are PyArrow programs that never start a
+    SparkContext, so spark-submit would fail them in cluster mode.
+    """
+    return {
+        "Name": name,
+        "ActionOnFailure": "CONTINUE",
+        "HadoopJarStep": {
+            "Jar": "command-runner.jar",
+            "Args": [
+                "bash",
+                "-c",
+                PYTHON_STEP_SCRIPT,
+                package_path,
+                module,
+                *module_args,
+            ],
+        },
+    }
+
+
+class EmrRetryStepSensor(EmrStepSensor):
+    """
+    Watches an EMR step and resubmits it to the same cluster when it fails,
+    until step_attempts is reached. Other steps on the cluster are left alone,
+    so only the failed table runs again.
+    """
+
+    template_fields = ["job_flow_id", "step_id", "step"]
+
+    @apply_defaults
+    def __init__(self, step, step_attempts=2, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.step = step
+        self.step_attempts = step_attempts
+        self.attempt = 1
+
+    def poke(self, context):
+        response = self.get_emr_response()
+        state = self.state_from_response(response)
+        if state in self.FAILED_STATE and self.attempt < self.step_attempts:
+            self.attempt += 1
+            self.log.info(
+                "Step %s is %s, submitting attempt %s of %s",
+                self.step_id,
+                state,
+                self.attempt,
+                self.step_attempts,
+            )
+            emr = EmrHook(aws_conn_id=self.aws_conn_id).get_conn()
+            self.step_id = emr.add_job_flow_steps(
+                JobFlowId=self.job_flow_id, Steps=[self.step]
+            )["StepIds"][0]
+            return False
+        return super().poke(context)
+
+
+def find_job_flow(cluster_name, cluster_states, aws_conn_id="aws_default"):
+    """
+    Returns the id of the active cluster named cluster_name
+    """
+    job_flow_id = EmrHook(aws_conn_id=aws_conn_id).get_cluster_id_by_name(
+        cluster_name, cluster_states
+    )
+    if job_flow_id is None:
+        raise AirflowException(
+            f"No {cluster_name} cluster in {cluster_states}, "
+            "deploy the EMR stack with EMR_PERSISTENT_CLUSTER=true"
+        )
+    return job_flow_id
+
+
+def terminate_job_flow(
+    context, job_flow_task_id="create_job_flow", aws_conn_id="aws_default"
+):
+    """
+    DAG on_failure_callback terminating the cluster the run created, which
+    would otherwise stay alive (and billed) when the run times out before
+    its remove_cluster task
+    """
+    job_flow_id = context["task_instance"].xcom_pull(task_ids=job_flow_task_id)
+    if job_flow_id:
+        EmrHook(aws_conn_id=aws_conn_id).get_conn().terminate_job_flows(
+            JobFlowIds=[job_flow_id]
+        )
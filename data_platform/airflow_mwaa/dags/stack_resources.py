@@ -0,0 +1,140 @@
+import json
+import os
+import tempfile
+import time
+
+# Resolved resources are shared by every task and DAG parse on a worker
+CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), "stack_resources")
+CACHE_TTL_SECONDS = int(os.environ.get("STACK_RESOURCES_TTL_SECONDS", 3600))
+
+
+class StackResources:
+    """
+    Resolves the physical ids of a CloudFormation stack's resources.
+    Nothing is fetched until a lookup runs, and describe_stack_resources
+    answers are cached on disk for CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self, stack_name, ttl_seconds=CACHE_TTL_SECONDS):
+        self.stack_name = stack_name
+        self.ttl_seconds = ttl_seconds
+        self.cache_path = os.path.join(CACHE_DIRECTORY, f"{stack_name}.json")
+        self._resources = None
+
+    @property
+    def resources(self):
+        if self._resources is None:
+            self._resources = self._read_cache()
+        if self._resources is None:
+            self._resources = self._describe()
+            self._write_cache(self._resources)
+        return self._resources
+
+    def _read_cache(self):
+        try:
+            if time.time() - os.path.getmtime(self.cache_path) > self.ttl_seconds:
+                return None
+            with open(self.cache_path) as cache:
+                return json.load(cache)
+        except (OSError, ValueError):
+            return None
+
+    def _write_cache(self, resources):
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        # write then rename, so concurrent readers never see a partial file
+        descriptor, path = tempfile.mkstemp(dir=CACHE_DIRECTORY)
+        with os.fdopen(descriptor, "w") as cache:
+            json.dump(resources, cache)
+        os.replace(path, self.cache_path)
+
+    def _describe(self):
+        import boto3
+
+        cf = boto3.client("cloudformation")
+        stack = cf.describe_stack_resources(StackName=self.stack_name)
+        return [
+            {
+                "ResourceType": resource["ResourceType"],
+                "LogicalResourceId": resource["LogicalResourceId"],
+                "PhysicalResourceId": resource["PhysicalResourceId"],
+            }
+            for resource in stack["StackResources"]
+        ]
+
+    def invalidate(self):
+        self._resources = None
+        try:
+            os.remove(self.cache_path)
+        except FileNotFoundError:
+            pass
+
+    def find(self, resource_type, logical_id_contains="", physical_id_contains=""):
+        """
+        Returns the physical id of the first matching resource. A miss drops
+        the cached resources and looks again, as the stack may have changed
+        since they were cached.
+        """
+        try:
+            return self._find(resource_type, logical_id_contains, physical_id_contains)
+        except LookupError:
+            self.invalidate()
+            return self._find(resource_type, logical_id_contains, physical_id_contains)
+
+    def _find(self, resource_type, logical_id_contains, physical_id_contains):
+        for resource in self.resources:
+            if (
+                resource["ResourceType"] == resource_type
+                and logical_id_contains in resource["LogicalResourceId"]
+                and physical_id_contains in resource["PhysicalResourceId"]
+            ):
+                return resource["PhysicalResourceId"]
+        raise LookupError(
+            f"No {resource_type} matching {logical_id_contains or physical_id_contains} "
+            f"in {self.stack_name}"
+        )
+
+
+common_stack = StackResources("production-common-stack")
+emr_stack = StackResources("production-emr-stack")
+data_lake_stack = StackResources("production-data-lake-stack")
+
+
+def public_subnet():
+    return common_stack.find("AWS::EC2::Subnet", logical_id_contains="PublicSubnet")
+
+
+def script_bucket():
+    return common_stack.find(
+        "AWS::S3::Bucket", physical_id_contains="script-bucket-production-"
+    )
+
+
+def bronze_bucket():
+    return data_lake_stack.find(
+        "AWS::S3::Bucket", physical_id_contains="datalake-production-bronze-"
+    )
+
+
+def silver_bucket():
+    return data_lake_stack.find(
+        "AWS::S3::Bucket", physical_id_contains="datalake-production-silver-"
+    )
+
+
+def emr_service_role():
+    return emr_stack.find("AWS::IAM::Role", logical_id_contains="emrservicerole")
+
+
+def emr_job_flow_role():
+    return emr_stack.find("AWS::IAM::Role", logical_id_contains="emrjobflowrole")
+
+
+# Jinja macros, so resources are resolved when a task runs, not at DAG parse
+macros = {
+    "public_subnet": public_subnet,
+    "script_bucket": script_bucket,
+    "bronze_bucket": bronze_bucket,
+    "silver_bucket": silver_bucket,
+    "emr_service_role": emr_service_role,
+    "emr_job_flow_role": emr_job_flow_role,
+}
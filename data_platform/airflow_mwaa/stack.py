@@ -45,6 +45,14 @@ class AirflowStack(core.Stack):
                 log_level="WARNING",
             )
         )
+        # task logs carry the spans of data_platform.instrumentation, logged at INFO
+        self.task_logging_configuration = (
+            mwaa.CfnEnvironment.ModuleLoggingConfigurationProperty(
+                cloud_watch_log_group_arn=self.log_group.log_group_arn,
+                enabled=True,
+                log_level="INFO",
+            )
+        )
 
         self.security_group = ec2.SecurityGroup(
             self,
@@ -175,9 +183,22 @@ class AirflowStack(core.Stack):
                 "data_platform/airflow_mwaa/requirements.txt", arcname="requirements.txt"
             )
             for file in os.listdir("data_platform/airflow_mwaa/dags"):
+                if not file.endswith(".py"):
+                    continue
                 zipObj2.write(
                     f"data_platform/airflow_mwaa/dags/{file}", arcname=f"dags/{file}"
                 )
+            # table definitions shared with the DAGs, importable as data_platform.*
+            for file in [
+                "__init__.py",
+                "definitions.py",
+                "data_definitions.py",
+                "emr/spark_profile.py",
+                "instrumentation.py",
+            ]:
+                zipObj2.write(
+                    f"data_platform/{file}", arcname=f"dags/data_platform/{file}"
+                )
 
         self.deploy_files = s3deploy.BucketDeployment(
             self,
@@ -197,7 +218,7 @@ class AirflowStack(core.Stack):
             logging_configuration=mwaa.CfnEnvironment.LoggingConfigurationProperty(
                 dag_processing_logs=self.logging_configuration,
                 scheduler_logs=self.logging_configuration,
-                task_logs=self.logging_configuration,
+                task_logs=self.task_logging_configuration,
                 webserver_logs=self.logging_configuration,
                 worker_logs=self.logging_configuration,
             ),
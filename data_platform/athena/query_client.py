@@ -0,0 +1,353 @@
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import re
+import sqlite3
+import uuid
+from typing import NamedTuple
+from urllib.parse import urlparse
+
+from data_platform.glue_catalog.partition_registrar import DATA_VERSION_PARAMETER
+
+# quoted literals and identifiers are kept as they are when normalizing
+QUOTED_PATTERN = re.compile(r"('(?:[^']|'')*'|\"[^\"]*\")")
+COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+# a table reference: a bare or double quoted identifier, optionally schema qualified
+IDENTIFIER = r'(?:"[^"]+"|\w+)'
+TABLE_PATTERN = re.compile(
+    rf"\b(?:from|join)\s+({IDENTIFIER})(?:\s*\.\s*({IDENTIFIER}))?", re.IGNORECASE
+)
+# functions whose arguments use the FROM keyword, and IS [NOT] DISTINCT FROM
+FROM_FUNCTION_PATTERN = re.compile(
+    r"\b(?:extract|substring|trim|overlay|position)\s*\(", re.IGNORECASE
+)
+DISTINCT_FROM_PATTERN = re.compile(r"\bdistinct\s+from\b", re.IGNORECASE)
+RUNNING_STATES = ("QUEUED", "RUNNING")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Returns a canonical form of a query, so queries that only differ in
+    case, whitespace, comments or a trailing semicolon share a cache entry
+    """
+    parts = QUOTED_PATTERN.split(COMMENT_PATTERN.sub(" ", sql))
+    normalized = "".join(
+        part if index % 2 else re.sub(r"\s+", " ", part.lower())
+        for index, part in enumerate(parts)
+    )
+    return normalized.strip().rstrip(";").strip()
+
+
+def strip_from_functions(sql: str) -> str:
+    """
+    Removes the calls whose arguments use FROM, like extract(year from x),
+    so their arguments aren't read as tables
+    """
+    while True:
+        match = FROM_FUNCTION_PATTERN.search(sql)
+        if not match:
+            return sql
+        depth = 0
+        for end in range(match.end() - 1, len(sql)):
+            depth += {"(": 1, ")": -1}.get(sql[end], 0)
+            if depth == 0:
+                break
+        sql = sql[: match.start()] + " " + sql[end + 1 :]
+
+
+def unquote(identifier: str) -> str:
+    return identifier.strip('"').lower()
+
+
+def referenced_tables(sql: str, database: str) -> list:
+    """
+    Returns the (database, table) pairs a query reads. String literals and
+    comments are ignored, quoted identifiers are read without their quotes.
+    """
+    sql = LITERAL_PATTERN.sub("''", COMMENT_PATTERN.sub(" ", sql))
+    sql = DISTINCT_FROM_PATTERN.sub("distinct", strip_from_functions(sql))
+    return sorted(
+        {
+            (unquote(first), unquote(second)) if second else (database, unquote(first))
+            for first, second in TABLE_PATTERN.findall(sql)
+        }
+    )
+
+
+def split_s3_uri(uri: str) -> tuple:
+    parsed = urlparse(uri)
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+class QueryResult(NamedTuple):
+    query_execution_id: str
+    output_location: str
+    bytes_scanned: int
+    cached: bool
+
+
+class AthenaQueryClient:
+    """
+    Runs Athena queries, reusing the results of previous runs.
+    A query is cached under the hash of its normalized text and of the
+    data_version of every table it reads, so it runs again as soon as one
+    of its tables gets new data. The cache index lives next to the results,
+    in the workgroup's results bucket.
+    """
+
+    def __init__(
+        self,
+        athena,
+        glue,
+        s3,
+        workgroup: str,
+        database: str,
+        results_bucket: str,
+        cache_prefix: str = "query-cache",
+        poll_seconds: float = 1.0,
+        max_concurrency: int = 5,
+    ):
+        self.athena = athena
+        self.glue = glue
+        self.s3 = s3
+        self.workgroup = workgroup
+        self.database = database
+        self.results_bucket = results_bucket
+        self.cache_prefix = cache_prefix
+        self.poll_seconds = poll_seconds
+        self.max_concurrency = max_concurrency
+        self.stats = {
+            "queries": 0,
+            "executions": 0,
+            "cache_hits": 0,
+            "bytes_scanned": 0,
+            "bytes_avoided": 0,
+        }
+
+    def table_version(self, database: str, table_name: str):
+        """
+        Returns the data_version of a catalog table, None when the table has
+        none (its UpdateTime doesn't change with its data), and an empty
+        string for names that aren't catalog tables
+        """
+        try:
+            table = self.glue.get_table(DatabaseName=database, Name=table_name)
+        except Exception as error:
+            # common table expressions and the like aren't catalog tables
+            if type(error).__name__ != "EntityNotFoundException":
+                raise
+            return ""
+        return table["Table"].get("Parameters", {}).get(DATA_VERSION_PARAMETER)
+
+    def cache_key(self, sql: str) -> str:
+        """
+        Returns None for queries that read no catalog table, or a table
+        without a data_version: their cached result could never be invalidated
+        """
+        normalized = normalize_sql(sql)
+        versions = {
+            f"{database}.{table}": self.table_version(database, table)
+            for database, table in referenced_tables(normalized, self.database)
+        }
+        if None in versions.values() or not any(versions.values()):
+            return None
+        versions = [f"{table}={version}" for table, version in versions.items()]
+        return hashlib.sha256(
+            "\n".join([self.workgroup, normalized, *versions]).encode()
+        ).hexdigest()
+
+    def read_cache(self, key: str):
+        """
+        Returns the cached result of a key, if its output still exists
+        (the results bucket expires objects)
+        """
+        try:
+            entry = json.loads(
+                self.s3.get_object(
+                    Bucket=self.results_bucket, Key=f"{self.cache_prefix}/{key}.json"
+                )["Body"].read()
+            )
+            bucket, output_key = split_s3_uri(entry["output_location"])
+            self.s3.head_object(Bucket=bucket, Key=output_key)
+        except Exception as error:
+            if type(error).__name__ not in ("NoSuchKey", "ClientError"):
+                raise
+            return None
+        return entry
+
+    def write_cache(self, key: str, result: QueryResult) -> None:
+        self.s3.put_object(
+            Bucket=self.results_bucket,
+            Key=f"{self.cache_prefix}/{key}.json",
+            Body=json.dumps(result._asdict()).encode(),
+        )
+
+    def execute(self, sql: str) -> str:
+        return self.athena.start_query_execution(
+            QueryString=sql,
+            QueryExecutionContext={"Database": self.database},
+            WorkGroup=self.workgroup,
+        )["QueryExecutionId"]
+
+    async def wait(self, query_execution_id: str) -> dict:
+        loop = asyncio.get_event_loop()
+        while True:
+            execution = (
+                await loop.run_in_executor(
+                    None,
+                    lambda: self.athena.get_query_execution(
+                        QueryExecutionId=query_execution_id
+                    ),
+                )
+            )["QueryExecution"]
+            state = execution["Status"]["State"]
+            if state not in RUNNING_STATES:
+                break
+            await asyncio.sleep(self.poll_seconds)
+        if state != "SUCCEEDED":
+            raise RuntimeError(
+                f"Query {query_execution_id} {state}: "
+                f"{execution['Status'].get('StateChangeReason', '')}"
+            )
+        return execution
+
+    async def query(self, sql: str) -> QueryResult:
+        """
+        Returns the result of a query, from the cache when its tables
+        haven't changed since it last ran
+        """
+        loop = asyncio.get_event_loop()
+        self.stats["queries"] += 1
+        key = await loop.run_in_executor(None, self.cache_key, sql)
+        entry = None
+        if key:
+            entry = await loop.run_in_executor(None, self.read_cache, key)
+        if entry:
+            self.stats["cache_hits"] += 1
+            self.stats["bytes_avoided"] += entry["bytes_scanned"]
+            return QueryResult(**dict(entry, cached=True))
+
+        query_execution_id = await loop.run_in_executor(None, self.execute, sql)
+        execution = await self.wait(query_execution_id)
+        result = QueryResult(
+            query_execution_id=query_execution_id,
+            output_location=execution["ResultConfiguration"]["OutputLocation"],
+            bytes_scanned=execution["Statistics"]["DataScannedInBytes"],
+            cached=False,
+        )
+        self.stats["executions"] += 1
+        self.stats["bytes_scanned"] += result.bytes_scanned
+        if key:
+            await loop.run_in_executor(None, self.write_cache, key, result)
+        return result
+
+    async def query_many(self, queries: list) -> list:
+        """
+        Runs independent queries concurrently, at most max_concurrency at once
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run(sql):
+            async with semaphore:
+                return await self.query(sql)
+
+        return await asyncio.gather(*(run(sql) for sql in queries))
+
+    def read_result(self, result: QueryResult) -> list:
+        """
+        Returns the rows of a result as dicts
+        """
+        bucket, key = split_s3_uri(result.output_location)
+        body = self.s3.get_object(Bucket=bucket, Key=key)["Body"].read().decode()
+        return list(csv.DictReader(io.StringIO(body)))
+
+
+class NoSuchKey(Exception):
+    """
+    Raised by the local S3, named like the S3 client's exception
+    """
+
+
+class LocalS3:
+    """
+    In memory stand-in for the S3 client calls the query client makes
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes) -> dict:
+        self.objects[Bucket, Key] = Body
+        return {}
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        if (Bucket, Key) not in self.objects:
+            raise NoSuchKey(f"s3://{Bucket}/{Key}")
+        return {"Body": io.BytesIO(self.objects[Bucket, Key])}
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        self.get_object(Bucket=Bucket, Key=Key)
+        return {"ContentLength": len(self.objects[Bucket, Key])}
+
+
+class LocalAthena:
+    """
+    Stand-in for the Athena client calls the query client makes. Queries run
+    on sqlite and finish at once, and the bytes scanned are the CSV size of
+    the tables a query reads, as Athena scans whole unpartitioned tables.
+    """
+
+    def __init__(self, s3: LocalS3, results_bucket: str):
+        self.s3 = s3
+        self.results_bucket = results_bucket
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.table_bytes = {}
+        self.executions = {}
+
+    def create_table(self, name: str, rows: list) -> None:
+        columns = list(rows[0])
+        self.connection.execute(f"CREATE TABLE {name} ({', '.join(columns)})")
+        self.connection.executemany(
+            f"INSERT INTO {name} VALUES ({', '.join('?' for _ in columns)})",
+            [[row[column] for column in columns] for row in rows],
+        )
+        output = io.StringIO()
+        csv.writer(output).writerows([row.values() for row in rows])
+        self.table_bytes[name] = len(output.getvalue().encode())
+
+    def start_query_execution(
+        self, QueryString: str, QueryExecutionContext: dict, WorkGroup: str
+    ) -> dict:
+        query_execution_id = str(uuid.uuid4())
+        cursor = self.connection.execute(QueryString)
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow([column[0] for column in cursor.description])
+        writer.writerows(cursor.fetchall())
+        self.s3.put_object(
+            Bucket=self.results_bucket,
+            Key=f"{query_execution_id}.csv",
+            Body=output.getvalue().encode(),
+        )
+        tables = referenced_tables(
+            normalize_sql(QueryString), QueryExecutionContext["Database"]
+        )
+        self.executions[query_execution_id] = {
+            "QueryExecutionId": query_execution_id,
+            "Status": {"State": "SUCCEEDED"},
+            "ResultConfiguration": {
+                "OutputLocation": f"s3://{self.results_bucket}/{query_execution_id}.csv"
+            },
+            "Statistics": {
+                "DataScannedInBytes": sum(
+                    self.table_bytes.get(table, 0) for _, table in tables
+                )
+            },
+        }
+        return {"QueryExecutionId": query_execution_id}
+
+    def get_query_execution(self, QueryExecutionId: str) -> dict:
+        return {"QueryExecution": self.executions[QueryExecutionId]}
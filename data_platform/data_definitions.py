@@ -1,176 +1,398 @@
+from typing import NamedTuple, Optional
+
 from data_platform.definitions import db_name
 
-# SQL STATEMENTS TO CREATE TABLES
-geolocation = f"""
-CREATE TABLE IF NOT EXISTS {db_name}.geolocation (
-    geolocation_zip_code_prefix   VARCHAR,
-    geolocation_lat FLOAT,
-    geolocation_lng FLOAT,
-    geolocation_city  VARCHAR,
-    geolocation_state   VARCHAR
-);
-"""
-
-product_category_name_translation = f"""
-CREATE TABLE IF NOT EXISTS {db_name}.product_category_name_translation (
-    product_category_name  VARCHAR,
-    product_category_name_english  VARCHAR,
-    PRIMARY KEY (product_category_name)
-);
-"""
-
-products = f"""
-CREATE TABLE IF NOT EXISTS ecommerce.products (
-    product_id UUID,
-    product_category_name  VARCHAR,
-    product_name_length FLOAT,
-    product_description_length FLOAT,
-    product_photos_qty FLOAT,
-    product_weight_g FLOAT,
-    product_length_cm FLOAT,
-    product_height_cm FLOAT,
-    product_width_cm FLOAT,
-    PRIMARY KEY (product_id),
-    FOREIGN KEY (product_category_name) REFERENCES ecommerce.product_category_name_translation (product_category_name)
-);
-"""
-
-sellers = f"""
-CREATE TABLE IF NOT EXISTS {db_name}.sellers (
-    seller_id UUID,
-    seller_zip_code_prefix   VARCHAR,
-    seller_city  VARCHAR,
-    seller_state   VARCHAR,
-    PRIMARY KEY (seller_id)
-);
-"""
-
-customers = f"""
-CREATE TABLE IF NOT EXISTS {db_name}.customers (
-    customer_id UUID,
-    customer_unique_id UUID,
-    customer_zip_code_prefix   VARCHAR,
-    customer_city  VARCHAR,
-    customer_state   VARCHAR,
-    PRIMARY KEY (customer_id)
-);
-"""
-
-orders = f"""
-CREATE TABLE IF NOT EXISTS {db_name}.orders (
-    order_id UUID,
-    customer_id UUID,
-    order_status  VARCHAR,
-    order_purchase_timestamp DATE,
-    order_approved_at DATE,
-    order_delivered_carrier_date DATE,
-    order_delivered_customer_date DATE,
-    order_estimated_delivery_date DATE,
-    PRIMARY KEY (order_id),
-    FOREIGN KEY (customer_id) REFERENCES {db_name}.customers (customer_id)
-);
-"""
-
-order_reviews = f"""
-CREATE TABLE IF NOT EXISTS {db_name}.order_reviews (
-    review_id UUID,
-    order_id UUID,
-    review_score INT,
-    review_comment_title  VARCHAR,
-    review_comment_message  VARCHAR,
-    review_creation_date DATE,
-    review_answer_timestamp DATE,
-    PRIMARY KEY (review_id),
-    FOREIGN KEY (order_id) REFERENCES {db_name}.orders (order_id)
-);
-"""
-
-order_items = f"""
-CREATE TABLE IF NOT EXISTS ecommerce.order_items (
-    order_id UUID,
-    order_item_qty INT,
-    product_id UUID,
-    seller_id UUID,
-    shipping_limit_date DATE,
-    price FLOAT(2),
-    freight_value FLOAT(2),
-    FOREIGN KEY (order_id) REFERENCES ecommerce.orders (order_id),
-    FOREIGN KEY (product_id) REFERENCES ecommerce.products (product_id),
-    FOREIGN KEY (seller_id) REFERENCES ecommerce.sellers (seller_id)
-);
-"""
-
-order_payments = f"""
-CREATE TABLE IF NOT EXISTS {db_name}.order_payments (
-    order_id UUID,
-    payment_sequential INT,
-    payment_type  VARCHAR,
-    payment_installments INT,
-    payment_value FLOAT(2),
-    FOREIGN KEY (order_id) REFERENCES {db_name}.orders (order_id)
-);
-"""
-
-sql_list = [
-    geolocation,
-    product_category_name_translation,
-    products,
-    sellers,
-    customers,
-    orders,
-    order_reviews,
-    order_items,
-    order_payments,
-]
-
-# DATA URLs (Public S3)
-product_category_name_url = "https://ecommerce-olist-datasets.s3.amazonaws.com/product_category_name_translation.csv"
-customers_url = (
-    "https://ecommerce-olist-datasets.s3.amazonaws.com/olist_customers_dataset.csv"
-)
-geolocation_url = (
-    "https://ecommerce-olist-datasets.s3.amazonaws.com/olist_geolocation_dataset.csv"
-)
-order_items_url = (
-    "https://ecommerce-olist-datasets.s3.amazonaws.com/olist_order_items_dataset.csv"
-)
-order_payments_url = (
-    "https://ecommerce-olist-datasets.s3.amazonaws.com/olist_order_payments_dataset.csv"
-)
-order_reviews_url = (
-    "https://ecommerce-olist-datasets.s3.amazonaws.com/olist_order_reviews_dataset.csv"
-)
-orders_url = (
-    "https://ecommerce-olist-datasets.s3.amazonaws.com/olist_orders_dataset.csv"
-)
-products_url = (
-    "https://ecommerce-olist-datasets.s3.amazonaws.com/olist_products_dataset.csv"
-)
-sellers_url = (
-    "https://ecommerce-olist-datasets.s3.amazonaws.com/olist_sellers_dataset.csv"
-)
-
-url_list = [
-    geolocation_url,
-    product_category_name_url,
-    products_url,
-    sellers_url,
-    customers_url,
-    orders_url,
-    order_reviews_url,
-    order_items_url,
-    order_payments_url,
-]
-
-# TABLE NAMES list
-table_names_list = [
-    f"{db_name}.geolocation",
-    f"{db_name}.product_category_name_translation",
-    f"{db_name}.products",
-    f"{db_name}.sellers",
-    f"{db_name}.customers",
-    f"{db_name}.orders",
-    f"{db_name}.order_reviews",
-    f"{db_name}.order_items",
-    f"{db_name}.order_payments",
-]
+# TABLE SCHEMA REGISTRY
+# The single description of the replicated tables. The RDS DDL, the lake's
+# Arrow schemas, the Glue tables, the Redshift tables and the load order are
+# all generated from it. Kept free of heavy imports: it ships to MWAA.
+
+
+class ColumnType(NamedTuple):
+    """
+    How a logical column type is stored by each engine. arrow is the pyarrow
+    type factory and its arguments, so pyarrow is only imported when used.
+    """
+
+    postgres: str
+    arrow: tuple
+    glue: str
+    redshift: str
+
+
+COLUMN_TYPES = {
+    "uuid": ColumnType("UUID", ("string",), "string", "varchar(36)"),
+    "string": ColumnType("VARCHAR", ("string",), "string", "varchar(65535)"),
+    "int": ColumnType("INT", ("int32",), "int", "integer"),
+    "double": ColumnType("FLOAT", ("float64",), "double", "double precision"),
+    "date": ColumnType("DATE", ("date32",), "date", "date"),
+    "timestamp": ColumnType("TIMESTAMP", ("timestamp", "us"), "timestamp", "timestamp"),
+}
+
+
+class Column(NamedTuple):
+    name: str
+    type: str
+    # RDS type, where the source database stores the column differently
+    postgres_type: Optional[str] = None
+    # not a column of the source database: derived in silver or added by DMS
+    derived: bool = False
+    # constraints the silver rows are validated against (primary key columns
+    # are never null); rows breaking them are quarantined
+    nullable: bool = True
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
+
+    @property
+    def column_type(self) -> ColumnType:
+        return COLUMN_TYPES[self.type]
+
+    @property
+    def postgres(self) -> str:
+        return self.postgres_type or self.column_type.postgres
+
+    def arrow_type(self):
+        import pyarrow as pa
+
+        factory, *arguments = self.column_type.arrow
+        return getattr(pa, factory)(*arguments)
+
+
+class ForeignKey(NamedTuple):
+    columns: tuple
+    table: str
+    referenced_columns: tuple
+
+
+# DMS timestamp column (timestampColumnName), kept in silver for incremental models
+EXTRACTED_AT = Column("extracted_at", "timestamp", derived=True)
+
+
+class TableSchema(NamedTuple):
+    """
+    A replicated table: its columns, keys, source dataset and how the lake
+    partitions and sorts it. Columns are listed in storage order, derived
+    columns after the source ones.
+    """
+
+    name: str
+    columns: tuple
+    url: str
+    primary_key: tuple = ()
+    foreign_keys: tuple = ()
+    # date column of the silver directories
+    partition_column: Optional[str] = None
+    # sort key of the native Redshift table
+    sort_column: Optional[str] = None
+
+    @property
+    def qualified_name(self) -> str:
+        return f"{db_name}.{self.name}"
+
+    @property
+    def source_columns(self) -> tuple:
+        return tuple(column for column in self.columns if not column.derived)
+
+    @property
+    def lake_columns(self) -> tuple:
+        return self.columns + (EXTRACTED_AT,)
+
+    @property
+    def not_null_columns(self) -> tuple:
+        return tuple(
+            column
+            for column in self.lake_columns
+            if not column.nullable or column.name in self.primary_key
+        )
+
+    def column(self, name: str) -> Column:
+        for column in self.lake_columns:
+            if column.name == name:
+                return column
+        raise KeyError(f"{self.name} has no column {name}")
+
+    def postgres_ddl(self, constraints: bool = True) -> str:
+        """
+        CREATE TABLE of the source table, optionally without its keys so they
+        can be built after a bulk load
+        """
+        lines = [f"{column.name} {column.postgres}" for column in self.source_columns]
+        if constraints and self.primary_key:
+            lines.append(f"PRIMARY KEY ({', '.join(self.primary_key)})")
+        if constraints:
+            lines.extend(
+                f"FOREIGN KEY ({', '.join(foreign_key.columns)}) "
+                f"REFERENCES {db_name}.{foreign_key.table} "
+                f"({', '.join(foreign_key.referenced_columns)})"
+                for foreign_key in self.foreign_keys
+            )
+        body = ",\n    ".join(lines)
+        return f"\nCREATE TABLE IF NOT EXISTS {self.qualified_name} (\n    {body}\n);\n"
+
+    def arrow_schema(self):
+        """
+        Schema the lake writer types silver files with
+        """
+        import pyarrow as pa
+
+        return pa.schema(
+            [(column.name, column.arrow_type()) for column in self.lake_columns]
+        )
+
+    def glue_columns(self) -> dict:
+        """
+        {column: glue type} of the silver table, partition column included
+        """
+        return {column.name: column.column_type.glue for column in self.lake_columns}
+
+    def redshift_ddl(self, table_name: str, exclude: tuple = ()) -> str:
+        """
+        CREATE TABLE of the lake columns as a native Redshift table, without
+        the excluded columns
+        """
+        columns = [column for column in self.lake_columns if column.name not in exclude]
+        definitions = ", ".join(
+            f"{column.name} {column.column_type.redshift}" for column in columns
+        )
+        ddl = f"create table if not exists {table_name} ({definitions})"
+        if self.sort_column and self.sort_column not in exclude:
+            ddl += f" sortkey ({self.sort_column})"
+        return ddl
+
+
+def load_order(tables: list) -> list:
+    """
+    Sorts tables so every table comes after the tables it references
+    """
+    remaining = {table.name: table for table in tables}
+    ordered = []
+    while remaining:
+        ready = [
+            table
+            for table in remaining.values()
+            if all(
+                foreign_key.table not in remaining or foreign_key.table == table.name
+                for foreign_key in table.foreign_keys
+            )
+        ]
+        if not ready:
+            raise ValueError(f"Circular foreign keys between tables: {list(remaining)}")
+        for table in ready:
+            ordered.append(remaining.pop(table.name))
+    return ordered
+
+
+DATASETS_URL = "https://ecommerce-olist-datasets.s3.amazonaws.com"
+
+TABLES = {
+    table.name: table
+    for table in load_order(
+        [
+            TableSchema(
+                name="geolocation",
+                columns=(
+                    Column("geolocation_zip_code_prefix", "string"),
+                    Column("geolocation_lat", "double", min_value=-90, max_value=90),
+                    Column("geolocation_lng", "double", min_value=-180, max_value=180),
+                    Column("geolocation_city", "string"),
+                    Column("geolocation_state", "string"),
+                    Column("geolocation_zip_code_prefix_1", "string", derived=True),
+                    Column("geolocation_zip_code_prefix_2", "string", derived=True),
+                    Column("geolocation_zip_code_prefix_3", "string", derived=True),
+                    Column("geolocation_zip_code_prefix_4", "string", derived=True),
+                ),
+                url=f"{DATASETS_URL}/olist_geolocation_dataset.csv",
+                sort_column="geolocation_zip_code_prefix",
+            ),
+            TableSchema(
+                name="product_category_name_translation",
+                columns=(
+                    Column("product_category_name", "string"),
+                    Column("product_category_name_english", "string"),
+                ),
+                url=f"{DATASETS_URL}/product_category_name_translation.csv",
+                primary_key=("product_category_name",),
+                sort_column="product_category_name",
+            ),
+            TableSchema(
+                name="products",
+                columns=(
+                    Column("product_id", "uuid"),
+                    Column("product_category_name", "string"),
+                    Column(
+                        "product_name_length", "int", postgres_type="FLOAT", min_value=0
+                    ),
+                    Column(
+                        "product_description_length",
+                        "int",
+                        postgres_type="FLOAT",
+                        min_value=0,
+                    ),
+                    Column(
+                        "product_photos_qty", "int", postgres_type="FLOAT", min_value=0
+                    ),
+                    Column("product_weight_g", "double", min_value=0),
+                    Column("product_length_cm", "double", min_value=0),
+                    Column("product_height_cm", "double", min_value=0),
+                    Column("product_width_cm", "double", min_value=0),
+                ),
+                url=f"{DATASETS_URL}/olist_products_dataset.csv",
+                primary_key=("product_id",),
+                foreign_keys=(
+                    ForeignKey(
+                        ("product_category_name",),
+                        "product_category_name_translation",
+                        ("product_category_name",),
+                    ),
+                ),
+                sort_column="product_id",
+            ),
+            TableSchema(
+                name="sellers",
+                columns=(
+                    Column("seller_id", "uuid"),
+                    Column("seller_zip_code_prefix", "string"),
+                    Column("seller_city", "string"),
+                    Column("seller_state", "string"),
+                ),
+                url=f"{DATASETS_URL}/olist_sellers_dataset.csv",
+                primary_key=("seller_id",),
+                sort_column="seller_id",
+            ),
+            TableSchema(
+                name="customers",
+                columns=(
+                    Column("customer_id", "uuid"),
+                    Column("customer_unique_id", "uuid"),
+                    Column("customer_zip_code_prefix", "string"),
+                    Column("customer_city", "string"),
+                    Column("customer_state", "string"),
+                ),
+                url=f"{DATASETS_URL}/olist_customers_dataset.csv",
+                primary_key=("customer_id",),
+                sort_column="customer_id",
+            ),
+            TableSchema(
+                name="orders",
+                columns=(
+                    Column("order_id", "uuid"),
+                    Column("customer_id", "uuid", nullable=False),
+                    Column("order_status", "string"),
+                    Column(
+                        "order_purchase_timestamp", "timestamp", postgres_type="DATE"
+                    ),
+                    Column("order_approved_at", "timestamp", postgres_type="DATE"),
+                    Column(
+                        "order_delivered_carrier_date",
+                        "timestamp",
+                        postgres_type="DATE",
+                    ),
+                    Column(
+                        "order_delivered_customer_date",
+                        "timestamp",
+                        postgres_type="DATE",
+                    ),
+                    Column(
+                        "order_estimated_delivery_date",
+                        "timestamp",
+                        postgres_type="DATE",
+                    ),
+                    Column("order_purchase_date", "date", derived=True),
+                ),
+                url=f"{DATASETS_URL}/olist_orders_dataset.csv",
+                primary_key=("order_id",),
+                foreign_keys=(
+                    ForeignKey(("customer_id",), "customers", ("customer_id",)),
+                ),
+                partition_column="order_purchase_date",
+                sort_column="order_purchase_date",
+            ),
+            TableSchema(
+                name="order_reviews",
+                columns=(
+                    Column("review_id", "uuid"),
+                    Column("order_id", "uuid"),
+                    Column("review_score", "int", min_value=1, max_value=5),
+                    Column("review_comment_title", "string"),
+                    Column("review_comment_message", "string"),
+                    Column("review_creation_date", "date"),
+                    Column(
+                        "review_answer_timestamp", "timestamp", postgres_type="DATE"
+                    ),
+                ),
+                url=f"{DATASETS_URL}/olist_order_reviews_dataset.csv",
+                primary_key=("review_id",),
+                foreign_keys=(ForeignKey(("order_id",), "orders", ("order_id",)),),
+                partition_column="review_creation_date",
+                sort_column="review_creation_date",
+            ),
+            TableSchema(
+                name="order_items",
+                columns=(
+                    Column("order_id", "uuid", nullable=False),
+                    Column("order_item_qty", "int", min_value=1),
+                    Column("product_id", "uuid", nullable=False),
+                    Column("seller_id", "uuid", nullable=False),
+                    Column("shipping_limit_date", "date"),
+                    Column("price", "double", postgres_type="FLOAT(2)", min_value=0),
+                    Column(
+                        "freight_value", "double", postgres_type="FLOAT(2)", min_value=0
+                    ),
+                    Column("order_item_id", "string", derived=True, nullable=False),
+                ),
+                url=f"{DATASETS_URL}/olist_order_items_dataset.csv",
+                foreign_keys=(
+                    ForeignKey(("order_id",), "orders", ("order_id",)),
+                    ForeignKey(("product_id",), "products", ("product_id",)),
+                    ForeignKey(("seller_id",), "sellers", ("seller_id",)),
+                ),
+                partition_column="shipping_limit_date",
+                sort_column="shipping_limit_date",
+            ),
+            TableSchema(
+                name="order_payments",
+                columns=(
+                    Column("order_id", "uuid", nullable=False),
+                    Column("payment_sequential", "int", min_value=1),
+                    Column("payment_type", "string"),
+                    Column("payment_installments", "int", min_value=0),
+                    Column(
+                        "payment_value", "double", postgres_type="FLOAT(2)", min_value=0
+                    ),
+                ),
+                url=f"{DATASETS_URL}/olist_order_payments_dataset.csv",
+                foreign_keys=(ForeignKey(("order_id",), "orders", ("order_id",)),),
+                sort_column="order_id",
+            ),
+        ]
+    )
+}
+
+# LISTS OF THE REGISTRY, in load order
+table_names_list = [table.qualified_name for table in TABLES.values()]
+sql_list = [table.postgres_ddl() for table in TABLES.values()]
+url_list = [table.url for table in TABLES.values()]
+
+# maps each table to its primary key columns (empty when the table has none)
+primary_keys = {
+    table.qualified_name: list(table.primary_key) for table in TABLES.values()
+}
+
+# maps each table to its (columns, referenced table, referenced columns) foreign keys
+foreign_keys = {
+    table.qualified_name: [
+        (
+            list(foreign_key.columns),
+            f"{db_name}.{foreign_key.table}",
+            list(foreign_key.referenced_columns),
+        )
+        for foreign_key in table.foreign_keys
+    ]
+    for table in TABLES.values()
+}
+
+# maps each table to the tables it references, so that loads can respect dependencies
+table_dependencies = {
+    table_name: sorted({referenced for _, referenced, _ in references})
+    for table_name, references in foreign_keys.items()
+}
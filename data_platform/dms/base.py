@@ -1,4 +1,5 @@
 import json
+from typing import NamedTuple, Optional
 from aws_cdk import core
 from aws_cdk import aws_iam as iam, aws_dms as dms, aws_ec2 as ec2
 from data_platform.data_lake.base import BaseDataLakeBucket
@@ -6,6 +7,19 @@ from data_platform.common_stack import CommonResourcesStack
 from data_platform.rds.stack import RDSStack
 from data_platform.active_environment import active_environment
 from data_platform.definitions import db_password, db_username, db_name
+from data_platform.replication_definitions import (
+    MAX_FULL_LOAD_SUBTASKS,
+    FULL_LOAD_COMMIT_RATE,
+    CDC_MAX_BATCH_INTERVAL_SECONDS,
+    CHANGE_PROCESSING_MEMORY_MB,
+    table_load_settings,
+)
+from data_platform.dms.identifiers import (
+    replication_task_identifier,
+    source_endpoint_identifier,
+    target_endpoint_identifier,
+    replication_instance_identifier,
+)
 
 
 class RawDMSRole(iam.Role):
@@ -64,23 +78,139 @@ class RawDMSRole(iam.Role):
         return policy
 
 
+# date folder layouts that sort chronologically, which the CDC merge relies on
+DATE_PARTITION_SEQUENCES = ("YYYYMMDD", "YYYYMMDDHH", "YYYYMM")
+PARQUET_VERSIONS = ("PARQUET_1_0", "PARQUET_2_0")
+COMPRESSION_TYPES = ("GZIP", "NONE")
+ENCODING_TYPES = ("RLE_DICTIONARY", "PLAIN", "PLAIN_DICTIONARY")
+
+
+class S3TargetSettings(NamedTuple):
+    """
+    How DMS writes the bronze files. Parquet settings only apply to the
+    parquet format and csv settings to csv. Date partitioning writes each
+    day's CDC files to <table>/YYYY/MM/DD/, so readers list only new days.
+    """
+
+    data_format: str = "parquet"
+    parquet_version: Optional[str] = "PARQUET_2_0"
+    compression_type: str = "GZIP"
+    encoding_type: Optional[str] = "RLE_DICTIONARY"
+    # large enough for the UUID columns to stay dictionary encoded
+    dict_page_size_limit: Optional[int] = 3 * 1024 * 1024
+    row_group_length: Optional[int] = 100_000
+    enable_statistics: Optional[bool] = True
+    csv_delimiter: Optional[str] = None
+    csv_row_delimiter: Optional[str] = None
+    date_partition_enabled: bool = True
+    date_partition_sequence: Optional[str] = "YYYYMMDD"
+    date_partition_delimiter: Optional[str] = "SLASH"
+    max_file_size_kb: int = 131072
+    cdc_max_batch_interval: int = CDC_MAX_BATCH_INTERVAL_SECONDS
+    timestamp_column_name: str = "extracted_at"
+    include_op_for_full_load: bool = True
+
+    def validate(self) -> None:
+        """
+        Fails the synth on settings that contradict each other, which DMS
+        would silently ignore or reject when the task runs
+        """
+        parquet_settings = {
+            "parquet_version": self.parquet_version,
+            "encoding_type": self.encoding_type,
+            "dict_page_size_limit": self.dict_page_size_limit,
+            "row_group_length": self.row_group_length,
+            "enable_statistics": self.enable_statistics,
+        }
+        csv_settings = {
+            "csv_delimiter": self.csv_delimiter,
+            "csv_row_delimiter": self.csv_row_delimiter,
+        }
+        if self.data_format not in ("parquet", "csv"):
+            raise ValueError(f"Unknown DMS data format {self.data_format}")
+        if self.data_format == "parquet":
+            ignored = [name for name, value in csv_settings.items() if value]
+        else:
+            ignored = [
+                name for name, value in parquet_settings.items() if value is not None
+            ]
+        if ignored:
+            raise ValueError(
+                f"{', '.join(ignored)} don't apply to {self.data_format} files"
+            )
+        if self.parquet_version and self.parquet_version not in PARQUET_VERSIONS:
+            raise ValueError(f"parquet_version must be one of {PARQUET_VERSIONS}")
+        if self.compression_type not in COMPRESSION_TYPES:
+            raise ValueError(f"compression_type must be one of {COMPRESSION_TYPES}")
+        if self.encoding_type and self.encoding_type not in ENCODING_TYPES:
+            raise ValueError(f"encoding_type must be one of {ENCODING_TYPES}")
+        if self.dict_page_size_limit and self.encoding_type == "PLAIN":
+            raise ValueError("dict_page_size_limit needs a dictionary encoding")
+        for name in ("dict_page_size_limit", "row_group_length", "max_file_size_kb"):
+            if getattr(self, name) is not None and getattr(self, name) <= 0:
+                raise ValueError(f"{name} must be positive")
+        if self.date_partition_enabled:
+            if self.date_partition_sequence not in DATE_PARTITION_SEQUENCES:
+                raise ValueError(
+                    f"date_partition_sequence must be one of "
+                    f"{DATE_PARTITION_SEQUENCES}, so date folders sort by date"
+                )
+            if self.date_partition_delimiter != "SLASH":
+                raise ValueError("Date partitions must be folders (SLASH delimiter)")
+        elif self.date_partition_sequence or self.date_partition_delimiter:
+            raise ValueError(
+                "date_partition_sequence and date_partition_delimiter "
+                "need date_partition_enabled"
+            )
+        if not 0 < self.cdc_max_batch_interval <= 3600:
+            raise ValueError("cdc_max_batch_interval must be between 1s and 1 hour")
+
+    @property
+    def extra_connection_attributes(self) -> str:
+        attributes = {
+            "dataFormat": self.data_format,
+            "parquetVersion": self.parquet_version,
+            "encodingType": self.encoding_type,
+            "dictPageSizeLimit": self.dict_page_size_limit,
+            "rowGroupLength": self.row_group_length,
+            "enableStatistics": self.enable_statistics,
+            "csvDelimiter": self.csv_delimiter,
+            "csvRowDelimiter": self.csv_row_delimiter,
+            "datePartitionEnabled": self.date_partition_enabled,
+            "datePartitionSequence": self.date_partition_sequence,
+            "datePartitionDelimiter": self.date_partition_delimiter,
+            "maxFileSize": self.max_file_size_kb,
+            "cdcMaxBatchInterval": self.cdc_max_batch_interval,
+            "timestampColumnName": self.timestamp_column_name,
+            "includeOpForFullLoad": self.include_op_for_full_load,
+        }
+        return ";".join(
+            f"{name}={str(value).lower() if isinstance(value, bool) else value}"
+            for name, value in attributes.items()
+            if value is not None
+        )
+
+
 class DMSEndpoints:
     def __init__(
         self,
         scope: core.Construct,
         rds_stack: RDSStack,
         data_lake_bronze_bucket: BaseDataLakeBucket,
+        s3_target_settings: S3TargetSettings = S3TargetSettings(),
         **kwargs,
     ):
         self.deploy_env = active_environment
         self.rds_stack = rds_stack
         self.data_lake_bronze_bucket = data_lake_bronze_bucket
+        self.s3_target_settings = s3_target_settings
+        self.s3_target_settings.validate()
 
         self.rds_endpoint = dms.CfnEndpoint(
             scope=scope,
             id=f"dms-{self.deploy_env.value}-ecommerce-rds-endpoint",
             endpoint_type="source",
-            endpoint_identifier=f"dms-source-{self.deploy_env.value}-ecommerce-rds-endpoint",
+            endpoint_identifier=source_endpoint_identifier(self.deploy_env.value),
             engine_name="postgres",
             password=db_password,  # should not be hardcoded. Move to SecretsManager and use dynamic reference
             username=db_username,
@@ -94,15 +224,13 @@ class DMSEndpoints:
             scope=scope,
             id=f"dms-{self.deploy_env.value}-ecommerce-s3-endpoint",
             endpoint_type="target",
-            endpoint_identifier=f"dms-target-{self.deploy_env.value}-ecommerce-s3-endpoint",
+            endpoint_identifier=target_endpoint_identifier(self.deploy_env.value),
             engine_name="s3",
-            extra_connection_attributes="DataFormat=parquet;maxFileSize=131072;timestampColumnName=extracted_at;includeOpForFullLoad=true;cdcMaxBatchInterval=120",
+            extra_connection_attributes=self.s3_target_settings.extra_connection_attributes,
             s3_settings=dms.CfnEndpoint.S3SettingsProperty(
                 bucket_name=self.data_lake_bronze_bucket.bucket_name,
                 bucket_folder="ecommerce_rds",
-                compression_type="gzip",
-                csv_delimiter=",",
-                csv_row_delimiter="\n",
+                compression_type=self.s3_target_settings.compression_type.lower(),
                 service_access_role_arn=RawDMSRole(
                     scope, self.data_lake_bronze_bucket
                 ).role_arn,
@@ -142,7 +270,9 @@ class ReplicationInstance:
             publicly_accessible=False,
             engine_version="3.4.4",
             replication_instance_class="dms.t2.small",
-            replication_instance_identifier=f"dms-{self.deploy_env.value}-replication-instance",
+            replication_instance_identifier=replication_instance_identifier(
+                self.deploy_env.value
+            ),
             vpc_security_group_ids=[self.dms_sg.security_group_id],
             replication_subnet_group_identifier=self.dms_subnet_group.replication_subnet_group_identifier,
         )
@@ -152,12 +282,19 @@ class ReplicationInstance:
 
 
 class ReplicationTask(dms.CfnReplicationTask):
+    """
+    Full load and CDC of every table of the source database. Large tables
+    are full loaded in parallel segments, as declared in
+    replication_definitions.py.
+    """
+
     def __init__(
         self,
         scope: core.Construct,
         common_stack: CommonResourcesStack,
         rds_stack: RDSStack,
         data_lake_bronze_bucket: BaseDataLakeBucket,
+        s3_target_settings: S3TargetSettings = S3TargetSettings(),
         # dms_endpoints: DMSEndpoints,
         # dms_replication_instance: ReplicationInstance,
         **kwargs,
@@ -171,34 +308,95 @@ class ReplicationTask(dms.CfnReplicationTask):
             scope=scope,
             rds_stack=rds_stack,
             data_lake_bronze_bucket=data_lake_bronze_bucket,
+            s3_target_settings=s3_target_settings,
         )
         self.instance = ReplicationInstance(
             scope=scope, common_stack=common_stack
         ).instance
 
+        self.validate(table_load_settings)
+
         super().__init__(
             scope=scope,
             id=f"{self.deploy_env.value}-dms-task-ecommerce-rds",
             migration_type="full-load-and-cdc",
-            replication_task_identifier=f"{self.deploy_env.value}-dms-task-ecommerce-rds",
+            replication_task_identifier=replication_task_identifier(
+                self.deploy_env.value
+            ),
             replication_instance_arn=self.instance.ref,
             source_endpoint_arn=self.endpoints.rds_endpoint.ref,
             target_endpoint_arn=self.endpoints.s3_endpoint.ref,
-            table_mappings=json.dumps(
-                {
-                    "rules": [
-                        {
-                            "rule-type": "selection",
-                            "rule-id": "1",
-                            "rule-name": "1",
-                            "object-locator": {
-                                "schema-name": "%",  # All schemas
-                                "table-name": "%",  # All tables
-                            },
-                            "rule-action": "include",
-                            "filters": [],
-                        }
-                    ]
-                }
+            table_mappings=json.dumps(self.table_mappings(table_load_settings)),
+            replication_task_settings=json.dumps(
+                self.task_settings(table_load_settings)
             ),
         )
+
+    @staticmethod
+    def validate(load_settings: dict) -> None:
+        """
+        Fails the synth on segments DMS would only reject when the task runs
+        """
+        for table_name, settings in load_settings.items():
+            if settings.boundaries and not settings.column:
+                raise ValueError(f"{table_name} has boundaries but no column")
+            if list(settings.boundaries) != sorted(set(settings.boundaries)):
+                raise ValueError(f"{table_name} boundaries must be ascending")
+            if settings.segments > MAX_FULL_LOAD_SUBTASKS:
+                raise ValueError(
+                    f"{table_name} has more segments than the "
+                    f"{MAX_FULL_LOAD_SUBTASKS} full load subtasks"
+                )
+
+    @staticmethod
+    def table_mappings(load_settings: dict) -> dict:
+        rules = [
+            {
+                "rule-type": "selection",
+                "rule-id": "1",
+                "rule-name": "1",
+                "object-locator": {
+                    "schema-name": "%",  # All schemas
+                    "table-name": "%",  # All tables
+                },
+                "rule-action": "include",
+                "filters": [],
+            }
+        ]
+        for settings in load_settings.values():
+            if settings.segments < 2:
+                continue
+            schema_name, table_name = settings.table_name.split(".")
+            rule_id = str(len(rules) + 1)
+            rules.append(
+                {
+                    "rule-type": "table-settings",
+                    "rule-id": rule_id,
+                    "rule-name": rule_id,
+                    "object-locator": {
+                        "schema-name": schema_name,
+                        "table-name": table_name,
+                    },
+                    "parallel-load": {
+                        "type": "ranges",
+                        "columns": [settings.column],
+                        "boundaries": [[boundary] for boundary in settings.boundaries],
+                    },
+                }
+            )
+        return {"rules": rules}
+
+    @staticmethod
+    def task_settings(load_settings: dict) -> dict:
+        return {
+            "FullLoadSettings": {
+                "MaxFullLoadSubTasks": MAX_FULL_LOAD_SUBTASKS,
+                "CommitRate": FULL_LOAD_COMMIT_RATE,
+            },
+            # how often the S3 target writes changes is the endpoint's
+            # cdcMaxBatchInterval, this bounds the memory DMS buffers them in
+            "ChangeProcessingTuning": {
+                "MemoryLimitTotal": CHANGE_PROCESSING_MEMORY_MB,
+                "CommitTimeout": 1,
+            },
+        }
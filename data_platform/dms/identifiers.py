@@ -0,0 +1,19 @@
+# Identifiers of the DMS resources, shared by the CDK constructs in base.py
+# and the scripts that operate the replication task (trigger_dms.py), which
+# can't import the CDK
+
+
+def replication_task_identifier(environment: str) -> str:
+    return f"{environment}-dms-task-ecommerce-rds"
+
+
+def source_endpoint_identifier(environment: str) -> str:
+    return f"dms-source-{environment}-ecommerce-rds-endpoint"
+
+
+def target_endpoint_identifier(environment: str) -> str:
+    return f"dms-target-{environment}-ecommerce-s3-endpoint"
+
+
+def replication_instance_identifier(environment: str) -> str:
+    return f"dms-{environment}-replication-instance"
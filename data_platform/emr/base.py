@@ -0,0 +1,169 @@
+from aws_cdk import core
+from aws_cdk import aws_emr as emr, aws_iam as iam, aws_s3 as s3
+from data_platform.active_environment import active_environment
+from data_platform.emr.spark_profile import SparkProfile
+
+# Spot capacity is spread over similar instance types, so losing one spot pool
+# doesn't stall the cluster. Weights are capacity units: every type has the
+# 4 vCPUs of an m5.xlarge core node, so each counts as one unit.
+TASK_INSTANCE_TYPES = {"m5.xlarge": 1, "m5a.xlarge": 1, "m4.xlarge": 1, "r5.xlarge": 1}
+
+
+def configuration_properties(configurations: list) -> list:
+    """
+    Converts RunJobFlow style configurations into CloudFormation properties
+    """
+    return [
+        emr.CfnCluster.ConfigurationProperty(
+            classification=configuration["Classification"],
+            configuration_properties=configuration.get("Properties"),
+            configurations=configuration_properties(
+                configuration.get("Configurations", [])
+            )
+            or None,
+        )
+        for configuration in configurations
+    ]
+
+
+class BasePersistentEMRCluster(emr.CfnCluster):
+    """
+    Long lived EMR cluster that steps are submitted to.
+    Master and core nodes are on demand, extra capacity comes from a spot
+    task fleet grown and shrunk by managed scaling. CloudFormation owns
+    the cluster and wouldn't recreate it, so it never terminates on idle,
+    the spot fleet scales down to nothing instead.
+    Nodes run bootstrap_path, the script installing the jobs' libraries.
+    """
+
+    def __init__(
+        self,
+        scope: core.Construct,
+        subnet_ids: list,
+        service_role: iam.Role,
+        job_flow_profile: iam.CfnInstanceProfile,
+        log_bucket: s3.Bucket,
+        bootstrap_path: str,
+        instance_type: str = "m5.xlarge",
+        core_capacity: int = 2,
+        max_task_capacity: int = 8,
+        step_concurrency: int = 4,
+        spark_profile: SparkProfile = None,
+        **kwargs,
+    ) -> None:
+        self.deploy_env = active_environment
+        self.instance_type = instance_type
+        self.core_capacity = core_capacity
+        self.max_task_capacity = max_task_capacity
+        self.obj_name = f"emr-cluster-{self.deploy_env.value}"
+        # executors are sized for the largest the cluster can scale to
+        self.spark_profile = spark_profile or SparkProfile(
+            instance_type=instance_type,
+            instance_count=core_capacity + max_task_capacity,
+        )
+        self.validate()
+
+        super().__init__(
+            scope,
+            id=self.obj_name,
+            name=self.obj_name,
+            release_label=self.spark_profile.release_label,
+            applications=[emr.CfnCluster.ApplicationProperty(name="Spark")],
+            configurations=configuration_properties(
+                self.spark_profile.configurations()
+            ),
+            instances=self.instances(subnet_ids),
+            bootstrap_actions=[
+                emr.CfnCluster.BootstrapActionConfigProperty(
+                    name="install_python_libraries",
+                    script_bootstrap_action=emr.CfnCluster.ScriptBootstrapActionConfigProperty(
+                        path=bootstrap_path
+                    ),
+                )
+            ],
+            # note job_flow_role is an instance profile (not an iam role)
+            job_flow_role=job_flow_profile.ref,
+            service_role=service_role.role_name,
+            managed_scaling_policy=self.managed_scaling_policy,
+            step_concurrency_level=step_concurrency,
+            log_uri=f"s3://{log_bucket.bucket_name}/elasticmapreduce/",
+            visible_to_all_users=True,
+            **kwargs,
+        )
+        self.task_fleet = self.add_task_fleet()
+
+    def validate(self):
+        """
+        Fails the synth on settings EMR would only reject at deploy time
+        """
+        if self.core_capacity < 1:
+            raise ValueError("The cluster needs at least one core node")
+        if self.max_task_capacity < 0:
+            raise ValueError("max_task_capacity can't be negative")
+
+    def instances(self, subnet_ids: list):
+        return emr.CfnCluster.JobFlowInstancesConfigProperty(
+            ec2_subnet_ids=subnet_ids,
+            hadoop_version="Amazon",
+            keep_job_flow_alive_when_no_steps=True,
+            termination_protected=False,
+            master_instance_fleet=emr.CfnCluster.InstanceFleetConfigProperty(
+                name="master",
+                target_on_demand_capacity=1,
+                instance_type_configs=[
+                    emr.CfnCluster.InstanceTypeConfigProperty(
+                        instance_type=self.instance_type
+                    )
+                ],
+            ),
+            core_instance_fleet=emr.CfnCluster.InstanceFleetConfigProperty(
+                name="core",
+                target_on_demand_capacity=self.core_capacity,
+                instance_type_configs=[
+                    emr.CfnCluster.InstanceTypeConfigProperty(
+                        instance_type=self.instance_type, weighted_capacity=1
+                    )
+                ],
+            ),
+        )
+
+    @property
+    def managed_scaling_policy(self):
+        """
+        Core nodes stay on demand, everything above them runs on spot
+        """
+        return emr.CfnCluster.ManagedScalingPolicyProperty(
+            compute_limits=emr.CfnCluster.ComputeLimitsProperty(
+                unit_type="InstanceFleetUnits",
+                minimum_capacity_units=self.core_capacity,
+                maximum_capacity_units=self.core_capacity + self.max_task_capacity,
+                maximum_core_capacity_units=self.core_capacity,
+                maximum_on_demand_capacity_units=self.core_capacity,
+            )
+        )
+
+    def add_task_fleet(self):
+        return emr.CfnInstanceFleetConfig(
+            self.stack,
+            id=f"{self.obj_name}-task-fleet",
+            cluster_id=self.ref,
+            instance_fleet_type="TASK",
+            name="task",
+            target_on_demand_capacity=0,
+            target_spot_capacity=0,
+            instance_type_configs=[
+                emr.CfnInstanceFleetConfig.InstanceTypeConfigProperty(
+                    instance_type=instance_type,
+                    weighted_capacity=weight,
+                    bid_price_as_percentage_of_on_demand_price=100,
+                )
+                for instance_type, weight in TASK_INSTANCE_TYPES.items()
+            ],
+            launch_specifications=emr.CfnInstanceFleetConfig.InstanceFleetProvisioningSpecificationsProperty(
+                spot_specification=emr.CfnInstanceFleetConfig.SpotProvisioningSpecificationProperty(
+                    allocation_strategy="capacity-optimized",
+                    timeout_action="SWITCH_TO_ON_DEMAND",
+                    timeout_duration_minutes=10,
+                )
+            ),
+        )
@@ -0,0 +1,170 @@
+from typing import NamedTuple
+
+# vCPUs and memory YARN hands out per node, as configured by EMR by default
+# https://docs.aws.amazon.com/emr/latest/ReleaseGuide/emr-hadoop-task-config.html
+YARN_NODE_RESOURCES = {
+    "m4.xlarge": (4, 12288),
+    "m5.xlarge": (4, 12288),
+    "m5a.xlarge": (4, 12288),
+    "m5.2xlarge": (8, 24576),
+    "m5.4xlarge": (16, 57344),
+    "r5.xlarge": (4, 24576),
+    "r5.2xlarge": (8, 57344),
+}
+# YARN adds at least this much off-heap memory to each executor
+MIN_MEMORY_OVERHEAD_MIB = 384
+
+
+class SparkProfile(NamedTuple):
+    """
+    Spark settings for the EMR clusters, sized from the worker nodes.
+    Used by the EMR stack and by the DAG, so both clusters run the same way.
+    """
+
+    instance_type: str = "m5.xlarge"
+    # core and task nodes the cluster can scale up to
+    instance_count: int = 2
+    release_label: str = "emr-6.2.0"
+    # two executors per xlarge node
+    executor_cores: int = 2
+    memory_overhead_factor: float = 0.1
+    # steps run in cluster mode, so the driver takes a YARN container on
+    # one of the nodes: every node keeps room for it, next to its executors
+    driver_memory_mib: int = 2048
+    # shuffle partitions per executor core, AQE coalesces the small ones
+    partitions_per_core: int = 3
+    advisory_partition_size: str = "128m"
+
+    @property
+    def node_vcpus(self) -> int:
+        return YARN_NODE_RESOURCES[self.instance_type][0]
+
+    @property
+    def executors_per_node(self) -> int:
+        return self.node_vcpus // self.executor_cores
+
+    def overhead_mib(self, heap_mib: int) -> int:
+        return max(MIN_MEMORY_OVERHEAD_MIB, int(heap_mib * self.memory_overhead_factor))
+
+    @property
+    def driver_container_mib(self) -> int:
+        return self.driver_memory_mib + self.overhead_mib(self.driver_memory_mib)
+
+    @property
+    def executor_memory_mib(self) -> int:
+        """
+        Heap of each executor, so heap and overhead fill the YARN memory a
+        node has left once the driver's container is set aside
+        """
+        node_memory = YARN_NODE_RESOURCES[self.instance_type][1]
+        return int(
+            (node_memory - self.driver_container_mib)
+            / self.executors_per_node
+            / (1 + self.memory_overhead_factor)
+        )
+
+    @property
+    def memory_overhead_mib(self) -> int:
+        return self.overhead_mib(self.executor_memory_mib)
+
+    @property
+    def max_executors(self) -> int:
+        return self.executors_per_node * self.instance_count
+
+    @property
+    def shuffle_partitions(self) -> int:
+        return self.max_executors * self.executor_cores * self.partitions_per_core
+
+    def validate(self) -> None:
+        """
+        Raises ValueError on settings the cluster would only reject at runtime
+        """
+        if self.instance_type not in YARN_NODE_RESOURCES:
+            raise ValueError(
+                f"Unknown instance type {self.instance_type}, "
+                f"add its YARN resources to YARN_NODE_RESOURCES"
+            )
+        if self.instance_count < 1:
+            raise ValueError("The cluster needs at least one worker node")
+        if not 1 <= self.executor_cores <= self.node_vcpus:
+            raise ValueError(
+                f"executor_cores must be between 1 and the {self.node_vcpus} "
+                f"vCPUs of {self.instance_type}"
+            )
+        # adaptive query execution and the Arrow settings below need Spark 3
+        major = int(self.release_label.split("-")[1].split(".")[0])
+        if major < 6:
+            raise ValueError(f"{self.release_label} runs Spark 2, use emr-6.x")
+        used_memory = (
+            self.executor_memory_mib + self.memory_overhead_mib
+        ) * self.executors_per_node + self.driver_container_mib
+        if (
+            self.executor_memory_mib <= 0
+            or used_memory > YARN_NODE_RESOURCES[self.instance_type][1]
+        ):
+            raise ValueError(
+                f"{self.executors_per_node} executors of {self.executor_memory_mib}m "
+                f"and a driver of {self.driver_memory_mib}m plus overhead don't fit "
+                f"in a {self.instance_type} node"
+            )
+
+    @property
+    def spark_defaults(self) -> dict:
+        return {
+            # executors sized from the nodes, so maximizeResourceAllocation is off
+            "spark.executor.cores": str(self.executor_cores),
+            "spark.executor.memory": f"{self.executor_memory_mib}m",
+            "spark.executor.memoryOverhead": f"{self.memory_overhead_mib}m",
+            "spark.driver.memory": f"{self.driver_memory_mib}m",
+            "spark.driver.memoryOverhead": (
+                f"{self.overhead_mib(self.driver_memory_mib)}m"
+            ),
+            "spark.sql.shuffle.partitions": str(self.shuffle_partitions),
+            # adaptive execution
+            "spark.sql.adaptive.enabled": "true",
+            "spark.sql.adaptive.coalescePartitions.enabled": "true",
+            "spark.sql.adaptive.skewJoin.enabled": "true",
+            "spark.sql.adaptive.advisoryPartitionSizeInBytes": self.advisory_partition_size,
+            # dynamic allocation, following managed scaling
+            "spark.dynamicAllocation.enabled": "true",
+            "spark.shuffle.service.enabled": "true",
+            "spark.dynamicAllocation.minExecutors": "1",
+            "spark.dynamicAllocation.maxExecutors": str(self.max_executors),
+            # EMRFS S3 optimized committer, no renames on S3
+            "spark.sql.parquet.fs.optimized.committer.optimization-enabled": "true",
+            "spark.sql.parquet.output.committer.class": "com.amazon.emr.committer.EmrOptimizedSparkSqlParquetOutputCommitter",
+            # Parquet reads
+            "spark.sql.parquet.enableVectorizedReader": "true",
+            "spark.sql.parquet.filterPushdown": "true",
+            # serialization
+            "spark.serializer": "org.apache.spark.serializer.KryoSerializer",
+            "spark.kryoserializer.buffer.max": "512m",
+            "spark.sql.execution.arrow.pyspark.enabled": "true",
+            "spark.sql.execution.arrow.pyspark.fallback.enabled": "true",
+        }
+
+    def configurations(self) -> list:
+        """
+        Returns the EMR configurations, in the shape of the RunJobFlow API
+        """
+        self.validate()
+        return [
+            # use python3 for pyspark
+            {
+                "Classification": "spark-env",
+                "Configurations": [
+                    {
+                        "Classification": "export",
+                        "Properties": {
+                            "PYSPARK_PYTHON": "/usr/bin/python3",
+                            "PYSPARK_DRIVER_PYTHON": "/usr/bin/python3",
+                        },
+                    }
+                ],
+            },
+            {
+                "Classification": "spark",
+                "Properties": {"maximizeResourceAllocation": "false"},
+            },
+            {"Classification": "spark-defaults", "Properties": self.spark_defaults},
+        ]
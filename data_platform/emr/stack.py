@@ -1,10 +1,16 @@
+import io
+import os
+from zipfile import ZipFile
+
 from aws_cdk import core
 from aws_cdk import (
     aws_emr as emr,
     aws_ec2 as ec2,
     aws_iam as iam,
+    aws_s3_deployment as s3deploy,
 )
 from data_platform.common_stack import CommonResourcesStack
+from data_platform.emr.base import BasePersistentEMRCluster
 from data_platform.active_environment import active_environment
 
 
@@ -13,6 +19,7 @@ class EMRStack(core.Stack):
         self,
         scope: core.Construct,
         common_stack: CommonResourcesStack,
+        persistent_cluster: bool = False,
         **kwargs,
     ) -> None:
         self.deploy_env = active_environment
@@ -64,6 +71,55 @@ class EMRStack(core.Stack):
             instance_profile_name="emrJobFlowProfile",
         )
 
+        # the bronze_to_silver steps run the module with python3, importing
+        # the data_platform package from data_platform.zip
+        package = io.BytesIO()
+        with ZipFile(package, "w") as package_zip:
+            for file in [
+                "__init__.py",
+                "definitions.py",
+                "data_definitions.py",
+                "instrumentation.py",
+            ]:
+                package_zip.write(
+                    f"data_platform/{file}", arcname=f"data_platform/{file}"
+                )
+            package_zip.writestr("data_platform/processing/__init__.py", "")
+            for file in os.listdir("data_platform/processing"):
+                if file.endswith(".py"):
+                    package_zip.write(
+                        f"data_platform/processing/{file}",
+                        arcname=f"data_platform/processing/{file}",
+                    )
+        with ZipFile("data_platform/emr/resources.zip", "w") as resources_zip:
+            resources_zip.writestr("data_platform.zip", package.getvalue())
+            resources_zip.write(
+                "scripts/emr/bootstrap_emr.sh", arcname="bootstrap_emr.sh"
+            )
+
+        self.deploy_scripts = s3deploy.BucketDeployment(
+            self,
+            id=f"{self.deploy_env.value}-emr-scripts",
+            destination_bucket=self.s3_script_bucket,
+            sources=[s3deploy.Source.asset("data_platform/emr/resources.zip")],
+        )
+
+        # long lived cluster the DAG submits steps to, instead of one per run
+        if persistent_cluster:
+            self.emr_cluster = BasePersistentEMRCluster(
+                self,
+                subnet_ids=[
+                    subnet.subnet_id
+                    for subnet in common_stack.custom_vpc.public_subnets
+                ],
+                service_role=self.emr_service_role,
+                job_flow_profile=self.emr_job_flow_profile,
+                log_bucket=self.s3_log_bucket,
+                bootstrap_path=f"s3://{self.s3_script_bucket.bucket_name}/bootstrap_emr.sh",
+            )
+            # the bootstrap script has to be uploaded before the nodes start
+            self.emr_cluster.node.add_dependency(self.deploy_scripts)
+
         # # create emr cluster
         # emr.CfnCluster(
         #     self,
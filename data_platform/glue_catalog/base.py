@@ -1,7 +1,16 @@
 from enum import Enum
+from typing import NamedTuple
 from aws_cdk import core
-from aws_cdk import aws_glue as glue, aws_iam as iam
+from aws_cdk import (
+    aws_glue as glue,
+    aws_iam as iam,
+    aws_lambda as lambda_,
+    aws_s3 as s3,
+    aws_s3_notifications as s3_notifications,
+)
 from data_platform.data_lake.base import BaseDataLakeBucket
+from data_platform.glue_catalog.identifiers import crawler_name
+from data_platform.processing.cdc_merge import HIVE_NULL_PARTITION
 
 
 class BaseDataLakeGlueDatabase(glue.Database):
@@ -38,6 +47,175 @@ class BaseDataLakeGlueDatabase(glue.Database):
         return f"s3://{self.data_lake_bucket.bucket_name}"
 
 
+# Glue (Hive) types of the Arrow types the processing jobs write
+ARROW_TO_GLUE_TYPES = {
+    "bool": "boolean",
+    "int32": "int",
+    "int64": "bigint",
+    "double": "double",
+    "string": "string",
+    "date32[day]": "date",
+    "timestamp[us]": "timestamp",
+}
+
+
+def glue_columns(schema) -> dict:
+    """
+    Returns the {column: glue type} of an Arrow schema
+    """
+    return {field.name: ARROW_TO_GLUE_TYPES[str(field.type)] for field in schema}
+
+
+class DateProjection(NamedTuple):
+    """
+    Partitions of one day each, from start until end (NOW for today)
+    """
+
+    column: str
+    start: str = "2016-01-01"
+    end: str = "NOW"
+    format: str = "yyyy-MM-dd"
+    glue_type: str = "date"
+
+    def parameters(self) -> dict:
+        return {
+            f"projection.{self.column}.type": "date",
+            f"projection.{self.column}.range": f"{self.start},{self.end}",
+            f"projection.{self.column}.format": self.format,
+            f"projection.{self.column}.interval": "1",
+            f"projection.{self.column}.interval.unit": "DAYS",
+        }
+
+
+class IntegerProjection(NamedTuple):
+    """
+    Partitions for every integer between minimum and maximum
+    """
+
+    column: str
+    minimum: int
+    maximum: int
+    glue_type: str = "int"
+
+    def parameters(self) -> dict:
+        return {
+            f"projection.{self.column}.type": "integer",
+            f"projection.{self.column}.range": f"{self.minimum},{self.maximum}",
+        }
+
+
+class BaseDataLakeGlueTable(glue.CfnTable):
+    """
+    Parquet table of a data lake bucket, declared instead of crawled.
+    Partitions are projected from the table parameters, so Athena plans
+    queries without listing partitions in the catalog. Projected ranges
+    can't hold the directory of null values, so Athena doesn't read the
+    rows whose partition column is null (the table description says so).
+    With a symlink_directory, the table is read through the symlink
+    manifests under it, which list the Parquet files of each partition.
+    """
+
+    def __init__(
+        self,
+        scope: core.Construct,
+        glue_database: BaseDataLakeGlueDatabase,
+        prefix: str,
+        table_name: str,
+        columns: dict,
+        projections: list = (),
+        symlink_directory: str = None,
+        **kwargs,
+    ) -> None:
+        self.glue_database = glue_database
+        self.deploy_env = self.glue_database.deploy_env
+        self.data_lake_bucket = self.glue_database.data_lake_bucket
+        self.table_name = table_name
+        self.projections = list(projections)
+        self.symlink_directory = symlink_directory
+        self.location = (
+            f"s3://{self.data_lake_bucket.bucket_name}/{prefix}/{self.table_name}"
+        )
+        if self.symlink_directory:
+            self.location += f"/{self.symlink_directory}"
+        partition_columns = [projection.column for projection in self.projections]
+        self.columns = {
+            name: glue_type
+            for name, glue_type in columns.items()
+            if name not in partition_columns
+        }
+        self.obj_name = f"glue-{self.deploy_env.value}-{self.data_lake_bucket.layer.value}-{self.table_name}-table"
+        super().__init__(
+            scope,
+            id=self.obj_name,
+            catalog_id=core.Aws.ACCOUNT_ID,
+            database_name=self.glue_database.database_name,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=self.table_name,
+                description=self.description,
+                table_type="EXTERNAL_TABLE",
+                parameters=self.parameters,
+                partition_keys=[
+                    glue.CfnTable.ColumnProperty(
+                        name=projection.column, type=projection.glue_type
+                    )
+                    for projection in self.projections
+                ],
+                storage_descriptor=self.storage_descriptor,
+            ),
+            **kwargs,
+        )
+        self.node.add_dependency(self.glue_database)
+
+    @property
+    def description(self):
+        if not self.projections:
+            return None
+        columns = " or ".join(projection.column for projection in self.projections)
+        return (
+            f"Rows whose {columns} is null are written to "
+            f"{HIVE_NULL_PARTITION}, which partition projection skips: "
+            "Athena doesn't read them"
+        )
+
+    @property
+    def parameters(self):
+        parameters = {"classification": "parquet", "EXTERNAL": "TRUE"}
+        if self.projections:
+            parameters["projection.enabled"] = "true"
+            parameters["storage.location.template"] = self.location + "".join(
+                f"/{column}=${{{column}}}"
+                for column in (projection.column for projection in self.projections)
+            )
+            for projection in self.projections:
+                parameters.update(projection.parameters())
+        return parameters
+
+    @property
+    def storage_descriptor(self):
+        if self.symlink_directory:
+            input_format = "org.apache.hadoop.hive.ql.io.SymlinkTextInputFormat"
+            output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
+        else:
+            input_format = (
+                "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+            )
+            output_format = (
+                "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+            )
+        return glue.CfnTable.StorageDescriptorProperty(
+            columns=[
+                glue.CfnTable.ColumnProperty(name=name, type=glue_type)
+                for name, glue_type in self.columns.items()
+            ],
+            location=self.location,
+            input_format=input_format,
+            output_format=output_format,
+            serde_info=glue.CfnTable.SerdeInfoProperty(
+                serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+            ),
+        )
+
+
 class BaseDataLakeGlueRole(iam.Role):
     def __init__(
         self,
@@ -108,13 +286,18 @@ class BaseDataLakeGlueRole(iam.Role):
 
 
 class BaseGlueCrawler(glue.CfnCrawler):
+    """
+    Crawler of a data lake folder, run on a schedule or, without a
+    schedule_expression, only when started
+    """
+
     def __init__(
         self,
         scope: core.Construct,
         table_name: str,
         glue_database: BaseDataLakeGlueDatabase,
-        schedule_expression: str,
         glue_role: BaseDataLakeGlueRole,
+        schedule_expression: str = None,
         **kwargs,
     ) -> None:
 
@@ -124,7 +307,9 @@ class BaseGlueCrawler(glue.CfnCrawler):
         self.table_name = table_name
         self.deploy_env = self.glue_database.deploy_env
         self.data_lake_bucket = self.glue_database.data_lake_bucket
-        self.obj_name = f"glue-{self.deploy_env.value}-{self.data_lake_bucket.layer.value}-{self.table_name}-crawler"
+        self.obj_name = crawler_name(
+            self.deploy_env.value, self.data_lake_bucket.layer.value, self.table_name
+        )
         super().__init__(
             scope,
             id=self.obj_name,
@@ -140,6 +325,8 @@ class BaseGlueCrawler(glue.CfnCrawler):
 
     @property
     def crawler_schedule(self):
+        if not self.schedule_expression:
+            return None
         return glue.CfnCrawler.ScheduleProperty(
             schedule_expression=self.schedule_expression
         )
@@ -153,3 +340,80 @@ class BaseGlueCrawler(glue.CfnCrawler):
                 ),
             ]
         )
+
+
+class BasePartitionRegistrar(lambda_.Function):
+    """
+    Lambda that adds the partitions listed in the manifests writers leave
+    in a data lake bucket to the bucket's glue database
+    """
+
+    def __init__(
+        self,
+        scope: core.Construct,
+        glue_database: BaseDataLakeGlueDatabase,
+        table_name: str,
+        **kwargs,
+    ) -> None:
+        self.glue_database = glue_database
+        self.deploy_env = self.glue_database.deploy_env
+        self.data_lake_bucket = self.glue_database.data_lake_bucket
+        self.obj_name = f"glue-{self.deploy_env.value}-{self.data_lake_bucket.layer.value}-partition-registrar"
+        super().__init__(
+            scope,
+            id=self.obj_name,
+            function_name=self.obj_name,
+            description=f"Registers new partitions of Data Lake "
+            f"{self.data_lake_bucket.layer.value}.{table_name}",
+            runtime=lambda_.Runtime.PYTHON_3_8,
+            handler="partition_registrar.handler",
+            code=lambda_.Code.from_asset(
+                "data_platform/glue_catalog", exclude=["*", "!partition_registrar.py"]
+            ),
+            environment={
+                "DATABASE_NAME": self.glue_database.database_name,
+                "TABLE_PREFIX": table_name,
+            },
+            timeout=core.Duration.minutes(1),
+            **kwargs,
+        )
+        self.add_policy()
+        self.add_notification()
+
+    def add_policy(self):
+        self.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "glue:GetTable",
+                    "glue:UpdateTable",
+                    "glue:BatchCreatePartition",
+                ],
+                resources=[
+                    f"arn:aws:glue:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:catalog",
+                    f"arn:aws:glue:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:database/{self.glue_database.database_name}",
+                    f"arn:aws:glue:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:table/{self.glue_database.database_name}/*",
+                ],
+            )
+        )
+        self.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["s3:GetObject"],
+                resources=[f"{self.data_lake_bucket.bucket_arn}/_state/manifests/*"],
+            )
+        )
+
+    def add_notification(self):
+        """
+        The bucket is looked up by name, as a notification set on the bucket
+        construct would make the data lake stack depend on this one
+        """
+        bucket = s3.Bucket.from_bucket_name(
+            self,
+            id=f"{self.obj_name}-bucket",
+            bucket_name=f"{self.data_lake_bucket.obj_name}-{core.Aws.ACCOUNT_ID}",
+        )
+        bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED,
+            s3_notifications.LambdaDestination(self),
+            s3.NotificationKeyFilter(prefix="_state/manifests/", suffix=".json"),
+        )
@@ -0,0 +1,6 @@
+# Identifiers of the Glue resources, shared by the CDK constructs in base.py
+# and the scripts that start them (trigger_dms.py), which can't import the CDK
+
+
+def crawler_name(environment: str, layer: str, table_name: str) -> str:
+    return f"glue-{environment}-{layer}-{table_name}-crawler"
@@ -0,0 +1,223 @@
+import json
+import os
+import posixpath
+from collections import defaultdict
+from urllib.parse import unquote_plus
+
+# Lambda handler, deployed on its own: only the standard library and boto3
+TABLE_PREFIX = os.environ.get("TABLE_PREFIX", "ecommerce_rds")
+MANIFEST_DIRECTORY = "_state/manifests/"
+# BatchCreatePartition accepts at most 100 partitions per call
+MAX_PARTITIONS_PER_CALL = 100
+# table parameter bumped on every write, readers use it to detect new data
+DATA_VERSION_PARAMETER = "data_version"
+# get_table returns read only fields that update_table doesn't accept
+TABLE_INPUT_FIELDS = [
+    "Name",
+    "Description",
+    "Owner",
+    "Retention",
+    "StorageDescriptor",
+    "PartitionKeys",
+    "TableType",
+    "Parameters",
+]
+
+
+class EntityNotFoundException(Exception):
+    """
+    Raised by the local catalog, named like the Glue client's exception
+    """
+
+
+class LocalGlueCatalog:
+    """
+    In memory stand-in for the Glue client calls the registrar makes,
+    with the same arguments and response shapes
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.partitions = defaultdict(dict)
+
+    def create_table(self, DatabaseName: str, TableInput: dict) -> dict:
+        self.tables[DatabaseName, TableInput["Name"]] = dict(TableInput)
+        return {}
+
+    def get_table(self, DatabaseName: str, Name: str) -> dict:
+        if (DatabaseName, Name) not in self.tables:
+            raise EntityNotFoundException(f"Table {DatabaseName}.{Name} not found")
+        return {"Table": dict(self.tables[DatabaseName, Name])}
+
+    def update_table(self, DatabaseName: str, TableInput: dict) -> dict:
+        self.get_table(DatabaseName=DatabaseName, Name=TableInput["Name"])
+        return self.create_table(DatabaseName=DatabaseName, TableInput=TableInput)
+
+    def batch_create_partition(
+        self, DatabaseName: str, TableName: str, PartitionInputList: list
+    ) -> dict:
+        errors = []
+        partitions = self.partitions[DatabaseName, TableName]
+        for partition in PartitionInputList:
+            values = tuple(partition["Values"])
+            if values in partitions:
+                errors.append(
+                    {
+                        "PartitionValues": list(values),
+                        "ErrorDetail": {"ErrorCode": "AlreadyExistsException"},
+                    }
+                )
+            else:
+                partitions[values] = partition
+        return {"Errors": errors}
+
+
+def partition_of(key: str) -> tuple:
+    """
+    Returns the (table, partition directory, {column: value}) of an object
+    key like ecommerce_rds/orders/order_purchase_date=2018-01-01/part-0.parquet
+    """
+    parts = key.split("/")
+    if TABLE_PREFIX not in parts[:-1]:
+        return None
+    start = parts.index(TABLE_PREFIX) + 1
+    directories = parts[start:-1]
+    if not directories:
+        return None
+    values = dict(part.split("=", 1) for part in directories[1:] if "=" in part)
+    return directories[0], "/".join(parts[:-1]), values
+
+
+class PartitionRegistrar:
+    """
+    Registers the partitions of newly written files in the Glue catalog,
+    so tables don't wait for (nor pay) a crawler to see new data.
+    Crawlers only need to run when a table's schema changes.
+    Every written table also gets a new data_version parameter, which query
+    caches use to tell when a table's data changed.
+    """
+
+    def __init__(self, glue, database_name: str):
+        self.glue = glue
+        self.database_name = database_name
+
+    def partitions_by_table(self, keys: list) -> dict:
+        partitions = defaultdict(dict)
+        for key in keys:
+            partition = partition_of(key)
+            if partition:
+                table_name, directory, values = partition
+                partitions[table_name][directory] = values
+        return partitions
+
+    def partition_input(self, table: dict, bucket: str, directory: str, values):
+        storage = dict(table["StorageDescriptor"])
+        storage["Location"] = f"s3://{bucket}/{directory}"
+        return {
+            "Values": [values[key["Name"]] for key in table["PartitionKeys"]],
+            "StorageDescriptor": storage,
+        }
+
+    def stamp_version(self, table: dict, data_version: str) -> None:
+        table_input = {
+            field: table[field] for field in TABLE_INPUT_FIELDS if field in table
+        }
+        table_input["Parameters"] = dict(
+            table.get("Parameters", {}), **{DATA_VERSION_PARAMETER: data_version}
+        )
+        self.glue.update_table(DatabaseName=self.database_name, TableInput=table_input)
+
+    def register(self, bucket: str, keys: list, data_version: str = None) -> dict:
+        """
+        Creates the missing partitions of the given object keys.
+        Partitions that already exist are counted, not updated.
+        When a data_version is given, it is stamped on every written table.
+        """
+        stats = {"created": 0, "existing": 0, "skipped": 0, "versioned": 0}
+        for table_name, directories in self.partitions_by_table(keys).items():
+            try:
+                table = self.glue.get_table(
+                    DatabaseName=self.database_name, Name=table_name
+                )["Table"]
+            except Exception as error:
+                # tables are created by a crawler or the catalog stack first
+                if type(error).__name__ != "EntityNotFoundException":
+                    raise
+                stats["skipped"] += len(directories)
+                continue
+            if data_version:
+                self.stamp_version(table, data_version)
+                stats["versioned"] += 1
+            names = [key["Name"] for key in table.get("PartitionKeys", [])]
+            if not names:
+                continue
+            partitions = [
+                self.partition_input(table, bucket, directory, values)
+                for directory, values in sorted(directories.items())
+                if set(names) == set(values)
+            ]
+            stats["skipped"] += len(directories) - len(partitions)
+            for start in range(0, len(partitions), MAX_PARTITIONS_PER_CALL):
+                chunk = partitions[start : start + MAX_PARTITIONS_PER_CALL]
+                response = self.glue.batch_create_partition(
+                    DatabaseName=self.database_name,
+                    TableName=table_name,
+                    PartitionInputList=chunk,
+                )
+                existing = sum(
+                    error["ErrorDetail"]["ErrorCode"] == "AlreadyExistsException"
+                    for error in response.get("Errors", [])
+                )
+                if len(response.get("Errors", [])) > existing:
+                    raise RuntimeError(
+                        f"Could not register partitions of {table_name}: "
+                        f"{response['Errors']}"
+                    )
+                stats["existing"] += existing
+                stats["created"] += len(chunk) - existing
+        return stats
+
+
+def data_version(key: str) -> str:
+    """
+    Manifests are named <run time>-<uuid>.json, so later writes sort higher
+    """
+    return posixpath.splitext(posixpath.basename(key))[0]
+
+
+def object_keys(s3, bucket: str, key: str) -> list:
+    """
+    Returns the data files behind a created object: the files listed in a
+    writer's manifest, or the object itself
+    """
+    if MANIFEST_DIRECTORY not in key:
+        return [key]
+    root = key.split(MANIFEST_DIRECTORY)[0]
+    manifest = json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+    return [posixpath.join(root, path) if root else path for path in manifest["files"]]
+
+
+def handler(event, context, glue=None, s3=None):
+    """
+    Lambda entry point for S3 ObjectCreated notifications
+    """
+    if glue is None or s3 is None:
+        import boto3
+
+        glue = glue or boto3.client("glue")
+        s3 = s3 or boto3.client("s3")
+
+    keys_by_bucket = defaultdict(list)
+    versions = {}
+    for record in event.get("Records", []):
+        bucket = record["s3"]["bucket"]["name"]
+        key = unquote_plus(record["s3"]["object"]["key"])
+        keys_by_bucket[bucket].extend(object_keys(s3, bucket, key))
+        versions[bucket] = max(versions.get(bucket, ""), data_version(key))
+
+    registrar = PartitionRegistrar(glue, os.environ["DATABASE_NAME"])
+    stats = {}
+    for bucket, keys in keys_by_bucket.items():
+        stats[bucket] = registrar.register(bucket, keys, versions[bucket])
+    print(json.dumps(stats))
+    return stats
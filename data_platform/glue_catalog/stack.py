@@ -5,8 +5,21 @@ from data_platform.data_lake.base import BaseDataLakeBucket
 from data_platform.glue_catalog.base import (
     BaseDataLakeGlueDatabase,
     BaseDataLakeGlueRole,
+    BaseDataLakeGlueTable,
     BaseGlueCrawler,
+    BasePartitionRegistrar,
+    DateProjection,
+    IntegerProjection,
+    glue_columns,
 )
+from data_platform.data_definitions import TABLES
+from data_platform.processing.silver_to_gold import (
+    ORDERS_OBT,
+    ORDERS_OBT_SCHEMA,
+    PARTITION_COLUMN,
+    SYMLINK_DIRECTORY,
+)
+from data_platform.processing.storage import SILVER_PREFIX, GOLD_PREFIX
 
 
 class GlueCatalogStack(core.Stack):
@@ -45,35 +58,50 @@ class GlueCatalogStack(core.Stack):
             data_lake_gold_bucket=self.data_lake_gold_bucket,
         )
 
+        # no schedule: trigger_dms starts it once DMS (re)loads tables,
+        # which is when their schema can change
         self.ecommerce_bronze_crawler = BaseGlueCrawler(
             self,
             glue_database=self.bronze_database,
             glue_role=self.role,
             table_name="ecommerce_rds",
-            schedule_expression="cron(0/15 * * * ? *)",
         )
 
         self.ecommerce_bronze_crawler.node.add_dependency(self.bronze_database)
         self.ecommerce_bronze_crawler.node.add_dependency(self.role)
 
-        self.ecommerce_silver_crawler = BaseGlueCrawler(
-            self,
-            glue_database=self.silver_database,
-            glue_role=self.role,
-            table_name="ecommerce_rds",
-            schedule_expression="cron(0/15 * * * ? *)",
-        )
+        # silver tables are declared from the table registry, with
+        # projected date partitions, so they don't need a crawler
+        self.silver_tables = {
+            table.name: BaseDataLakeGlueTable(
+                self,
+                glue_database=self.silver_database,
+                prefix=SILVER_PREFIX,
+                table_name=table.name,
+                columns=table.glue_columns(),
+                projections=[DateProjection(table.partition_column)]
+                if table.partition_column
+                else [],
+            )
+            for table in TABLES.values()
+        }
 
-        self.ecommerce_silver_crawler.node.add_dependency(self.silver_database)
-        self.ecommerce_silver_crawler.node.add_dependency(self.role)
+        self.silver_partition_registrar = BasePartitionRegistrar(
+            self, glue_database=self.silver_database, table_name=SILVER_PREFIX
+        )
 
-        self.ecommerce_gold_crawler = BaseGlueCrawler(
+        # gold is written by the processing jobs too, one partition per year,
+        # and read through symlink manifests so a rewrite switches at once
+        self.gold_orders_obt_table = BaseDataLakeGlueTable(
             self,
             glue_database=self.gold_database,
-            glue_role=self.role,
-            table_name="ecommerce_rds",
-            schedule_expression="cron(0/15 * * * ? *)",
+            prefix=GOLD_PREFIX,
+            table_name=ORDERS_OBT,
+            columns=glue_columns(ORDERS_OBT_SCHEMA),
+            projections=[IntegerProjection(PARTITION_COLUMN, 2016, 2030)],
+            symlink_directory=SYMLINK_DIRECTORY,
         )
 
-        self.ecommerce_gold_crawler.node.add_dependency(self.gold_database)
-        self.ecommerce_gold_crawler.node.add_dependency(self.role)
+        self.gold_partition_registrar = BasePartitionRegistrar(
+            self, glue_database=self.gold_database, table_name=GOLD_PREFIX
+        )
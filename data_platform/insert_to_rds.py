@@ -1,56 +1,445 @@
-import io
+import argparse
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 import requests
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 
 from data_platform.definitions import db_name, db_password, db_username
-from data_platform.data_definitions import table_names_list, sql_list, url_list
-
-
-rds = boto3.client('rds')
-instances = rds.describe_db_instances(DBInstanceIdentifier='rds-production-ecommerce-db')
-rds_host = instances.get('DBInstances')[0]['Endpoint']['Address']
-
-# CONNECTION PARAMS
-dsn = (
-    "dbname={dbname} "
-    "user={user} "
-    "password={password} "
-    "port={port} "
-    "host={host} ".format(
-        dbname=db_name,
-        user=db_username,
-        password=db_password,
-        port=5432,
-        host=rds_host
-    )
+from data_platform.data_definitions import (
+    TABLES,
+    table_names_list,
+    table_dependencies,
+    primary_keys,
+    foreign_keys,
 )
+from data_platform.instrumentation import Instrumentation
+
+# spans of the load, sent to the sinks of INSTRUMENTATION_SINKS (none by default)
+instrumentation = Instrumentation.from_environment()
+
+# registry tables by qualified name
+tables = {table.qualified_name: table for table in TABLES.values()}
+
+
+class StreamReader:
+    """
+    File-like wrapper around a streamed HTTP response.
+    COPY reads it chunk by chunk, so the file is never held in memory.
+    """
+
+    def __init__(self, response: requests.Response):
+        self.raw = response.raw
+        # let urllib3 handle gzip/deflate content encodings
+        self.raw.decode_content = True
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.raw.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def get_rds_host() -> str:
+    """
+    Returns the endpoint address of the production RDS instance
+    """
+    rds = boto3.client("rds")
+    instances = rds.describe_db_instances(
+        DBInstanceIdentifier="rds-production-ecommerce-db"
+    )
+    return instances.get("DBInstances")[0]["Endpoint"]["Address"]
+
+
+def get_dsn(host: str, port: int = 5432) -> str:
+    return (
+        "dbname={dbname} "
+        "user={user} "
+        "password={password} "
+        "port={port} "
+        "host={host} ".format(
+            dbname=db_name,
+            user=db_username,
+            password=db_password,
+            port=port,
+            host=host,
+        )
+    )
+
+
+def load_stages(table_names: list) -> list:
+    """
+    Groups tables into stages following the foreign key graph.
+    Tables in the same stage are independent and can be loaded at the same time.
+    """
+    remaining = list(table_names)
+    loaded = set()
+    stages = []
+    while remaining:
+        stage = [
+            table_name
+            for table_name in remaining
+            if all(
+                referenced in loaded or referenced not in remaining
+                for referenced in table_dependencies[table_name]
+                if referenced != table_name
+            )
+        ]
+        if not stage:
+            raise ValueError(f"Circular foreign keys between tables: {remaining}")
+        stages.append(stage)
+        loaded.update(stage)
+        remaining = [table_name for table_name in remaining if table_name not in loaded]
+    return stages
+
+
+def copy_csv(cur, table_name: str, source, chunk_size: int) -> int:
+    cur.copy_expert(
+        f"COPY {table_name} FROM STDIN WITH (FORMAT CSV, HEADER TRUE)",
+        source,
+        size=chunk_size,
+    )
+    return cur.rowcount
+
+
+def load_table(
+    pool: ThreadedConnectionPool,
+    create_table: str,
+    table_name: str,
+    url: str,
+    chunk_size: int,
+) -> None:
+    """
+    Creates a table and streams its CSV straight into COPY. url is either
+    a dataset url or a local directory of CSV files, like the ones
+    synthetic_data generates.
+    """
+    span = instrumentation.span("load_table", table=table_name)
+    conn = pool.getconn()
+    try:
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cur, span:
+            print(f"Creating {table_name}")
+            cur.execute(create_table)
+            print(f"Streaming data from {url}")
+            start = time.perf_counter()
+            if url.startswith(("http://", "https://")):
+                with requests.get(url, stream=True) as r:
+                    r.raise_for_status()
+                    reader = StreamReader(r)
+                    rows = copy_csv(cur, table_name, reader, chunk_size)
+                bytes_read = reader.bytes_read
+            else:
+                rows = bytes_read = 0
+                for path in sorted(glob.glob(os.path.join(url, "*.csv"))):
+                    with open(path, "rb") as source:
+                        rows += copy_csv(cur, table_name, source, chunk_size)
+                    bytes_read += os.path.getsize(path)
+            elapsed = time.perf_counter() - start
+            span.count("rows", rows)
+            span.count("bytes", bytes_read)
+        print(
+            f"Finished {table_name}: {rows} rows, {bytes_read / 1e6:.1f} MB "
+            f"in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)"
+        )
+    finally:
+        pool.putconn(conn)
+
+
+def run_statements(
+    pool: ThreadedConnectionPool, statements: list, maintenance_work_mem: str = None
+) -> list:
+    """
+    Runs statements in order over one pooled connection, returning the first
+    row of each statement that produces results
+    """
+    conn = pool.getconn()
+    try:
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cur:
+            if maintenance_work_mem:
+                cur.execute("SET maintenance_work_mem = %s", (maintenance_work_mem,))
+            results = []
+            for statement in statements:
+                cur.execute(statement)
+                results.append(cur.fetchone() if cur.description else None)
+            return results
+    finally:
+        pool.putconn(conn)
+
+
+def run_stage(executor: ThreadPoolExecutor, function, table_names: list, **kwargs):
+    """
+    Runs function for each table at the same time and waits for all of them
+    """
+    futures = {
+        table_name: executor.submit(function, table_name=table_name, **kwargs)
+        for table_name in table_names
+    }
+    return {table_name: future.result() for table_name, future in futures.items()}
+
+
+def constraint_name(table_name: str, columns: list, suffix: str) -> str:
+    return f"{table_name.split('.')[-1]}_{'_'.join(columns)}_{suffix}"
+
+
+def find_violations(pool: ThreadedConnectionPool, table_name: str) -> dict:
+    """
+    Counts the rows of a loaded table that would break its declared constraints
+    """
+    checks = {}
+    primary_key = primary_keys[table_name]
+    if primary_key:
+        columns = ", ".join(primary_key)
+        checks[f"duplicate primary key ({columns})"] = (
+            f"SELECT count(*) FROM (SELECT {columns} FROM {table_name} "
+            f"GROUP BY {columns} HAVING count(*) > 1) AS duplicates"
+        )
+        is_null = " OR ".join(f"{column} IS NULL" for column in primary_key)
+        null_keys = f"SELECT count(*) FROM {table_name} WHERE {is_null}"
+        checks[f"null primary key ({columns})"] = null_keys
+    for columns, referenced, referenced_columns in foreign_keys[table_name]:
+        not_null = " AND ".join(f"c.{column} IS NOT NULL" for column in columns)
+        join = " AND ".join(
+            f"p.{referenced_column} = c.{column}"
+            for column, referenced_column in zip(columns, referenced_columns)
+        )
+        checks[f"orphan foreign key ({', '.join(columns)}) -> {referenced}"] = (
+            f"SELECT count(*) FROM {table_name} AS c WHERE {not_null} "
+            f"AND NOT EXISTS (SELECT 1 FROM {referenced} AS p WHERE {join})"
+        )
+    with instrumentation.span("find_violations", table=table_name) as span:
+        counts = run_statements(pool, list(checks.values()))
+        span.count("violations", sum(count[0] for count in counts))
+    return {check: count[0] for check, count in zip(checks, counts)}
+
+
+def build_keys(
+    pool: ThreadedConnectionPool,
+    table_name: str,
+    violations: dict,
+    maintenance_work_mem: str,
+) -> None:
+    """
+    Builds the primary key and the indexes supporting foreign key lookups
+    """
+    statements = []
+    primary_key = primary_keys[table_name]
+    if primary_key and not has_key_violations(violations[table_name]):
+        statements.append(
+            f"ALTER TABLE {table_name} "
+            f"ADD CONSTRAINT {constraint_name(table_name, primary_key, 'pkey')} "
+            f"PRIMARY KEY ({', '.join(primary_key)})"
+        )
+    for columns, _, _ in foreign_keys[table_name]:
+        if columns != primary_key:
+            statements.append(
+                f"CREATE INDEX IF NOT EXISTS {constraint_name(table_name, columns, 'idx')} "
+                f"ON {table_name} ({', '.join(columns)})"
+            )
+    statements.append(f"ANALYZE {table_name}")
+    start = time.perf_counter()
+    with instrumentation.span("build_keys", table=table_name):
+        run_statements(pool, statements, maintenance_work_mem)
+    print(f"Built keys for {table_name} in {time.perf_counter() - start:.1f}s")
+
+
+def build_foreign_keys(
+    pool: ThreadedConnectionPool, table_name: str, violations: dict
+) -> None:
+    """
+    Adds foreign keys without checking, then validates the ones with no orphans.
+    Constraints that reference a table without primary key are skipped.
+    """
+    statements = []
+    for columns, referenced, referenced_columns in foreign_keys[table_name]:
+        if has_key_violations(violations[referenced]):
+            print(f"Skipping {table_name} -> {referenced}: referenced key not built")
+            continue
+        name = constraint_name(table_name, columns, "fkey")
+        statements.append(
+            f"ALTER TABLE {table_name} ADD CONSTRAINT {name} "
+            f"FOREIGN KEY ({', '.join(columns)}) "
+            f"REFERENCES {referenced} ({', '.join(referenced_columns)}) NOT VALID"
+        )
+        orphans = f"orphan foreign key ({', '.join(columns)}) -> {referenced}"
+        if not violations[table_name][orphans]:
+            statements.append(f"ALTER TABLE {table_name} VALIDATE CONSTRAINT {name}")
+    start = time.perf_counter()
+    with instrumentation.span("build_foreign_keys", table=table_name) as span:
+        run_statements(pool, statements)
+        span.count("constraints", len(statements))
+    print(f"Built foreign keys for {table_name} in {time.perf_counter() - start:.1f}s")
+
+
+def has_key_violations(violations: dict) -> bool:
+    return any(count for check, count in violations.items() if "primary key" in check)
+
+
+def bulk_load(
+    executor: ThreadPoolExecutor,
+    pool: ThreadedConnectionPool,
+    table_names: list,
+    urls: dict,
+    chunk_size: int,
+    maintenance_work_mem: str,
+) -> dict:
+    """
+    Loads every table without constraints, then builds and validates
+    primary keys, indexes and foreign keys afterwards.
+    Returns the constraint violations found for each table.
+    """
+    print("Loading all tables without constraints\n")
+    with instrumentation.span("bulk_load_phase", phase="load"):
+        run_stage(
+            executor,
+            lambda table_name: load_table(
+                pool,
+                create_table=tables[table_name].postgres_ddl(constraints=False),
+                table_name=table_name,
+                url=urls[table_name],
+                chunk_size=chunk_size,
+            ),
+            table_names,
+        )
+
+    print("\nValidating constraints\n")
+    with instrumentation.span("bulk_load_phase", phase="validate"):
+        violations = run_stage(
+            executor, lambda table_name: find_violations(pool, table_name), table_names
+        )
+
+    print("Building primary keys and indexes\n")
+    with instrumentation.span("bulk_load_phase", phase="build_keys"):
+        run_stage(
+            executor,
+            build_keys,
+            table_names,
+            pool=pool,
+            violations=violations,
+            maintenance_work_mem=maintenance_work_mem,
+        )
+
+    print("\nBuilding foreign keys\n")
+    with instrumentation.span("bulk_load_phase", phase="build_foreign_keys"):
+        run_stage(
+            executor,
+            build_foreign_keys,
+            [table_name for table_name in table_names if foreign_keys[table_name]],
+            pool=pool,
+            violations=violations,
+        )
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create the ecommerce schema in Postgres and load the Olist datasets"
+    )
+    parser.add_argument(
+        "--host", help="Postgres host. Defaults to the production RDS endpoint"
+    )
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument(
+        "--dsn", help="libpq connection string, instead of --host and --port"
+    )
+    parser.add_argument(
+        "--data",
+        help="Directory of <table>/*.csv files to load instead of the public datasets",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Maximum number of tables (and connections) loaded at the same time",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1024 * 1024,
+        help="Bytes read from each HTTP stream per COPY round trip",
+    )
+    parser.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="Create tables without constraints, COPY, then build keys and indexes",
+    )
+    parser.add_argument(
+        "--maintenance-work-mem",
+        default="256MB",
+        help="Memory available to each index build in --bulk-load mode",
+    )
+    args = parser.parse_args()
+    # where the log sink of the instrumentation writes spans
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    dsn = args.dsn or get_dsn(host=args.host or get_rds_host(), port=args.port)
+    if args.data:
+        urls = {
+            table.qualified_name: os.path.join(args.data, table.name)
+            for table in TABLES.values()
+        }
+    else:
+        urls = {table.qualified_name: table.url for table in TABLES.values()}
+
+    pool = ThreadedConnectionPool(minconn=1, maxconn=args.workers, dsn=dsn)
+    print("connected")
+    try:
+        conn = pool.getconn()
+        try:
+            conn.set_session(autocommit=True)
+            with conn.cursor() as cur:
+                # Create Schema
+                print("Creating Schema\n")
+                cur.execute(f"CREATE SCHEMA IF NOT EXISTS {db_name}")
+        finally:
+            pool.putconn(conn)
+
+        run = instrumentation.span("insert_to_rds", bulk_load=args.bulk_load)
+        with ThreadPoolExecutor(max_workers=args.workers) as executor, run:
+            if args.bulk_load:
+                violations = bulk_load(
+                    executor,
+                    pool,
+                    table_names_list,
+                    urls,
+                    chunk_size=args.chunk_size,
+                    maintenance_work_mem=args.maintenance_work_mem,
+                )
+            else:
+                # Create tables and load data, stage by stage
+                for stage in load_stages(table_names_list):
+                    print(f"Loading stage: {', '.join(stage)}\n")
+                    with instrumentation.span("load_stage", tables=len(stage)):
+                        run_stage(
+                            executor,
+                            lambda table_name: load_table(
+                                pool,
+                                create_table=tables[table_name].postgres_ddl(),
+                                table_name=table_name,
+                                url=urls[table_name],
+                                chunk_size=args.chunk_size,
+                            ),
+                            stage,
+                        )
+                violations = {}
+    finally:
+        pool.closeall()
+
+    found = [
+        f"{table_name}: {count} rows with {check}"
+        for table_name, checks in violations.items()
+        for check, count in checks.items()
+        if count
+    ]
+    if found:
+        raise SystemExit("Constraint violations found:\n" + "\n".join(found))
+    print("Finished loading")
+
 
-# CREATE SCHEMA, TABLES and load data
-table_info = zip(sql_list, table_names_list, url_list)
-
-conn = psycopg2.connect(dsn)
-print("connected")
-conn.set_session(autocommit=True)
-try:
-    cur = conn.cursor()
-    # Create Schema
-    print("Creating Schema\n")
-    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {db_name}")
-    # Create tables
-    for create_table, table_name, url in table_info:
-        print(f"Creating {table_name}")
-        cur.execute(create_table)
-        print(f"Getting data from {url}")
-        r = requests.get(url)
-        assert r.status_code == 200
-        buff = io.StringIO(r.text)
-        # Exclude Header
-        next(buff)
-        # Insert data
-        print("Inserting data")
-        # cur.copy_from(buff, table_name, sep=",")
-        cur.copy_expert(f"COPY {table_name} FROM STDIN WITH (FORMAT CSV)", buff)
-        print(f"Finished {db_name}\n")
-finally:
-    conn.close()
+if __name__ == "__main__":
+    main()
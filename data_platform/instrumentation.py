@@ -0,0 +1,367 @@
+"""
+Lightweight timers and counters, grouped into spans of a trace.
+
+    instrumentation = Instrumentation.from_environment()
+    with instrumentation.span("load_table", table="orders") as span:
+        span.count("rows", 1000)
+
+A span records its duration, counters and attributes when it closes, and
+sends them to the sinks: structured (JSON) logs, CloudWatch embedded metric
+format or StatsD. Without sinks spans are a shared no-op object, so
+instrumented code costs a method call. Spans started from another span
+(or from the trace context of an Airflow XCom or the TRACE_ID and
+PARENT_SPAN_ID environment variables) share its trace id, so the tasks of
+a DAG run can be followed across processes. Only uses the standard
+library: it ships to MWAA with the DAGs.
+"""
+import datetime
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+logger = logging.getLogger("data_platform.metrics")
+
+
+class LogSink:
+    """
+    One JSON log line per span
+    """
+
+    def __init__(self, level: int = logging.INFO):
+        self.level = level
+
+    def emit(self, record: dict) -> None:
+        logger.log(self.level, json.dumps(record, default=str, sort_keys=True))
+
+
+class EmfSink:
+    """
+    CloudWatch embedded metric format: a JSON line CloudWatch Logs turns into
+    metrics (the span's seconds and counters), dimensioned by span name and
+    its text attributes
+    """
+
+    def __init__(self, namespace: str = "DataPlatform", stream=None):
+        self.namespace = namespace
+        self.stream = stream
+
+    def emit(self, record: dict) -> None:
+        dimensions = {"span": record["name"]}
+        dimensions.update(
+            (name, value)
+            for name, value in record["attributes"].items()
+            if isinstance(value, str)
+        )
+        metrics = {"seconds": record["seconds"]}
+        metrics.update(record["counters"])
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [
+                            {
+                                "Name": name,
+                                "Unit": "Seconds" if name == "seconds" else "Count",
+                            }
+                            for name in metrics
+                        ],
+                    }
+                ],
+            },
+            "trace_id": record["trace_id"],
+            "span_id": record["span_id"],
+            "status": record["status"],
+        }
+        document.update(dimensions)
+        document.update(metrics)
+        stream = self.stream or sys.stdout
+        stream.write(json.dumps(document, default=str) + "\n")
+        stream.flush()
+
+
+class StatsdSink:
+    """
+    StatsD timers and counters over UDP, named <prefix>.<span>.<metric>,
+    with the text attributes as DogStatsD tags when tags is set.
+    Sending never raises: metrics are lost rather than failing the job.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 8125,
+        prefix: str = "data_platform",
+        tags: bool = False,
+    ):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.tags = tags
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, record: dict) -> None:
+        name = f"{self.prefix}.{record['name']}"
+        suffix = ""
+        if self.tags:
+            tags = [
+                f"{key}:{value}"
+                for key, value in record["attributes"].items()
+                if isinstance(value, str)
+            ]
+            suffix = "|#" + ",".join(tags) if tags else ""
+        lines = [f"{name}.seconds:{record['seconds'] * 1000:.3f}|ms{suffix}"]
+        lines.extend(
+            f"{name}.{counter}:{value}|c{suffix}"
+            for counter, value in record["counters"].items()
+        )
+        try:
+            self.socket.sendto("\n".join(lines).encode(), self.address)
+        except OSError:
+            logger.debug("Dropped StatsD metrics of %s", record["name"])
+
+
+SINKS = {"log": LogSink, "emf": EmfSink, "statsd": StatsdSink}
+
+
+class NoopSpan:
+    """
+    What spans are without sinks: nothing is timed, counted or sent
+    """
+
+    context = {}
+
+    def count(self, name: str, value=1) -> None:
+        pass
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    """
+    Times a block of code and accumulates counters (rows, bytes...) for it
+    """
+
+    def __init__(
+        self,
+        instrumentation: "Instrumentation",
+        name: str,
+        trace_id: str,
+        parent_id: str,
+        attributes: dict,
+    ):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.counters = defaultdict(int)
+        self.started_at = None
+        self.start = None
+
+    @property
+    def context(self) -> dict:
+        """
+        What a child span in another task or process needs, e.g. as an XCom
+        """
+        return {"trace_id": self.trace_id, "span_id": self.span_id}
+
+    def count(self, name: str, value=1) -> None:
+        self.counters[name] += value
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.started_at = datetime.datetime.utcnow()
+        self.start = time.perf_counter()
+        self.instrumentation.enter(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        self.instrumentation.exit(self)
+        record = {
+            "type": "span",
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "started_at": self.started_at.isoformat(),
+            "seconds": seconds,
+            "status": "ok" if exc_type is None else "error",
+            "attributes": self.attributes,
+            "counters": dict(self.counters),
+        }
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc_value}"
+        self.instrumentation.emit(record)
+        return False
+
+
+class Instrumentation:
+    """
+    Creates spans and sends them to the sinks. A new span's parent is the
+    innermost open span of its thread, else the innermost open span of the
+    thread that opened the outermost one (so spans of worker threads join
+    the stage that started them), else the parent context the
+    instrumentation was created with.
+    """
+
+    def __init__(self, sinks: list = (), parent: dict = None):
+        self.sinks = list(sinks)
+        parent = parent or {}
+        self.trace_id = parent.get("trace_id") or uuid.uuid4().hex
+        self.parent_id = parent.get("span_id")
+        self.local = threading.local()
+        # span stack of the thread that opened the outermost span
+        self.root_stack = None
+
+    @classmethod
+    def from_environment(cls, default: str = "", parent: dict = None):
+        """
+        Sinks named in INSTRUMENTATION_SINKS (comma separated: log, emf,
+        statsd; none by default), joining the trace of TRACE_ID and
+        PARENT_SPAN_ID when set. STATSD_HOST, STATSD_PORT and EMF_NAMESPACE
+        configure those sinks.
+        """
+        names = os.environ.get("INSTRUMENTATION_SINKS", default)
+        sinks = []
+        for name in filter(None, (name.strip() for name in names.split(","))):
+            if name == "statsd":
+                sinks.append(
+                    StatsdSink(
+                        host=os.environ.get("STATSD_HOST", "localhost"),
+                        port=int(os.environ.get("STATSD_PORT", 8125)),
+                    )
+                )
+            elif name == "emf":
+                sinks.append(
+                    EmfSink(namespace=os.environ.get("EMF_NAMESPACE", "DataPlatform"))
+                )
+            elif name in SINKS:
+                sinks.append(SINKS[name]())
+            else:
+                raise ValueError(f"Unknown instrumentation sink {name}")
+        if parent is None and os.environ.get("TRACE_ID"):
+            parent = {
+                "trace_id": os.environ["TRACE_ID"],
+                "span_id": os.environ.get("PARENT_SPAN_ID"),
+            }
+        return cls(sinks, parent=parent)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sinks)
+
+    def stack(self) -> list:
+        if not hasattr(self.local, "spans"):
+            self.local.spans = []
+        return self.local.spans
+
+    def span(self, name: str, **attributes):
+        if not self.sinks:
+            return NOOP_SPAN
+        return Span(self, name, self.trace_id, self.current_span_id(), attributes)
+
+    def current_span_id(self) -> str:
+        stack = self.stack() or self.root_stack or ()
+        return stack[-1].span_id if stack else self.parent_id
+
+    def enter(self, span: Span) -> None:
+        stack = self.stack()
+        stack.append(span)
+        if not self.root_stack:
+            self.root_stack = stack
+
+    def exit(self, span: Span) -> None:
+        stack = self.stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+
+    def emit(self, record: dict) -> None:
+        for sink in self.sinks:
+            sink.emit(record)
+
+    def record(
+        self,
+        name: str,
+        seconds: float,
+        counters: dict = None,
+        started_at: datetime.datetime = None,
+        error: str = None,
+        **attributes,
+    ) -> None:
+        """
+        Sends a span timed elsewhere, e.g. by the service that ran it
+        """
+        if not self.sinks:
+            return
+        record = {
+            "type": "span",
+            "name": name,
+            "trace_id": self.trace_id,
+            "span_id": uuid.uuid4().hex[:16],
+            "parent_id": self.current_span_id(),
+            "started_at": started_at.isoformat() if started_at else None,
+            "seconds": seconds,
+            "status": "ok" if error is None else "error",
+            "attributes": attributes,
+            "counters": counters or {},
+        }
+        if error is not None:
+            record["error"] = error
+        self.emit(record)
+
+
+def airflow_task_callback(context: dict) -> None:
+    """
+    on_success_callback / on_failure_callback recording each task of a DAG
+    run as a span of the trace the start_trace task pushed to XCom
+    """
+    task_instance = context["task_instance"]
+    parent = task_instance.xcom_pull(task_ids="start_trace") or {}
+    instrumentation = Instrumentation.from_environment(default="log", parent=parent)
+    started_at = task_instance.start_date
+    seconds = 0.0
+    if started_at:
+        now = datetime.datetime.now(started_at.tzinfo)
+        seconds = (now - started_at).total_seconds()
+    exception = context.get("exception")
+    instrumentation.record(
+        "airflow_task",
+        seconds,
+        started_at=started_at,
+        error=str(exception) if exception else None,
+        dag_id=task_instance.dag_id,
+        task_id=task_instance.task_id,
+        try_number=task_instance.try_number,
+    )
+
+
+def start_trace(**context) -> dict:
+    """
+    First task of a DAG run: its return value (an XCom) is the trace context
+    the other tasks' spans join
+    """
+    instrumentation = Instrumentation.from_environment(default="log")
+    with instrumentation.span("dag_run", run_id=context.get("run_id")) as span:
+        return span.context or {"trace_id": instrumentation.trace_id}
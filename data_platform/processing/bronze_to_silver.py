@@ -0,0 +1,383 @@
+import argparse
+import os
+import posixpath
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from data_platform.data_definitions import TABLES
+from data_platform.instrumentation import Instrumentation
+from data_platform.processing.quality import (
+    TableValidator,
+    quarantine_schema,
+    reference_filter,
+)
+from data_platform.processing.storage import (
+    BRONZE_PREFIX,
+    SILVER_PREFIX,
+    QUARANTINE_PREFIX,
+    resolve,
+    table_path,
+    list_files,
+    state_path,
+    staging_directory,
+    delete_file,
+    write_json,
+    write_manifest,
+)
+
+# spans of the jobs, sent to the sinks of INSTRUMENTATION_SINKS (none by default)
+instrumentation = Instrumentation.from_environment()
+
+
+class SilverTable(NamedTuple):
+    """
+    How a bronze (DMS) table is typed, derived and partitioned in silver
+    """
+
+    name: str
+    schema: pa.Schema
+    partition_column: Optional[str] = None
+    derive: Optional[Callable] = None
+
+
+def cast(array: pa.Array, target: pa.DataType) -> pa.Array:
+    """
+    Casts a column to its silver type. Dates stored as text are parsed
+    as timestamps first, since Arrow can't cast strings to dates directly.
+    """
+    if array.type == target:
+        return array
+    if pa.types.is_string(array.type) and pa.types.is_date(target):
+        array = pc.cast(array, pa.timestamp("us"))
+    return pc.cast(array, target)
+
+
+def derive_geolocation(columns: dict) -> dict:
+    zip_code_prefix = columns["geolocation_zip_code_prefix"]
+    return {
+        f"geolocation_zip_code_prefix_{digits}": pc.utf8_slice_codeunits(
+            zip_code_prefix, 0, digits
+        )
+        for digits in range(1, 5)
+    }
+
+
+def derive_orders(columns: dict) -> dict:
+    return {
+        "order_purchase_date": pc.cast(columns["order_purchase_timestamp"], pa.date32())
+    }
+
+
+def derive_order_items(columns: dict) -> dict:
+    # order_item_qty is the item sequential inside an order, so
+    # order_id + sequential identifies a row
+    return {
+        "order_item_id": pc.binary_join_element_wise(
+            columns["order_id"], pc.cast(columns["order_item_qty"], pa.string()), "-"
+        )
+    }
+
+
+# silver columns computed from the bronze ones, by table
+DERIVE = {
+    "geolocation": derive_geolocation,
+    "orders": derive_orders,
+    "order_items": derive_order_items,
+}
+
+SILVER_TABLES = {
+    table.name: SilverTable(
+        name=table.name,
+        schema=table.arrow_schema(),
+        partition_column=table.partition_column,
+        derive=DERIVE.get(table.name),
+    )
+    for table in TABLES.values()
+}
+
+
+def to_silver(batch: pa.RecordBatch, table: SilverTable) -> pa.RecordBatch:
+    """
+    Types a bronze record batch and adds the derived silver columns.
+    Columns missing from the batch are filled with nulls and the DMS
+    Op column is dropped.
+    """
+    columns = {
+        field.name: cast(batch.column(field.name), field.type)
+        for field in table.schema
+        if field.name in batch.schema.names
+    }
+    if table.derive:
+        columns.update(table.derive(columns))
+    return pa.RecordBatch.from_arrays(
+        [
+            columns.get(field.name, pa.nulls(batch.num_rows, field.type))
+            for field in table.schema
+        ],
+        schema=table.schema,
+    )
+
+
+def is_full_load_file(path: str) -> bool:
+    """
+    DMS names full load files LOAD00000001.parquet, LOAD00000002.parquet...
+    Everything else in a table folder is change data capture output.
+    """
+    return os.path.basename(path).startswith("LOAD")
+
+
+def full_load_files(
+    bronze_fs: fs.FileSystem, bronze_root: str, table_name: str
+) -> list:
+    return [
+        info.path
+        for info in list_files(
+            bronze_fs, table_path(bronze_root, BRONZE_PREFIX, table_name)
+        )
+        if is_full_load_file(info.path)
+    ]
+
+
+def reference_filters(
+    table_name: str, bronze_fs: fs.FileSystem, bronze_root: str, changes: bool = False
+) -> dict:
+    """
+    Bloom filters of the keys a table references, read from the full load
+    of the referenced tables. Tables that weren't loaded aren't checked.
+    With changes, the keys of their CDC files are added too, so merged rows
+    can reference rows inserted after the full load.
+    """
+    filters = {}
+    for foreign_key in TABLES[table_name].foreign_keys:
+        if changes:
+            source = [
+                info.path
+                for info in list_files(
+                    bronze_fs, table_path(bronze_root, BRONZE_PREFIX, foreign_key.table)
+                )
+            ]
+        else:
+            source = full_load_files(bronze_fs, bronze_root, foreign_key.table)
+        if foreign_key.table == table_name or not source:
+            continue
+        dataset = ds.dataset(source, filesystem=bronze_fs, format="parquet")
+        filters[foreign_key] = reference_filter(
+            dataset.to_batches(columns=list(foreign_key.referenced_columns)),
+            foreign_key,
+            keys=dataset.count_rows(),
+        )
+    return filters
+
+
+def write_silver(
+    batches,
+    table: SilverTable,
+    filesystem: fs.FileSystem,
+    path: str,
+    compression: str = "snappy",
+    row_group_size: int = 256_000,
+    max_rows_per_file: int = 4_000_000,
+    existing_data_behavior: str = "overwrite_or_ignore",
+) -> list:
+    """
+    Writes typed record batches as (date partitioned) Parquet.
+    Only a few row groups per open file are buffered, so memory stays bounded.
+    Returns the written file paths.
+    """
+    written = []
+    partitioning = None
+    if table.partition_column:
+        partitioning = ds.partitioning(
+            pa.schema([table.schema.field(table.partition_column)]), flavor="hive"
+        )
+    ds.write_dataset(
+        batches,
+        path,
+        filesystem=filesystem,
+        format="parquet",
+        schema=table.schema,
+        partitioning=partitioning,
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+        max_rows_per_group=row_group_size,
+        max_rows_per_file=max_rows_per_file,
+        max_open_files=256,
+        existing_data_behavior=existing_data_behavior,
+        file_visitor=lambda written_file: written.append(written_file.path),
+    )
+    return written
+
+
+def replace_files(filesystem: fs.FileSystem, staging: str, target: str) -> list:
+    """
+    Replaces the files of a table folder with the ones staged for it. The
+    staged files are moved in before the previous ones are deleted, so the
+    table stays readable while it is rebuilt. Returns the moved file paths.
+    """
+    previous = list_files(filesystem, target)
+    published = []
+    for info in list_files(filesystem, staging):
+        path = target + info.path[len(staging) :]
+        filesystem.create_dir(posixpath.dirname(path), recursive=True)
+        filesystem.move(info.path, path)
+        published.append(path)
+    for info in previous:
+        filesystem.delete_file(info.path)
+    return published
+
+
+def process_table(
+    table_name: str,
+    bronze_uri: str,
+    silver_uri: str,
+    compression: str = "snappy",
+    batch_size: int = 64_000,
+    validate: bool = True,
+) -> dict:
+    """
+    Rebuilds a silver table from the DMS full load files in bronze.
+    Unless validate is off, rows breaking the registry's constraints go to
+    the table's quarantine folder instead, with the check they failed, and
+    the rows caught by each check are recorded in _state/quality.
+    The rebuild is written to the staging folder and only replaces the
+    table, its quarantine and CDC watermark once it is complete.
+    """
+    start = time.perf_counter()
+    table = SILVER_TABLES[table_name]
+    bronze_fs, bronze_root = resolve(bronze_uri)
+    silver_fs, silver_root = resolve(silver_uri)
+    target = table_path(silver_root, SILVER_PREFIX, table_name)
+    quarantine_target = table_path(silver_root, QUARANTINE_PREFIX, table_name)
+
+    staging = staging_directory(silver_root, "bronze_to_silver", table_name)
+    # files left by an interrupted rebuild
+    if silver_fs.get_file_info(staging).type == fs.FileType.Directory:
+        silver_fs.delete_dir_contents(staging)
+    run = f"{staging}/{uuid.uuid4().hex}"
+    staged_target, staged_quarantine = f"{run}/table", f"{run}/quarantine"
+
+    source = full_load_files(bronze_fs, bronze_root, table_name)
+
+    validator = None
+    if validate:
+        validator = TableValidator(
+            TABLES[table_name], reference_filters(table_name, bronze_fs, bronze_root)
+        )
+    rows = 0
+    quarantined = []
+    span = instrumentation.span("bronze_to_silver", table=table_name)
+    with span:
+        if source:
+            dataset = ds.dataset(source, filesystem=bronze_fs, format="parquet")
+
+            def batches():
+                nonlocal rows
+                for batch in dataset.to_batches(batch_size=batch_size):
+                    rows += batch.num_rows
+                    silver = to_silver(batch, table)
+                    if validator:
+                        silver, rejected = validator.validate(silver)
+                        if rejected is not None:
+                            quarantined.append(rejected)
+                    yield silver
+
+            write_silver(
+                batches(), table, silver_fs, staged_target, compression=compression
+            )
+        if quarantined:
+            write_silver(
+                quarantined,
+                SilverTable(table_name, quarantine_schema(table.schema)),
+                silver_fs,
+                staged_quarantine,
+                compression=compression,
+            )
+        written = replace_files(silver_fs, staged_target, target)
+        write_manifest(silver_fs, silver_root, table_name, written)
+        replace_files(silver_fs, staged_quarantine, quarantine_target)
+        silver_fs.delete_dir_contents(staging, missing_dir_ok=True)
+        # the rebuilt table only holds the full load, so CDC has to be replayed
+        delete_file(silver_fs, state_path(silver_root, "cdc", table_name))
+        span.count("rows", rows)
+        if validator:
+            span.count("quarantined", validator.quarantined)
+
+    stats = {
+        "table": table_name,
+        "rows": rows,
+        "files": len(written),
+        "bytes": sum(info.size for info in silver_fs.get_file_info(written)),
+        "seconds": time.perf_counter() - start,
+    }
+    if validator:
+        report = validator.report()
+        write_json(silver_fs, state_path(silver_root, "quality", table_name), report)
+        stats["quality"] = report
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Type, derive and partition the DMS bronze tables into silver"
+    )
+    parser.add_argument(
+        "--bronze", required=True, help="Bronze bucket uri (s3://...) or directory"
+    )
+    parser.add_argument(
+        "--silver", required=True, help="Silver bucket uri (s3://...) or directory"
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        default=list(SILVER_TABLES),
+        choices=list(SILVER_TABLES),
+    )
+    parser.add_argument("--compression", default="snappy", choices=["snappy", "zstd"])
+    parser.add_argument(
+        "--batch-size", type=int, default=64_000, help="Rows read per record batch"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Tables processed at once"
+    )
+    parser.add_argument(
+        "--skip-validation",
+        action="store_true",
+        help="Write every row to silver, without the data quality checks",
+    )
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(
+                process_table,
+                table_name,
+                args.bronze,
+                args.silver,
+                compression=args.compression,
+                batch_size=args.batch_size,
+                validate=not args.skip_validation,
+            )
+            for table_name in args.tables
+        ]
+        for future in futures:
+            stats = future.result()
+            print(
+                f"{stats['table']}: {stats['rows']} rows, {stats['files']} files, "
+                f"{stats['bytes'] / 1e6:.1f} MB in {stats['seconds']:.1f}s "
+                f"({stats['rows'] / max(stats['seconds'], 1e-9):,.0f} rows/s)"
+            )
+            quality = stats.get("quality", {})
+            for check, count in quality.items():
+                if check not in ("rows", "quarantined") and count:
+                    print(f"  quarantined {count} rows with {check}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+import argparse
+import os
+import posixpath
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from data_platform.definitions import db_name
+from data_platform.data_definitions import TABLES, primary_keys
+from data_platform.processing.bronze_to_silver import (
+    SILVER_TABLES,
+    SilverTable,
+    to_silver,
+    is_full_load_file,
+    reference_filters,
+    write_silver,
+)
+from data_platform.processing.compaction import (
+    visible_files,
+    file_day,
+    change_key,
+    is_compacted_file,
+    replaced_files,
+)
+from data_platform.processing.quality import TableValidator, quarantine_schema
+from data_platform.processing.storage import (
+    BRONZE_PREFIX,
+    SILVER_PREFIX,
+    QUARANTINE_PREFIX,
+    resolve,
+    table_path,
+    list_files,
+    state_path,
+    read_json,
+    write_json,
+    write_manifest,
+)
+
+# separates the values of composite keys once they are joined into one string
+KEY_SEPARATOR = "\x1f"
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def watermark_path(silver_root: str, table_name: str) -> str:
+    return state_path(silver_root, "cdc", table_name)
+
+
+def key_array(table: pa.Table, keys: list) -> pa.ChunkedArray:
+    """
+    Returns one string per row identifying its primary key
+    """
+    columns = [pc.fill_null(pc.cast(table[key], pa.string()), "") for key in keys]
+    if len(columns) == 1:
+        return columns[0]
+    return pc.binary_join_element_wise(*columns, KEY_SEPARATOR)
+
+
+def change_order(changes: pa.Table) -> np.ndarray:
+    """
+    Row order of changes by extracted_at, ties keep the order they were read in
+    """
+    extracted = pc.fill_null(
+        pc.cast(changes["extracted_at"], pa.int64()), np.iinfo(np.int64).min
+    ).to_numpy()
+    return np.argsort(extracted, kind="stable")
+
+
+def latest_per_key(changes: pa.Table, keys: list) -> pa.Table:
+    """
+    Collapses changes to the last operation of each primary key
+    """
+    order = change_order(changes)
+    key_values = key_array(changes, keys).to_numpy()[order]
+    # first occurrence in the reversed order is the last change of each key
+    _, last = np.unique(key_values[::-1], return_index=True)
+    return changes.take(np.sort(order[::-1][last]))
+
+
+def inserted_keys(changes: pa.Table, keys: list) -> pa.Array:
+    """
+    Returns the keys whose first change is an insert, which silver can't
+    hold yet
+    """
+    order = change_order(changes)
+    key_values = key_array(changes, keys).to_numpy()[order]
+    _, first = np.unique(key_values, return_index=True)
+    operations = changes["Op"].to_numpy()[order][first]
+    return pa.array(key_values[first][operations == "I"], pa.string())
+
+
+def partition_directory(target: str, table: SilverTable, value) -> str:
+    if not table.partition_column:
+        return target
+    value = HIVE_NULL_PARTITION if value is None else value.isoformat()
+    return f"{target}/{table.partition_column}={value}"
+
+
+def merged_rows(filesystem, path: str, last_file: str) -> int:
+    """
+    Rows of a file that were merged already: those of the CDC files up to
+    last_file, when a compacted file replaced them after they were merged
+    """
+    if not last_file:
+        return 0
+    return sum(
+        rows
+        for name, rows in replaced_files(filesystem, path)
+        if change_key(name) <= change_key(last_file)
+    )
+
+
+def read_changes(
+    filesystem, files: list, table: SilverTable, skipped_rows: dict = None
+) -> pa.Table:
+    """
+    Reads CDC files into silver typed rows, keeping the DMS Op column.
+    skipped_rows maps files to the number of their first rows to leave out.
+    """
+    skipped_rows = skipped_rows or {}
+    schema = table.schema.append(pa.field("Op", pa.string()))
+    batches = []
+    dataset = ds.dataset(files, filesystem=filesystem, format="parquet")
+    for fragment in dataset.get_fragments():
+        skip = skipped_rows.get(fragment.path, 0)
+        for batch in fragment.to_batches(schema=dataset.schema):
+            if skip:
+                skipped = min(skip, batch.num_rows)
+                batch, skip = batch.slice(skipped), skip - skipped
+            if not batch.num_rows:
+                continue
+            silver = to_silver(batch, table)
+            batches.append(
+                pa.RecordBatch.from_arrays(
+                    silver.columns + [batch.column("Op")], schema=schema
+                )
+            )
+    return pa.Table.from_batches(batches, schema=schema)
+
+
+def validate_rows(validator: TableValidator, rows: pa.Table, quarantined: list):
+    """
+    Keeps the rows passing the validator's checks, adding the others to
+    quarantined
+    """
+    valid = []
+    for batch in rows.to_batches():
+        batch, rejected = validator.validate(batch)
+        valid.append(batch)
+        if rejected is not None:
+            quarantined.append(rejected)
+    return pa.Table.from_batches(valid, schema=rows.schema)
+
+
+def touched_directories(
+    filesystem, target: str, keys: list, touched_keys: pa.Array, partitions=()
+) -> set:
+    """
+    Finds the silver files holding any of the touched keys, reading only
+    the key columns, and returns their directories. The partition
+    directories given are searched first, the rest of the table only for
+    the keys they don't hold.
+    """
+    directories = set()
+    if not len(touched_keys):
+        return directories
+    if filesystem.get_file_info(target).type != fs.FileType.Directory:
+        return directories
+    fragments = list(
+        ds.dataset(target, filesystem=filesystem, format="parquet").get_fragments()
+    )
+    remaining = touched_keys
+    in_partitions = [
+        posixpath.dirname(fragment.path) in partitions for fragment in fragments
+    ]
+    for searched_first in (True, False):
+        group = [
+            fragment
+            for fragment, first in zip(fragments, in_partitions)
+            if first == searched_first
+        ]
+        found = []
+        for fragment in group:
+            existing = key_array(fragment.to_table(columns=keys), keys)
+            matches = pc.is_in(existing, value_set=remaining)
+            if pc.any(matches).as_py():
+                directories.add(posixpath.dirname(fragment.path))
+                found.append(pc.filter(existing, matches).combine_chunks())
+        if found:
+            remaining = pc.filter(
+                remaining,
+                pc.invert(pc.is_in(remaining, value_set=pa.concat_arrays(found))),
+            )
+        if not len(remaining):
+            break
+    return directories
+
+
+def rewrite_directory(
+    filesystem,
+    directory: str,
+    schema: pa.Schema,
+    keys: list,
+    touched_keys: pa.Array,
+    upserts: pa.Table,
+    compression: str,
+) -> Optional[str]:
+    """
+    Replaces the touched keys of a silver partition with their latest state.
+    The new file is written before the old ones are removed.
+    Returns the written file, or None when the partition ends up empty.
+    """
+    files = [info.path for info in list_files(filesystem, directory)]
+    existing = ds.dataset(
+        files, filesystem=filesystem, format="parquet", schema=schema
+    ).to_table()
+    kept = existing.filter(
+        pc.invert(pc.is_in(key_array(existing, keys), value_set=touched_keys))
+    )
+    merged = pa.concat_tables([kept, upserts.select(schema.names).cast(schema)])
+    written = None
+    if merged.num_rows:
+        written = f"{directory}/part-{uuid.uuid4().hex}-0.parquet"
+        filesystem.create_dir(directory, recursive=True)
+        pq.write_table(merged, written, filesystem=filesystem, compression=compression)
+    for path in files:
+        filesystem.delete_file(path)
+    if not merged.num_rows and files:
+        filesystem.delete_dir(directory)
+    return written
+
+
+def merge_table(
+    table_name: str,
+    bronze_uri: str,
+    silver_uri: str,
+    compression: str = "snappy",
+    validate: bool = True,
+) -> dict:
+    """
+    Applies the CDC files written since the last run to a silver table.
+    Changes are collapsed to the latest state per primary key and only the
+    partitions holding those keys are rewritten. Tables without a primary
+    key only receive inserts, as DMS can't capture their updates and deletes.
+    Unless validate is off, new row versions are checked like the full load:
+    failing ones go to the quarantine folder, and the silver row they would
+    have replaced is kept.
+    """
+    start = time.perf_counter()
+    table = SILVER_TABLES[table_name]
+    keys = primary_keys[f"{db_name}.{table_name}"]
+    bronze_fs, bronze_root = resolve(bronze_uri)
+    silver_fs, silver_root = resolve(silver_uri)
+    source = table_path(bronze_root, BRONZE_PREFIX, table_name)
+    target = table_path(silver_root, SILVER_PREFIX, table_name)
+    quarantine_target = table_path(silver_root, QUARANTINE_PREFIX, table_name)
+    watermark = read_json(silver_fs, watermark_path(silver_root, table_name), {})
+
+    # CDC file names are timestamps, so everything after the last file is new.
+    # Names are compared without their folders, which DMS date partitioning
+    # adds, and only the date folders from the last file's day on are listed.
+    # A compacted file sorts right after the last CDC file it replaced, and
+    # its rows from files merged before the compaction are skipped.
+    last_file = posixpath.basename(watermark.get("last_file", ""))
+    files = sorted(
+        (
+            info.path
+            for info in visible_files(
+                bronze_fs, bronze_root, table_name, since_day=file_day(last_file)
+            )
+            if not is_full_load_file(info.path)
+            and (not last_file or change_key(info.path) > change_key(last_file))
+        ),
+        key=change_key,
+    )
+    stats = {"table": table_name, "files": len(files), "changes": 0, "partitions": 0}
+    if not files:
+        return dict(stats, seconds=time.perf_counter() - start)
+
+    # the file name watermark alone decides what is new: DMS can write
+    # changes sharing the last extracted_at to a later file
+    changes = read_changes(
+        bronze_fs,
+        files,
+        table,
+        skipped_rows={
+            path: merged_rows(bronze_fs, path, last_file)
+            for path in files
+            if is_compacted_file(path)
+        },
+    )
+    stats["changes"] = changes.num_rows
+
+    validator = None
+    if validate and changes.num_rows:
+        validator = TableValidator(
+            TABLES[table_name],
+            reference_filters(table_name, bronze_fs, bronze_root, changes=True),
+        )
+    written = []
+    quarantined = []
+    if changes.num_rows and not keys:
+        inserts = changes.filter(pc.equal(changes["Op"], "I")).drop(["Op"])
+        if validator:
+            inserts = validate_rows(validator, inserts, quarantined)
+        written = write_silver(
+            inserts.to_batches(), table, silver_fs, target, compression=compression
+        )
+    elif changes.num_rows:
+        latest = latest_per_key(changes, keys)
+        deletes = latest.filter(pc.equal(latest["Op"], "D")).drop(["Op"])
+        upserts = latest.filter(pc.not_equal(latest["Op"], "D")).drop(["Op"])
+        if validator:
+            upserts = validate_rows(validator, upserts, quarantined)
+        # keys of rejected upserts aren't touched, so their silver row stays
+        touched_keys = pa.array(
+            key_array(pa.concat_tables([deletes, upserts]), keys).to_pylist(),
+            pa.string(),
+        )
+
+        # group new row versions by the partition they belong to
+        rows_by_directory = defaultdict(list)
+        partition_values = (
+            upserts[table.partition_column].to_pylist()
+            if table.partition_column
+            else [None] * upserts.num_rows
+        )
+        for row, value in enumerate(partition_values):
+            rows_by_directory[partition_directory(target, table, value)].append(row)
+
+        # existing rows are looked for in the partitions of their changes
+        # first, and inserted keys aren't looked for at all
+        existing_keys = pc.filter(
+            touched_keys,
+            pc.invert(pc.is_in(touched_keys, value_set=inserted_keys(changes, keys))),
+        )
+        change_directories = set(rows_by_directory)
+        if table.partition_column:
+            change_directories.update(
+                partition_directory(target, table, value)
+                for value in deletes[table.partition_column].to_pylist()
+            )
+        directories = touched_directories(
+            silver_fs, target, keys, existing_keys, partitions=change_directories
+        )
+        directories.update(rows_by_directory)
+        file_schema = pa.schema(
+            [field for field in table.schema if field.name != table.partition_column]
+        )
+        for directory in sorted(directories):
+            path = rewrite_directory(
+                silver_fs,
+                directory,
+                file_schema,
+                keys,
+                touched_keys,
+                upserts.take(
+                    pa.array(rows_by_directory.get(directory, []), pa.int64())
+                ),
+                compression,
+            )
+            if path:
+                written.append(path)
+        stats["partitions"] = len(directories)
+    write_manifest(silver_fs, silver_root, table_name, written)
+    if quarantined:
+        write_silver(
+            quarantined,
+            SilverTable(table_name, quarantine_schema(table.schema)),
+            silver_fs,
+            quarantine_target,
+            compression=compression,
+        )
+    if validator:
+        report = validator.report()
+        write_json(
+            silver_fs, state_path(silver_root, "quality", "cdc", table_name), report
+        )
+        stats["quality"] = report
+
+    write_json(
+        silver_fs,
+        watermark_path(silver_root, table_name),
+        {"last_file": posixpath.relpath(files[-1], source)},
+    )
+    return dict(stats, seconds=time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge the DMS change data capture files into silver"
+    )
+    parser.add_argument(
+        "--bronze", required=True, help="Bronze bucket uri (s3://...) or directory"
+    )
+    parser.add_argument(
+        "--silver", required=True, help="Silver bucket uri (s3://...) or directory"
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        default=list(SILVER_TABLES),
+        choices=list(SILVER_TABLES),
+    )
+    parser.add_argument("--compression", default="snappy", choices=["snappy", "zstd"])
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Tables merged at once"
+    )
+    parser.add_argument(
+        "--skip-validation",
+        action="store_true",
+        help="Merge every change into silver, without the data quality checks",
+    )
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(
+                merge_table,
+                table_name,
+                args.bronze,
+                args.silver,
+                compression=args.compression,
+                validate=not args.skip_validation,
+            )
+            for table_name in args.tables
+        ]
+        for future in futures:
+            stats = future.result()
+            print(
+                f"{stats['table']}: {stats['changes']} changes from {stats['files']} "
+                f"files, {stats['partitions']} partitions rewritten "
+                f"in {stats['seconds']:.1f}s"
+            )
+            quality = stats.get("quality", {})
+            for check, count in quality.items():
+                if check not in ("rows", "quarantined") and count:
+                    print(f"  quarantined {count} rows with {check}")
+
+
+if __name__ == "__main__":
+    main()
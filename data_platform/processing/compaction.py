@@ -0,0 +1,380 @@
+import argparse
+import datetime
+import json
+import posixpath
+import re
+import time
+from collections import defaultdict
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from data_platform.processing.bronze_to_silver import SILVER_TABLES, is_full_load_file
+from data_platform.processing.storage import (
+    BRONZE_PREFIX,
+    resolve,
+    table_path,
+    list_files,
+    state_directory,
+    state_path,
+    staging_directory,
+    read_json,
+    write_json,
+    delete_file,
+)
+
+# DMS names CDC files after their commit time: 20210520-110000123.parquet
+CDC_FILE_PATTERN = re.compile(r"^((\d{8})-\d+)\.parquet$")
+# compacted files are named after the last CDC file they replace
+COMPACTED_FILE_PATTERN = re.compile(r"^((\d{8})-\d+)-compacted-.+\.parquet$")
+# Parquet metadata of compacted files: the [CDC file name, rows] they hold
+REPLACED_FILES_KEY = b"replaced_files"
+
+
+def is_compacted_file(path: str) -> bool:
+    return bool(COMPACTED_FILE_PATTERN.match(posixpath.basename(path)))
+
+
+def change_key(path: str) -> tuple:
+    """
+    Orders CDC and compacted files by the changes they hold: a compacted
+    file right after the last CDC file it replaces, and before the next one
+    """
+    name = posixpath.basename(path)
+    match = CDC_FILE_PATTERN.match(name)
+    if match:
+        return match.group(1), 0
+    match = COMPACTED_FILE_PATTERN.match(name)
+    if match:
+        return match.group(1), 1
+    return name, 0
+
+
+def replaced_files(filesystem, path: str) -> list:
+    """
+    The [CDC file name, rows] a file holds, in commit order: those a
+    compacted file replaced, or the file itself
+    """
+    metadata = pq.read_metadata(path, filesystem=filesystem)
+    replaced = (metadata.metadata or {}).get(REPLACED_FILES_KEY)
+    if replaced:
+        return json.loads(replaced)
+    return [[posixpath.basename(path), metadata.num_rows]]
+
+
+def file_day(path: str) -> str:
+    """
+    Returns the YYYYMMDD day of a CDC or compacted file, or None
+    """
+    name = posixpath.basename(path)
+    match = CDC_FILE_PATTERN.match(name) or COMPACTED_FILE_PATTERN.match(name)
+    return match.group(2) if match else None
+
+
+def manifest_paths(filesystem, bronze_root: str, table_name: str) -> list:
+    return [
+        info.path
+        for info in list_files(
+            filesystem,
+            state_directory(bronze_root, "compaction", table_name),
+            suffix=".json",
+        )
+    ]
+
+
+def read_manifests(filesystem, bronze_root: str, table_name: str) -> list:
+    """
+    Manifests of the compactions whose replaced files aren't deleted yet
+    (older ones are pruned), so there are only a few to read
+    """
+    return [
+        read_json(filesystem, path)
+        for path in manifest_paths(filesystem, bronze_root, table_name)
+    ]
+
+
+def files_since(filesystem, directory: str, since: list) -> list:
+    """
+    Lists the files under directory, skipping the DMS date folders
+    (YYYY/MM/DD) before since, the [YYYY, MM, DD] of a day
+    """
+    files = []
+    for info in filesystem.get_file_info(
+        fs.FileSelector(directory, allow_not_found=True)
+    ):
+        name = posixpath.basename(info.path)
+        if info.type == fs.FileType.File:
+            if name.endswith(".parquet"):
+                files.append(info)
+        elif since and name.isdigit() and len(name) == len(since[0]):
+            if name > since[0]:
+                files.extend(list_files(filesystem, info.path))
+            elif name == since[0]:
+                files.extend(files_since(filesystem, info.path, since[1:]))
+        else:
+            files.extend(list_files(filesystem, info.path))
+    return sorted(files, key=lambda info: info.path)
+
+
+def visible_files(
+    filesystem, bronze_root: str, table_name: str, since_day: str = None
+) -> list:
+    """
+    Lists a bronze table's files as of the last published compaction.
+    A compaction replaces its files once all its outputs are in the table
+    folder: until then its outputs are hidden and the replaced files listed,
+    then the replaced files are hidden (they are deleted in a later run, so
+    readers that listed them before can still read them). Readers that
+    don't go through the manifests, like Athena, see a day's rows twice from
+    the publish until that deletion.
+    With a since_day (YYYYMMDD), date partitioned folders of earlier days
+    aren't listed.
+    """
+    source = table_path(bronze_root, BRONZE_PREFIX, table_name)
+    if since_day:
+        files = files_since(
+            filesystem, source, [since_day[:4], since_day[4:6], since_day[6:8]]
+        )
+    else:
+        files = list_files(filesystem, source)
+    present = {posixpath.relpath(info.path, source) for info in files}
+    hidden = set()
+    for manifest in read_manifests(filesystem, bronze_root, table_name):
+        if all(path in present for path in manifest["added"]):
+            hidden.update(manifest["removed"])
+        else:
+            hidden.update(manifest["added"])
+    return [
+        info for info in files if posixpath.relpath(info.path, source) not in hidden
+    ]
+
+
+def plan_bins(files: list, target_size: int) -> list:
+    """
+    Packs consecutive files (in commit order) into bins of about target_size
+    bytes, so compacted files keep the rows ordered by extracted_at
+    """
+    bins, current, current_size = [], [], 0
+    for info in files:
+        if current and current_size + info.size > target_size:
+            bins.append(current)
+            current, current_size = [], 0
+        current.append(info)
+        current_size += info.size
+    if current:
+        bins.append(current)
+    return [files_bin for files_bin in bins if len(files_bin) > 1]
+
+
+def write_bin(filesystem, files: list, path: str, compression: str) -> int:
+    """
+    Streams a bin of files into one Parquet file, batch by batch, recording
+    the CDC files it replaces in its metadata
+    """
+    replaced = [
+        replaced for info in files for replaced in replaced_files(filesystem, info.path)
+    ]
+    schema = pa.unify_schemas(
+        [
+            pq.read_schema(info.path, filesystem=filesystem).remove_metadata()
+            for info in files
+        ]
+    ).with_metadata({REPLACED_FILES_KEY: json.dumps(replaced)})
+    dataset = ds.dataset(
+        [info.path for info in files],
+        filesystem=filesystem,
+        format="parquet",
+        schema=schema,
+    )
+    rows = 0
+    with pq.ParquetWriter(
+        path, schema, filesystem=filesystem, compression=compression
+    ) as writer:
+        # fragments keep the order of the file list, i.e. commit order
+        for fragment in dataset.get_fragments():
+            for batch in fragment.to_batches(schema=schema):
+                writer.write_table(pa.Table.from_batches([batch], schema=schema))
+                rows += batch.num_rows
+    return rows
+
+
+def publish(filesystem, staging: str, source: str, manifest: dict) -> None:
+    """
+    Moves the staged outputs of a committed compaction into the table folder.
+    Outputs already moved are skipped, so an interrupted publish can resume.
+    """
+    for staged, path in zip(manifest["staged"], manifest["added"]):
+        staged = posixpath.join(staging, staged)
+        if filesystem.get_file_info(staged).type == fs.FileType.File:
+            filesystem.create_dir(
+                posixpath.dirname(posixpath.join(source, path)), recursive=True
+            )
+            filesystem.move(staged, posixpath.join(source, path))
+
+
+def recover(
+    filesystem, bronze_root: str, table_name: str, retention: datetime.timedelta
+) -> int:
+    """
+    Finishes the previous runs: publishes the committed outputs that weren't
+    moved yet and drops the staged outputs of runs that never committed.
+    Files replaced more than retention ago are deleted and their manifests
+    pruned. Returns the number of deleted files.
+    """
+    source = table_path(bronze_root, BRONZE_PREFIX, table_name)
+    staging = staging_directory(bronze_root, "compaction", table_name)
+    expired_before = (datetime.datetime.utcnow() - retention).isoformat()
+    committed, deleted = set(), 0
+    for path in manifest_paths(filesystem, bronze_root, table_name):
+        manifest = read_json(filesystem, path)
+        publish(filesystem, staging, source, manifest)
+        committed.update(manifest["staged"])
+        if manifest["committed_at"] < expired_before:
+            for removed in manifest["removed"]:
+                delete_file(filesystem, posixpath.join(source, removed))
+                deleted += 1
+            filesystem.delete_file(path)
+    for info in list_files(filesystem, staging):
+        if posixpath.relpath(info.path, staging) not in committed:
+            filesystem.delete_file(info.path)
+    return deleted
+
+
+def compact_table(
+    table_name: str,
+    bronze_uri: str,
+    target_size: int = 256 * 1024 * 1024,
+    min_age_days: int = 1,
+    compression: str = "snappy",
+    retention_hours: float = 24,
+) -> dict:
+    """
+    Compacts the small CDC files of each closed day of a table.
+    Outputs are written to a staging folder, a manifest commits the swap,
+    and only then are they moved into the table folder. The replaced files
+    stay readable for retention_hours, and are deleted by a later run.
+    """
+    start = time.perf_counter()
+    run_id = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    last_day = (
+        datetime.datetime.utcnow().date() - datetime.timedelta(days=min_age_days)
+    ).strftime("%Y%m%d")
+    filesystem, bronze_root = resolve(bronze_uri)
+    source = table_path(bronze_root, BRONZE_PREFIX, table_name)
+    staging = staging_directory(bronze_root, "compaction", table_name)
+
+    deleted = recover(
+        filesystem,
+        bronze_root,
+        table_name,
+        datetime.timedelta(hours=retention_hours),
+    )
+
+    files_by_day = defaultdict(list)
+    for info in visible_files(filesystem, bronze_root, table_name):
+        day = file_day(info.path)
+        if (
+            day
+            and day <= last_day
+            and not is_full_load_file(info.path)
+            and info.size < target_size // 2
+        ):
+            files_by_day[posixpath.dirname(info.path), day].append(info)
+
+    stats = {
+        "table": table_name,
+        "removed": 0,
+        "added": 0,
+        "rows": 0,
+        "deleted": deleted,
+    }
+    for (directory, day), files in sorted(files_by_day.items()):
+        bins = plan_bins(files, target_size)
+        if not bins:
+            continue
+        added, staged, removed = [], [], []
+        for number, files_bin in enumerate(bins):
+            last = change_key(files_bin[-1].path)[0]
+            path = posixpath.relpath(
+                f"{directory}/{last}-compacted-{run_id}-{number:04d}.parquet", source
+            )
+            staged_path = posixpath.join(run_id, path)
+            filesystem.create_dir(
+                posixpath.dirname(posixpath.join(staging, staged_path)), recursive=True
+            )
+            stats["rows"] += write_bin(
+                filesystem, files_bin, posixpath.join(staging, staged_path), compression
+            )
+            added.append(path)
+            staged.append(staged_path)
+            removed.extend(posixpath.relpath(info.path, source) for info in files_bin)
+        manifest = {
+            "table": table_name,
+            "day": day,
+            "added": added,
+            "staged": staged,
+            "removed": removed,
+            "committed_at": datetime.datetime.utcnow().isoformat(),
+        }
+        write_json(
+            filesystem,
+            state_path(bronze_root, "compaction", table_name, f"{day}-{run_id}"),
+            manifest,
+        )
+        publish(filesystem, staging, source, manifest)
+        stats["added"] += len(added)
+        stats["removed"] += len(removed)
+    return dict(stats, seconds=time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compact the small DMS CDC files of the bronze data lake"
+    )
+    parser.add_argument(
+        "--bronze", required=True, help="Bronze bucket uri (s3://...) or directory"
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        default=list(SILVER_TABLES),
+        choices=list(SILVER_TABLES),
+    )
+    parser.add_argument(
+        "--target-size-mb", type=int, default=256, help="Size of compacted files"
+    )
+    parser.add_argument(
+        "--min-age-days",
+        type=int,
+        default=1,
+        help="Only compact days at least this old, so DMS is done writing them",
+    )
+    parser.add_argument("--compression", default="snappy", choices=["snappy", "zstd"])
+    parser.add_argument(
+        "--retention-hours",
+        type=float,
+        default=24,
+        help="Hours replaced files stay readable before a later run deletes them",
+    )
+    args = parser.parse_args()
+
+    for table_name in args.tables:
+        stats = compact_table(
+            table_name,
+            args.bronze,
+            target_size=args.target_size_mb * 1024 * 1024,
+            min_age_days=args.min_age_days,
+            compression=args.compression,
+            retention_hours=args.retention_hours,
+        )
+        print(
+            f"{stats['table']}: {stats['removed']} files compacted into "
+            f"{stats['added']} ({stats['rows']} rows), {stats['deleted']} replaced "
+            f"files deleted in {stats['seconds']:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+Vectorized 64 bit hashing of NumPy arrays, shared by the synthetic data
+generator (ids) and the data quality checks (key hashes)
+"""
+import numpy as np
+
+
+def splitmix64(values: np.ndarray) -> np.ndarray:
+    """
+    Bijective 64 bit mix: distinct inputs give distinct, random looking outputs
+    """
+    with np.errstate(over="ignore"):
+        values = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
@@ -0,0 +1,313 @@
+"""
+Data quality checks of silver record batches, run while bronze is written
+to silver: null, range, foreign key and primary key checks of the table
+registry, computed with Arrow compute and NumPy over whole batches.
+
+Keys are compared by 64 bit hashes of their values. Primary keys go into a
+hash set, so a row is a duplicate when an earlier row had the same key
+(telling two keys apart fails only on a hash collision). Foreign keys are
+looked up in a bloom filter of the referenced keys, which misses about 1%
+of the orphans but never flags a valid row.
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from data_platform.data_definitions import ForeignKey, TableSchema
+from data_platform.processing.hashing import splitmix64
+
+# multiplier of the polynomial string hash (the 64 bit FNV prime)
+HASH_MULTIPLIER = np.uint64(0x100000001B3)
+VIOLATION_COLUMN = "violation"
+
+
+def hash_strings(array: pa.Array) -> np.ndarray:
+    """
+    64 bit hash of each value, computed over the array's data buffer without
+    building Python strings. Non string columns are hashed as text, nulls
+    hash to 0.
+    """
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if not pa.types.is_string(array.type):
+        array = pc.cast(array, pa.string())
+    rows = len(array)
+    _, offsets_buffer, data_buffer = array.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int32)[
+        array.offset : array.offset + rows + 1
+    ].astype(np.int64)
+    lengths = np.diff(offsets)
+    starts = offsets[:-1] - offsets[0]
+    data = np.empty(0, dtype=np.uint8)
+    if data_buffer is not None:
+        data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0] : offsets[-1]]
+
+    # sum of byte * multiplier ** (bytes after it in the string), wrapping
+    owner = np.repeat(np.arange(rows), lengths)
+    from_end = starts[owner] + lengths[owner] - 1 - np.arange(len(data))
+    powers = np.ones(max(int(lengths.max(initial=0)), 1), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        powers[1:] = np.cumprod(np.full(len(powers) - 1, HASH_MULTIPLIER))
+        terms = data.astype(np.uint64) * powers[from_end]
+    sums = np.zeros(rows, dtype=np.uint64)
+    non_empty = lengths > 0
+    if non_empty.any():
+        sums[non_empty] = np.add.reduceat(terms, starts[non_empty])
+    hashes = splitmix64(sums ^ splitmix64(lengths))
+    if array.null_count:
+        hashes[array.is_null().to_numpy(zero_copy_only=False)] = 0
+    return hashes
+
+
+def key_hashes(columns: list) -> np.ndarray:
+    """
+    One hash per row for the values of several key columns
+    """
+    hashes = hash_strings(columns[0])
+    for column in columns[1:]:
+        with np.errstate(over="ignore"):
+            hashes = splitmix64(hashes * HASH_MULTIPLIER + hash_strings(column))
+    return hashes
+
+
+def not_null_rows(columns: list) -> np.ndarray:
+    valid = np.ones(len(columns[0]), dtype=bool)
+    for column in columns:
+        valid &= column.is_valid().to_numpy(zero_copy_only=False)
+    return valid
+
+
+class KeySet:
+    """
+    Open addressing hash set of key hashes, probed a whole batch at a time
+    """
+
+    def __init__(self, capacity: int = 1 << 16):
+        # 0 marks an empty slot, so hashes are stored with their 0 mapped to 1
+        self.slots = np.zeros(capacity, dtype=np.uint64)
+        self.size = 0
+
+    def insert(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Inserts distinct hashes, returning which of them were already there
+        """
+        found = np.zeros(len(hashes), dtype=bool)
+        mask = np.uint64(len(self.slots) - 1)
+        slots = (hashes & mask).astype(np.int64)
+        pending = np.arange(len(hashes))
+        while pending.size:
+            current = self.slots[slots[pending]]
+            matches = current == hashes[pending]
+            found[pending[matches]] = True
+            # hashes probing the same empty slot: the first one takes it
+            empty = pending[current == 0]
+            _, first = np.unique(slots[empty], return_index=True)
+            winners = empty[first]
+            self.slots[slots[winners]] = hashes[winners]
+            self.size += len(winners)
+            settled = matches.copy()
+            settled[np.isin(pending, winners)] = True
+            pending = pending[~settled]
+            # the others move to the next slot, unless their slot was just taken
+            moving = pending[self.slots[slots[pending]] != 0]
+            slots[moving] = (slots[moving] + 1) & int(mask)
+        return found
+
+    def add(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Adds a batch of hashes, returning which rows repeat a hash added
+        before, in an earlier batch or earlier in this one
+        """
+        hashes = np.where(hashes == 0, np.uint64(1), hashes)
+        distinct, first, inverse = np.unique(
+            hashes, return_index=True, return_inverse=True
+        )
+        if (self.size + len(distinct)) * 2 > len(self.slots):
+            self.grow(self.size + len(distinct))
+        repeated = self.insert(distinct)[inverse]
+        repeated |= first[inverse] != np.arange(len(hashes))
+        return repeated
+
+    def grow(self, size: int) -> None:
+        capacity = len(self.slots)
+        while size * 2 > capacity:
+            capacity *= 2
+        stored = self.slots[self.slots != 0]
+        self.slots = np.zeros(capacity, dtype=np.uint64)
+        self.size = 0
+        self.insert(stored)
+
+
+class BloomFilter:
+    """
+    Set membership with false positives, in bits_per_key bits per key
+    (10 bits and 7 probes give about 1% false positives)
+    """
+
+    def __init__(self, keys: int, bits_per_key: int = 10, probes: int = 7):
+        bits = 64
+        while bits < keys * bits_per_key:
+            bits *= 2
+        self.bits = np.zeros(bits // 8, dtype=np.uint8)
+        self.mask = np.uint64(bits - 1)
+        self.probes = np.arange(probes, dtype=np.uint64)
+
+    def positions(self, hashes: np.ndarray) -> np.ndarray:
+        # double hashing: probe i of a key is h1 + i * h2
+        step = splitmix64(hashes) | np.uint64(1)
+        with np.errstate(over="ignore"):
+            return (hashes[:, None] + self.probes[None, :] * step[:, None]) & self.mask
+
+    def add(self, hashes: np.ndarray) -> None:
+        positions = self.positions(hashes).ravel()
+        np.bitwise_or.at(
+            self.bits,
+            (positions >> np.uint64(3)).astype(np.int64),
+            (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)),
+        )
+
+    def might_contain(self, hashes: np.ndarray) -> np.ndarray:
+        positions = self.positions(hashes)
+        bytes_ = self.bits[(positions >> np.uint64(3)).astype(np.int64)]
+        bits = (bytes_ >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+
+def reference_filter(batches, foreign_key: ForeignKey, keys: int) -> BloomFilter:
+    """
+    Bloom filter of the referenced keys of a foreign key, from record
+    batches of the referenced table
+    """
+    bloom = BloomFilter(keys)
+    for batch in batches:
+        columns = [batch.column(name) for name in foreign_key.referenced_columns]
+        valid = not_null_rows(columns)
+        bloom.add(key_hashes(columns)[valid])
+    return bloom
+
+
+def describe_foreign_key(foreign_key: ForeignKey) -> str:
+    return (
+        f"orphan foreign key ({', '.join(foreign_key.columns)}) -> {foreign_key.table}"
+    )
+
+
+class TableValidator:
+    """
+    Splits the silver record batches of a table into valid rows and rows
+    breaking a constraint, counting the rows caught by each check. A row
+    is quarantined under the first check it fails; primary keys are checked
+    last, so a rejected row never hides a later valid row with its key.
+    Foreign keys are only checked against the referenced tables given a
+    filter.
+    """
+
+    def __init__(self, table: TableSchema, references: dict = None):
+        self.table = table
+        self.references = references or {}
+        self.keys = KeySet() if table.primary_key else None
+        self.primary_key_check = (
+            f"duplicate primary key ({', '.join(table.primary_key)})"
+        )
+        self.counts = {name: 0 for name in self.checks()}
+        self.rows = 0
+
+    def checks(self) -> list:
+        names = [f"null {column.name}" for column in self.table.not_null_columns]
+        names.extend(
+            f"{column.name} out of range"
+            for column in self.table.lake_columns
+            if column.min_value is not None or column.max_value is not None
+        )
+        names.extend(
+            describe_foreign_key(foreign_key)
+            for foreign_key in self.table.foreign_keys
+            if foreign_key in self.references
+        )
+        if self.table.primary_key:
+            names.append(self.primary_key_check)
+        return names
+
+    @property
+    def quarantined(self) -> int:
+        return sum(self.counts.values())
+
+    def failures(self, batch: pa.RecordBatch) -> list:
+        """
+        (check, mask of the failing rows) of every check but the primary key
+        """
+        failures = []
+        for column in self.table.not_null_columns:
+            values = batch.column(column.name)
+            failures.append(
+                (
+                    f"null {column.name}",
+                    values.is_null().to_numpy(zero_copy_only=False),
+                )
+            )
+        for column in self.table.lake_columns:
+            if column.min_value is None and column.max_value is None:
+                continue
+            values = batch.column(column.name)
+            below = above = pa.scalar(False)
+            if column.min_value is not None:
+                below = pc.less(values, column.min_value)
+            if column.max_value is not None:
+                above = pc.greater(values, column.max_value)
+            outside = pc.or_(below, above)
+            failures.append(
+                (
+                    f"{column.name} out of range",
+                    pc.fill_null(outside, False).to_numpy(zero_copy_only=False),
+                )
+            )
+        for foreign_key in self.table.foreign_keys:
+            bloom = self.references.get(foreign_key)
+            if bloom is None:
+                continue
+            columns = [batch.column(name) for name in foreign_key.columns]
+            # a null reference isn't an orphan, the null checks cover it
+            checked = not_null_rows(columns)
+            orphans = np.zeros(batch.num_rows, dtype=bool)
+            orphans[checked] = ~bloom.might_contain(key_hashes(columns)[checked])
+            failures.append((describe_foreign_key(foreign_key), orphans))
+        return failures
+
+    def validate(self, batch: pa.RecordBatch) -> tuple:
+        """
+        Returns the valid rows of a batch, and the others (or None) with the
+        check they failed in a violation column
+        """
+        self.rows += batch.num_rows
+        failures = self.failures(batch)
+        rejected = np.zeros(batch.num_rows, dtype=bool)
+        for _, failing in failures:
+            rejected |= failing
+        if self.keys is not None:
+            columns = [batch.column(name) for name in self.table.primary_key]
+            checked = ~rejected
+            duplicates = np.zeros(batch.num_rows, dtype=bool)
+            duplicates[checked] = self.keys.add(key_hashes(columns)[checked])
+            failures.append((self.primary_key_check, duplicates))
+            rejected |= duplicates
+        if not rejected.any():
+            return batch, None
+
+        names = [name for name, _ in failures]
+        masks = [failing for _, failing in failures]
+        violation = np.select(masks, names, default="")
+        for name in names:
+            self.counts[name] += int(np.count_nonzero(violation == name))
+        quarantined = batch.filter(pa.array(rejected))
+        quarantined = pa.RecordBatch.from_arrays(
+            quarantined.columns + [pa.array(violation[rejected], pa.string())],
+            schema=quarantine_schema(batch.schema),
+        )
+        return batch.filter(pa.array(~rejected)), quarantined
+
+    def report(self) -> dict:
+        return {"rows": self.rows, "quarantined": self.quarantined, **self.counts}
+
+
+def quarantine_schema(schema: pa.Schema) -> pa.Schema:
+    return schema.append(pa.field(VIOLATION_COLUMN, pa.string()))
@@ -0,0 +1,417 @@
+import argparse
+import datetime
+import time
+import uuid
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from data_platform.processing.bronze_to_silver import SILVER_TABLES
+from data_platform.processing.cdc_merge import HIVE_NULL_PARTITION
+from data_platform.processing.storage import (
+    SILVER_PREFIX,
+    GOLD_PREFIX,
+    resolve,
+    table_path,
+    list_files,
+    write_manifest,
+)
+
+ORDERS_OBT = "orders_obt"
+ORDERS_OBT_SCHEMA = pa.schema(
+    [
+        ("order_id", pa.string()),
+        ("customer_id", pa.string()),
+        ("order_status", pa.string()),
+        ("order_purchase_date", pa.date32()),
+        ("order_purchase_month", pa.int32()),
+        ("order_purchase_quarter", pa.int32()),
+        ("review_score", pa.int32()),
+        ("payment_type", pa.string()),
+        ("payment_installments", pa.int32()),
+        ("payment_value", pa.float64()),
+        ("seller_id", pa.string()),
+        ("product_id", pa.string()),
+        ("product_category", pa.string()),
+        ("item_quantity", pa.int64()),
+        ("gmv", pa.float64()),
+        ("order_purchase_year", pa.int32()),
+    ]
+)
+PARTITION_COLUMN = "order_purchase_year"
+# columns most dashboard queries filter on, in clustering priority
+CLUSTER_COLUMNS = ["order_purchase_date", "seller_id", "product_category"]
+LAYOUTS = ["none", "sorted", "zorder"]
+# bits of each column's rank in the interleaved Morton code (3 x 21 < 64)
+ZORDER_BITS = 21
+# Athena and Spectrum read the files listed by the symlink manifest of each
+# partition, under this folder, instead of listing the run folders
+SYMLINK_DIRECTORY = "_symlink_format_manifest"
+RUNS_DIRECTORY = "_runs"
+
+
+def read_silver(filesystem, silver_root: str, table_name: str, columns: list):
+    """
+    Reads columns of a silver table, including its partition column
+    """
+    table = SILVER_TABLES[table_name]
+    path = table_path(silver_root, SILVER_PREFIX, table_name)
+    schema = pa.schema([field for field in table.schema if field.name in columns])
+    files = list_files(filesystem, path)
+    if not files:
+        return schema.empty_table()
+    partitioning = None
+    if table.partition_column:
+        partitioning = ds.partitioning(
+            pa.schema([table.schema.field(table.partition_column)]), flavor="hive"
+        )
+    return ds.dataset(
+        [info.path for info in files],
+        filesystem=filesystem,
+        format="parquet",
+        partitioning=partitioning,
+        partition_base_dir=path,
+    ).to_table(columns=columns)
+
+
+def rename(table: pa.Table, names: dict) -> pa.Table:
+    return table.rename_columns([names.get(name, name) for name in table.column_names])
+
+
+def first_per_key(table: pa.Table, key: str, sort_keys: list) -> pa.Table:
+    """
+    Keeps the first row of each key, in sort_keys order
+    """
+    table = table.take(
+        pc.sort_indices(table, sort_keys=[(key, "ascending")] + sort_keys)
+    )
+    _, first = np.unique(table[key].to_numpy(), return_index=True)
+    return table.take(pa.array(first, pa.int64()))
+
+
+def summarize_payments(payments: pa.Table) -> pa.Table:
+    """
+    One row per order: total value, max installments and the type that paid
+    the most, so orders paid in several sequentials don't fan out the mart
+    """
+    totals = payments.group_by("order_id").aggregate(
+        [("payment_value", "sum"), ("payment_installments", "max")]
+    )
+    primary = first_per_key(
+        payments,
+        "order_id",
+        [("payment_value", "descending"), ("payment_sequential", "ascending")],
+    ).select(["order_id", "payment_type"])
+    return rename(
+        totals.join(primary, "order_id"),
+        {
+            "payment_value_sum": "payment_value",
+            "payment_installments_max": "payment_installments",
+        },
+    )
+
+
+def summarize_reviews(reviews: pa.Table) -> pa.Table:
+    """
+    One row per order with the score of its latest review
+    """
+    return first_per_key(
+        reviews,
+        "order_id",
+        [("review_answer_timestamp", "descending"), ("review_id", "ascending")],
+    ).select(["order_id", "review_score"])
+
+
+def build_orders_obt(filesystem, silver_root: str) -> pa.Table:
+    """
+    Builds orders_obt at the (order, seller, product) grain. Each silver
+    order item row is one item, so quantities are counted and gmv is the
+    sum of price plus freight.
+    """
+    items = read_silver(
+        filesystem,
+        silver_root,
+        "order_items",
+        ["order_id", "product_id", "seller_id", "price", "freight_value"],
+    )
+    items = items.append_column(
+        "item_gmv", pc.add(items["price"], pc.fill_null(items["freight_value"], 0.0))
+    ).append_column("item", pa.array(np.ones(items.num_rows, np.int64)))
+    summarized_items = rename(
+        items.group_by(["order_id", "seller_id", "product_id"]).aggregate(
+            [("item_gmv", "sum"), ("item", "sum")]
+        ),
+        {"item_gmv_sum": "gmv", "item_sum": "item_quantity"},
+    )
+    products = rename(
+        read_silver(
+            filesystem, silver_root, "products", ["product_id", "product_category_name"]
+        ),
+        {"product_category_name": "product_category"},
+    )
+    orders = read_silver(
+        filesystem,
+        silver_root,
+        "orders",
+        ["order_id", "customer_id", "order_status", "order_purchase_date"],
+    )
+    payments = read_silver(
+        filesystem,
+        silver_root,
+        "order_payments",
+        [
+            "order_id",
+            "payment_sequential",
+            "payment_type",
+            "payment_installments",
+            "payment_value",
+        ],
+    )
+    reviews = read_silver(
+        filesystem,
+        silver_root,
+        "order_reviews",
+        ["review_id", "order_id", "review_score", "review_answer_timestamp"],
+    )
+
+    obt = (
+        summarized_items.join(products, "product_id")
+        .join(orders, "order_id", join_type="inner")
+        .join(summarize_payments(payments), "order_id")
+        .join(summarize_reviews(reviews), "order_id")
+    )
+    purchase_date = obt["order_purchase_date"]
+    obt = (
+        obt.append_column("order_purchase_year", pc.year(purchase_date))
+        .append_column("order_purchase_month", pc.month(purchase_date))
+        .append_column("order_purchase_quarter", pc.quarter(purchase_date))
+    )
+    return pa.Table.from_arrays(
+        [obt[field.name].cast(field.type) for field in ORDERS_OBT_SCHEMA],
+        schema=ORDERS_OBT_SCHEMA,
+    )
+
+
+def column_ranks(column: pa.ChunkedArray) -> np.ndarray:
+    """
+    Dense rank of each value, in the column's sort order (nulls first)
+    """
+    if pa.types.is_date(column.type):
+        values = pc.fill_null(column.cast(pa.int32()), np.iinfo(np.int32).min)
+    else:
+        values = pc.fill_null(column.cast(pa.string()), "")
+    _, ranks = np.unique(values.to_numpy(), return_inverse=True)
+    return ranks.astype(np.uint64)
+
+
+def zorder_values(table: pa.Table, columns: list) -> np.ndarray:
+    """
+    Interleaves the bits of each column's rank into a Morton code, so rows
+    close on every column at once end up close in the file
+    """
+    codes = np.zeros(table.num_rows, dtype=np.uint64)
+    for position, column in enumerate(columns):
+        ranks = column_ranks(table[column])
+        # scale every column to ZORDER_BITS bits, so each one weighs the same
+        # in the high bits whatever its number of distinct values
+        bits = int(ranks.max(initial=0)).bit_length()
+        if bits > ZORDER_BITS:
+            ranks >>= np.uint64(bits - ZORDER_BITS)
+        else:
+            ranks <<= np.uint64(ZORDER_BITS - bits)
+        for bit in range(ZORDER_BITS):
+            codes |= ((ranks >> np.uint64(bit)) & np.uint64(1)) << np.uint64(
+                bit * len(columns) + position
+            )
+    return codes
+
+
+def cluster(table: pa.Table, layout: str, columns: list = CLUSTER_COLUMNS):
+    """
+    Orders rows so row groups cover narrow ranges of the cluster columns
+    """
+    if layout == "sorted":
+        return table.take(
+            pc.sort_indices(
+                table, sort_keys=[(column, "ascending") for column in columns]
+            )
+        )
+    if layout == "zorder":
+        order = np.argsort(zorder_values(table, columns), kind="stable")
+        return table.take(pa.array(order, pa.int64()))
+    # unclustered: order ids are random, so rows land in no useful order
+    return table.take(pc.sort_indices(table, sort_keys=[("order_id", "ascending")]))
+
+
+def file_uri(filesystem, path: str) -> str:
+    return f"s3://{path}" if filesystem.type_name == "s3" else path
+
+
+def gold_files(filesystem, target: str) -> list:
+    """
+    The data files the symlink manifests of a gold table point to
+    """
+    paths = []
+    manifests = list_files(filesystem, f"{target}/{SYMLINK_DIRECTORY}", "manifest")
+    for info in manifests:
+        with filesystem.open_input_stream(info.path) as stream:
+            paths += [
+                line.split("://", 1)[-1]
+                for line in stream.read().decode().splitlines()
+                if line
+            ]
+    return paths
+
+
+def write_gold(
+    table: pa.Table,
+    filesystem,
+    target: str,
+    layout: str = "zorder",
+    compression: str = "snappy",
+    row_group_size: int = 64_000,
+    max_rows_per_file: int = 2_000_000,
+) -> list:
+    """
+    Writes one directory per purchase year into a new run folder, then
+    points the symlink manifest of each year at its new files. A year
+    switches runs with one object write, so readers never see the files of
+    two runs at once. The run the manifests pointed to before is kept for
+    the queries still reading it, other runs are deleted.
+    Each year is clustered on its own and split into files of consecutive
+    rows, so both files and row groups carry narrow min/max statistics.
+    Returns the symlink manifests written.
+    """
+    run_id = f"{datetime.datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex}"
+    runs = f"{target}/{RUNS_DIRECTORY}"
+    symlinks = f"{target}/{SYMLINK_DIRECTORY}"
+    files_by_partition = {}
+    years = pc.unique(table[PARTITION_COLUMN]).to_pylist()
+    file_schema = ORDERS_OBT_SCHEMA.remove(
+        ORDERS_OBT_SCHEMA.get_field_index(PARTITION_COLUMN)
+    )
+    for year in sorted(years, key=lambda year: (year is None, year)):
+        mask = (
+            pc.is_null(table[PARTITION_COLUMN])
+            if year is None
+            else pc.equal(table[PARTITION_COLUMN], year)
+        )
+        rows = cluster(table.filter(mask), layout).select(file_schema.names)
+        value = HIVE_NULL_PARTITION if year is None else year
+        partition = f"{PARTITION_COLUMN}={value}"
+        directory = f"{runs}/{run_id}/{partition}"
+        filesystem.create_dir(directory, recursive=True)
+        files_by_partition[partition] = []
+        for number, start in enumerate(range(0, rows.num_rows, max_rows_per_file)):
+            path = f"{directory}/part-{number}.parquet"
+            pq.write_table(
+                rows.slice(start, max_rows_per_file),
+                path,
+                filesystem=filesystem,
+                compression=compression,
+                row_group_size=row_group_size,
+                write_statistics=True,
+            )
+            files_by_partition[partition].append(path)
+
+    previous = list_files(filesystem, symlinks, "manifest")
+    # runs the readers may still be reading, and the new one
+    kept = {f"{runs}/{run_id}"} | {
+        "/".join(path.split("/")[: runs.count("/") + 2])
+        for path in gold_files(filesystem, target)
+    }
+    manifests = []
+    for partition, paths in files_by_partition.items():
+        manifest = f"{symlinks}/{partition}/manifest"
+        filesystem.create_dir(f"{symlinks}/{partition}", recursive=True)
+        with filesystem.open_output_stream(manifest) as stream:
+            stream.write(
+                "".join(f"{file_uri(filesystem, path)}\n" for path in paths).encode()
+            )
+        manifests.append(manifest)
+    # years the new run doesn't have anymore
+    for info in previous:
+        if info.path not in manifests:
+            filesystem.delete_file(info.path)
+
+    for info in filesystem.get_file_info(fs.FileSelector(runs, allow_not_found=True)):
+        if info.type == fs.FileType.Directory and info.path not in kept:
+            filesystem.delete_dir(info.path)
+    # files of the layout before run folders, which readers no longer list
+    for info in list_files(filesystem, target):
+        if not info.path.startswith((f"{runs}/", f"{symlinks}/")):
+            filesystem.delete_file(info.path)
+    return manifests
+
+
+def materialize_orders_obt(
+    silver_uri: str,
+    gold_uri: str,
+    layout: str = "zorder",
+    compression: str = "snappy",
+    row_group_size: int = 64_000,
+) -> dict:
+    """
+    Rebuilds the gold orders_obt table from silver
+    """
+    start = time.perf_counter()
+    silver_fs, silver_root = resolve(silver_uri)
+    gold_fs, gold_root = resolve(gold_uri)
+    obt = build_orders_obt(silver_fs, silver_root)
+    target = table_path(gold_root, GOLD_PREFIX, ORDERS_OBT)
+    manifests = write_gold(
+        obt,
+        gold_fs,
+        target,
+        layout=layout,
+        compression=compression,
+        row_group_size=row_group_size,
+    )
+    # the registrar adds the partitions of the symlink manifests
+    write_manifest(gold_fs, gold_root, ORDERS_OBT, manifests)
+    written = gold_files(gold_fs, target)
+    return {
+        "table": ORDERS_OBT,
+        "rows": obt.num_rows,
+        "files": len(written),
+        "bytes": sum(info.size for info in gold_fs.get_file_info(written)),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Materialize the orders_obt wide table into the gold data lake"
+    )
+    parser.add_argument(
+        "--silver", required=True, help="Silver bucket uri (s3://...) or directory"
+    )
+    parser.add_argument(
+        "--gold", required=True, help="Gold bucket uri (s3://...) or directory"
+    )
+    parser.add_argument("--layout", default="zorder", choices=LAYOUTS)
+    parser.add_argument("--compression", default="snappy", choices=["snappy", "zstd"])
+    parser.add_argument(
+        "--row-group-size", type=int, default=64_000, help="Rows per row group"
+    )
+    args = parser.parse_args()
+
+    stats = materialize_orders_obt(
+        args.silver,
+        args.gold,
+        layout=args.layout,
+        compression=args.compression,
+        row_group_size=args.row_group_size,
+    )
+    print(
+        f"{stats['table']}: {stats['rows']} rows, {stats['files']} files, "
+        f"{stats['bytes'] / 1024 / 1024:.1f} MB in {stats['seconds']:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
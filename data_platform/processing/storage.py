@@ -0,0 +1,103 @@
+import datetime
+import json
+import os
+import posixpath
+import uuid
+from pyarrow import fs
+
+from data_platform.definitions import db_name
+
+# DMS writes <bucket_folder>/<schema>/<table>/ into the bronze bucket
+BRONZE_PREFIX = f"ecommerce_rds/{db_name}"
+# Silver and gold keep one folder per table, which is what the crawlers target
+SILVER_PREFIX = "ecommerce_rds"
+GOLD_PREFIX = "ecommerce_rds"
+# Silver rows failing the data quality checks, kept out of the crawled folders
+QUARANTINE_PREFIX = "quarantine/ecommerce_rds"
+
+
+def resolve(uri: str) -> tuple:
+    """
+    Returns the (filesystem, path) of an s3:// uri or of a local directory,
+    so a local folder can stand in for a data lake bucket
+    """
+    if "://" in uri:
+        return fs.FileSystem.from_uri(uri)
+    return fs.LocalFileSystem(), os.path.abspath(uri)
+
+
+def table_path(root: str, prefix: str, table: str) -> str:
+    return "/".join([root.rstrip("/"), prefix, table])
+
+
+def list_files(filesystem: fs.FileSystem, path: str, suffix: str = ".parquet") -> list:
+    """
+    Lists every file under path, recursively, ordered by path
+    """
+    selector = fs.FileSelector(path, recursive=True, allow_not_found=True)
+    return sorted(
+        (
+            info
+            for info in filesystem.get_file_info(selector)
+            if info.type == fs.FileType.File and info.path.endswith(suffix)
+        ),
+        key=lambda info: info.path,
+    )
+
+
+def state_directory(root: str, *names: str) -> str:
+    """
+    Directory of pipeline state documents (watermarks, manifests), kept
+    outside the table folders so crawlers and readers never pick them up
+    """
+    return "/".join([root.rstrip("/"), "_state", *names])
+
+
+def state_path(root: str, *names: str) -> str:
+    return state_directory(root, *names) + ".json"
+
+
+def staging_directory(root: str, *names: str) -> str:
+    """
+    Directory of files written but not published yet. Like _state, it is
+    outside the table folders, so neither crawlers nor Athena read it.
+    """
+    return "/".join([root.rstrip("/"), "_staging", *names])
+
+
+def read_json(filesystem: fs.FileSystem, path: str, default=None):
+    if filesystem.get_file_info(path).type != fs.FileType.File:
+        return default
+    with filesystem.open_input_stream(path) as stream:
+        return json.loads(stream.read())
+
+
+def write_json(filesystem: fs.FileSystem, path: str, value) -> None:
+    filesystem.create_dir(path.rsplit("/", 1)[0], recursive=True)
+    with filesystem.open_output_stream(path) as stream:
+        stream.write(json.dumps(value, indent=2, default=str).encode())
+
+
+def delete_file(filesystem: fs.FileSystem, path: str) -> None:
+    if filesystem.get_file_info(path).type == fs.FileType.File:
+        filesystem.delete_file(path)
+
+
+def write_manifest(
+    filesystem: fs.FileSystem, root: str, table_name: str, paths: list
+) -> None:
+    """
+    Records the files a run wrote, relative to root, so the Glue partition
+    registrar can add their partitions without crawling the table
+    """
+    if not paths:
+        return
+    run_id = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    write_json(
+        filesystem,
+        state_path(root, "manifests", table_name, f"{run_id}-{uuid.uuid4().hex}"),
+        {
+            "table": table_name,
+            "files": [posixpath.relpath(path, root) for path in paths],
+        },
+    )
@@ -0,0 +1,445 @@
+import argparse
+import datetime
+import hashlib
+import os
+import posixpath
+import re
+import time
+import uuid
+from collections import defaultdict
+
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from data_platform.data_definitions import TABLES
+from data_platform.processing.bronze_to_silver import SILVER_TABLES, SilverTable
+from data_platform.processing.cdc_merge import HIVE_NULL_PARTITION
+from data_platform.processing.storage import (
+    SILVER_PREFIX,
+    resolve,
+    table_path,
+    list_files,
+    state_path,
+    write_json,
+    delete_file,
+    read_json,
+)
+
+# partitions loaded into each native table, updated in the load's transaction
+STATE_TABLE = "copy_load_state"
+# unpartitioned tables are tracked as a single partition
+WHOLE_TABLE = ""
+COPY_PATTERN = re.compile(
+    r"^\s*copy\s+(\S+)\s+from\s+'([^']+)'.*\bformat\s+as\s+parquet(\s+manifest)?\b",
+    re.IGNORECASE | re.DOTALL,
+)
+# Redshift table attributes PostgreSQL doesn't know
+TABLE_ATTRIBUTES_PATTERN = re.compile(
+    r"\s+(sortkey|distkey|diststyle\s+\w+)(\s*\([^)]*\))?", re.IGNORECASE
+)
+EXTERNAL_SCHEMA_PATTERN = re.compile(
+    r"^\s*create\s+external\s+schema\s+if\s+not\s+exists\s+(\S+)\s",
+    re.IGNORECASE,
+)
+
+
+def quote_literal(value) -> str:
+    if value is None:
+        return "null"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def partition_type(table: SilverTable) -> str:
+    return TABLES[table.name].column(table.partition_column).column_type.redshift
+
+
+def partition_condition(table: SilverTable, values: list) -> str:
+    """
+    SQL condition selecting the rows of some partitions of a table
+    """
+    literals = [
+        f"cast({quote_literal(value)} as {partition_type(table)})"
+        for value in values
+        if value != HIVE_NULL_PARTITION
+    ]
+    conditions = []
+    if literals:
+        conditions.append(f"{table.partition_column} in ({', '.join(literals)})")
+    if HIVE_NULL_PARTITION in values:
+        conditions.append(f"{table.partition_column} is null")
+    return " or ".join(conditions)
+
+
+def copy_url(filesystem: fs.FileSystem, path: str) -> str:
+    return f"s3://{path}" if filesystem.type_name == "s3" else path
+
+
+def silver_partitions(filesystem: fs.FileSystem, root: str, table: SilverTable):
+    """
+    Groups the files of a silver table by partition value
+    """
+    path = table_path(root, SILVER_PREFIX, table.name)
+    partitions = defaultdict(list)
+    for info in list_files(filesystem, path):
+        if table.partition_column:
+            directory = posixpath.basename(posixpath.dirname(info.path))
+            partitions[directory.split("=", 1)[1]].append(info)
+        else:
+            partitions[WHOLE_TABLE].append(info)
+    return partitions
+
+
+def signature(files: list, root: str) -> str:
+    """
+    Changes whenever a partition's files are rewritten (merges and
+    compaction write new file names)
+    """
+    return hashlib.sha256(
+        "\n".join(
+            f"{posixpath.relpath(info.path, root)}:{info.size}" for info in files
+        ).encode()
+    ).hexdigest()
+
+
+class RedshiftCopyLoader:
+    """
+    Copies silver partitions into native Redshift tables, so dbt models read
+    local, sorted blocks instead of scanning S3 through Spectrum.
+    Only partitions whose files changed since the last load are copied: they
+    are loaded into a staging table, then swapped in with a delete and insert
+    in one transaction, together with the load state. Full loads build a new
+    table and swap it in by renaming. Readers never see a partial load.
+    """
+
+    def __init__(
+        self,
+        connection,
+        silver_uri: str,
+        iam_role: str,
+        schema: str = "silver",
+        external_schema: str = "data_lake_silver",
+        glue_database: str = "glue_ecommerce_production_data_lake_silver",
+    ):
+        self.connection = connection
+        self.filesystem, self.root = resolve(silver_uri)
+        self.iam_role = iam_role
+        self.schema = schema
+        self.external_schema = external_schema
+        self.glue_database = glue_database
+
+    def execute(self, *statements: str) -> list:
+        cursor = self.connection.cursor()
+        rows = []
+        for statement in statements:
+            cursor.execute(statement)
+            if cursor.description:
+                rows = cursor.fetchall()
+        return rows
+
+    def create_schemas(self) -> None:
+        """
+        Creates the native schema, the load state table and the Spectrum
+        schema over the silver Glue database
+        """
+        self.execute(
+            f"create external schema if not exists {self.external_schema} "
+            f"from data catalog database {quote_literal(self.glue_database)} "
+            f"iam_role {quote_literal(self.iam_role)}",
+            f"create schema if not exists {self.schema}",
+            f"create table if not exists {self.schema}.{STATE_TABLE} ("
+            "table_name varchar(256), partition_value varchar(256), "
+            "signature varchar(64), loaded_at timestamp)",
+        )
+        self.connection.commit()
+
+    def loaded_signatures(self, table_name: str) -> dict:
+        rows = self.execute(
+            f"select partition_value, signature from {self.schema}.{STATE_TABLE} "
+            f"where table_name = {quote_literal(table_name)}"
+        )
+        return dict(rows)
+
+    def write_copy_manifest(self, table_name: str, files: list) -> str:
+        """
+        COPY manifest of the files of a load. Parquet manifests need each
+        file's size.
+        """
+        path = state_path(self.root, "copy", table_name, uuid.uuid4().hex)
+        write_json(
+            self.filesystem,
+            path,
+            {
+                "entries": [
+                    {
+                        "url": copy_url(self.filesystem, info.path),
+                        "mandatory": True,
+                        "meta": {"content_length": info.size},
+                    }
+                    for info in files
+                ]
+            },
+        )
+        return path
+
+    def copy_files(self, table_name: str, target: str, files: list) -> None:
+        """
+        COPYs files with the columns of target into it, in one statement
+        """
+        manifest = self.write_copy_manifest(table_name, files)
+        try:
+            self.execute(
+                f"copy {target} "
+                f"from {quote_literal(copy_url(self.filesystem, manifest))} "
+                f"iam_role {quote_literal(self.iam_role)} format as parquet manifest"
+            )
+        finally:
+            delete_file(self.filesystem, manifest)
+
+    def stage_partitions(self, table: SilverTable, target: str, partitions: dict):
+        """
+        Loads the files of the changed partitions into target.
+        Files of unpartitioned tables hold every column and are copied in one
+        statement. Partitioned files lack the partition column, which only
+        lives in the directory names and which COPY can't read, so each
+        partition's prefix is copied into a table without it, then inserted
+        into target with the value of its directory.
+        """
+        files = [info for value in sorted(partitions) for info in partitions[value]]
+        if not files:
+            return
+        if not table.partition_column:
+            self.copy_files(table.name, target, files)
+            return
+        partition_files = f"{target}_files"
+        columns = [
+            name for name in table.schema.names if name != table.partition_column
+        ]
+        self.execute(
+            f"drop table if exists {partition_files}",
+            TABLES[table.name].redshift_ddl(
+                partition_files, exclude=(table.partition_column,)
+            ),
+        )
+        for value in sorted(partitions):
+            prefix = posixpath.dirname(partitions[value][0].path) + "/"
+            literal = quote_literal(None if value == HIVE_NULL_PARTITION else value)
+            self.execute(
+                f"copy {partition_files} "
+                f"from {quote_literal(copy_url(self.filesystem, prefix))} "
+                f"iam_role {quote_literal(self.iam_role)} format as parquet",
+                f"insert into {target} ({', '.join(columns)}, {table.partition_column}) "
+                f"select {', '.join(columns)}, "
+                f"cast({literal} as {partition_type(table)}) from {partition_files}",
+                f"delete from {partition_files}",
+            )
+        self.execute(f"drop table {partition_files}")
+
+    def record_state(self, table_name: str, signatures: dict, replace: bool) -> None:
+        loaded_at = datetime.datetime.utcnow().isoformat(sep=" ")
+        condition = f"table_name = {quote_literal(table_name)}"
+        if not replace:
+            values = ", ".join(quote_literal(value) for value in signatures)
+            condition += f" and partition_value in ({values})"
+        self.execute(f"delete from {self.schema}.{STATE_TABLE} where {condition}")
+        for value, partition_signature in signatures.items():
+            if partition_signature is None:
+                continue
+            self.execute(
+                f"insert into {self.schema}.{STATE_TABLE} values ("
+                f"{quote_literal(table_name)}, {quote_literal(value)}, "
+                f"{quote_literal(partition_signature)}, "
+                f"cast({quote_literal(loaded_at)} as timestamp))"
+            )
+
+    def load_table(self, table_name: str, full: bool = False) -> dict:
+        """
+        Brings a native table up to date with its silver partitions
+        """
+        start = time.perf_counter()
+        table = SILVER_TABLES[table_name]
+        target = f"{self.schema}.{table.name}"
+        staging = f"{table.name}__staging"
+        partitions = silver_partitions(self.filesystem, self.root, table)
+        current = {
+            value: signature(files, self.root) for value, files in partitions.items()
+        }
+        loaded = self.loaded_signatures(table.name)
+        full = full or not loaded
+        changed = {
+            value: current.get(value)
+            for value in set(current) | set(loaded)
+            if full or current.get(value) != loaded.get(value)
+        }
+        if not changed:
+            return {"table": table_name, "partitions": 0, "files": 0, "seconds": 0.0}
+        # unpartitioned tables are swapped whole
+        swap = full or not table.partition_column
+
+        self.execute(
+            TABLES[table.name].redshift_ddl(target),
+            f"drop table if exists {self.schema}.{staging}",
+            TABLES[table.name].redshift_ddl(f"{self.schema}.{staging}"),
+        )
+        self.connection.commit()
+        copied = {value: partitions[value] for value in changed if value in partitions}
+        try:
+            self.stage_partitions(table, f"{self.schema}.{staging}", copied)
+            if swap:
+                self.execute(
+                    f"drop table if exists {self.schema}.{table.name}__previous",
+                    f"alter table {target} rename to {table.name}__previous",
+                    f"alter table {self.schema}.{staging} rename to {table.name}",
+                    f"drop table {self.schema}.{table.name}__previous",
+                )
+            else:
+                self.execute(
+                    f"delete from {target} "
+                    f"where {partition_condition(table, list(changed))}",
+                    f"insert into {target} select * from {self.schema}.{staging}",
+                    f"drop table {self.schema}.{staging}",
+                )
+            self.record_state(table.name, changed, replace=swap)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        return {
+            "table": table_name,
+            "partitions": len(changed),
+            "files": sum(len(files) for files in copied.values()),
+            "seconds": time.perf_counter() - start,
+        }
+
+    def load(self, table_names: list, full: bool = False) -> list:
+        self.create_schemas()
+        return [self.load_table(table_name, full=full) for table_name in table_names]
+
+
+class LocalRedshift:
+    """
+    Wraps a local PostgreSQL connection so it accepts the SQL the loader
+    sends Redshift: COPY reads the Parquet files of a manifest or prefix
+    with Arrow, and external schemas become plain schemas
+    """
+
+    def __init__(self, connection, placeholder: str = "%s"):
+        self.connection = connection
+        self.placeholder = placeholder
+
+    def cursor(self):
+        return LocalRedshiftCursor(self.connection.cursor(), self)
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def rollback(self) -> None:
+        self.connection.rollback()
+
+
+class LocalRedshiftCursor:
+    def __init__(self, cursor, redshift: LocalRedshift):
+        self.cursor = cursor
+        self.redshift = redshift
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def fetchall(self) -> list:
+        return self.cursor.fetchall()
+
+    def insert(self, target: str, rows) -> None:
+        if not rows.num_rows:
+            return
+        columns = ", ".join(f'"{name}"' for name in rows.column_names)
+        placeholders = ", ".join(self.redshift.placeholder for _ in rows.column_names)
+        self.cursor.executemany(
+            f"insert into {target} ({columns}) values ({placeholders})",
+            [tuple(row.values()) for row in rows.to_pylist()],
+        )
+
+    def execute(self, sql: str) -> None:
+        external_schema = EXTERNAL_SCHEMA_PATTERN.match(sql)
+        if external_schema:
+            self.cursor.execute(
+                f"create schema if not exists {external_schema.group(1)}"
+            )
+            return
+        copy = COPY_PATTERN.match(sql)
+        if not copy:
+            self.cursor.execute(TABLE_ATTRIBUTES_PATTERN.sub("", sql))
+            return
+        target, url, manifest = copy.groups()
+        filesystem, path = resolve(url)
+        if manifest:
+            paths = [
+                resolve(entry["url"])[1]
+                for entry in read_json(filesystem, path)["entries"]
+            ]
+        else:
+            paths = [info.path for info in list_files(filesystem, path)]
+        for path in paths:
+            self.insert(target, pq.read_table(path, filesystem=filesystem))
+
+
+def main():
+    from data_platform.active_environment import active_environment
+
+    parser = argparse.ArgumentParser(
+        description="Copy the silver data lake tables into native Redshift tables"
+    )
+    parser.add_argument(
+        "--silver", required=True, help="Silver bucket uri (s3://...) or directory"
+    )
+    parser.add_argument(
+        "--dsn",
+        default=os.environ.get("REDSHIFT_DSN"),
+        help="libpq connection string of the cluster (default: $REDSHIFT_DSN)",
+    )
+    parser.add_argument(
+        "--iam-role", required=True, help="Role the cluster reads the bucket with"
+    )
+    parser.add_argument("--schema", default="silver")
+    parser.add_argument("--external-schema", default="data_lake_silver")
+    parser.add_argument(
+        "--glue-database",
+        default=f"glue_ecommerce_{active_environment.value}_data_lake_silver",
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        default=list(SILVER_TABLES),
+        choices=list(SILVER_TABLES),
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="Reload every partition of the tables"
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="The dsn is a local PostgreSQL standing in for Redshift",
+    )
+    args = parser.parse_args()
+
+    import psycopg2
+
+    connection = psycopg2.connect(args.dsn)
+    if args.local:
+        connection = LocalRedshift(connection)
+    loader = RedshiftCopyLoader(
+        connection,
+        args.silver,
+        args.iam_role,
+        schema=args.schema,
+        external_schema=args.external_schema,
+        glue_database=args.glue_database,
+    )
+    for stats in loader.load(args.tables, full=args.full):
+        print(
+            f"{stats['table']}: {stats['partitions']} partitions, "
+            f"{stats['files']} files in {stats['seconds']:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -77,6 +77,10 @@ class RedshiftStack(core.Stack):
                 connection=ec2.Port.tcp(5439),
             )
 
+        self.spectrum_role = SpectrumRole(
+            self, self.data_lake_silver_bucket, self.data_lake_gold_bucket
+        )
+
         self.redshift_cluster = redshift.Cluster(
             self,
             f"ecommerce-{self.deploy_env.value}-redshift",
@@ -89,11 +93,15 @@ class RedshiftStack(core.Stack):
             removal_policy=core.RemovalPolicy.DESTROY,
             master_user=redshift.Login(master_username="admin"),
             publicly_accessible=True,
-            roles=[
-                SpectrumRole(
-                    self, self.data_lake_silver_bucket, self.data_lake_gold_bucket
-                )
-            ],
+            roles=[self.spectrum_role],
             security_groups=[self.redshift_sg],
             vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
         )
+
+        # the silver COPY loader (data_platform/redshift/copy_loader.py) reads
+        # the bucket with the cluster's role
+        core.CfnOutput(
+            self,
+            f"redshift-{self.deploy_env.value}-spectrum-role-arn",
+            value=self.spectrum_role.role_arn,
+        )
@@ -0,0 +1,77 @@
+from typing import NamedTuple
+
+from data_platform.definitions import db_name
+from data_platform.data_definitions import table_names_list
+
+# FULL LOAD AND CDC SETTINGS OF THE DMS REPLICATION TASK
+# tables (or table segments) loaded at once: every one is a query on the
+# small production RDS, so this stays at the DMS default
+MAX_FULL_LOAD_SUBTASKS = 8
+# rows written per full load batch (DMS default 10000, maximum 50000)
+FULL_LOAD_COMMIT_RATE = 50000
+# the S3 endpoint writes the changes it buffered at least every 120 seconds
+# (cdcMaxBatchInterval). The task's BatchApply settings don't apply: batch
+# apply mode is off for S3 targets.
+CDC_MAX_BATCH_INTERVAL_SECONDS = 120
+CHANGE_PROCESSING_MEMORY_MB = 1024
+
+
+def uuid_boundaries(segments: int) -> tuple:
+    """
+    Splits the UUID space into equal ranges, for tables keyed by random UUIDs
+    """
+    step = 16**8 // segments
+    return tuple(
+        f"{segment * step:08x}-0000-0000-0000-000000000000"
+        for segment in range(1, segments)
+    )
+
+
+def zip_code_boundaries(segments: int) -> tuple:
+    step = 100000 // segments
+    return tuple(f"{segment * step:05d}" for segment in range(1, segments))
+
+
+class TableLoadSettings(NamedTuple):
+    """
+    How DMS full loads a source table: in one query, or in parallel
+    segments split on column at the given (ascending) boundaries
+    """
+
+    table_name: str
+    column: str = None
+    boundaries: tuple = ()
+
+    @property
+    def segments(self) -> int:
+        return len(self.boundaries) + 1
+
+
+# the largest tables, loaded in parallel segments
+table_load_settings = {
+    settings.table_name: settings
+    for settings in [
+        TableLoadSettings(
+            f"{db_name}.geolocation",
+            column="geolocation_zip_code_prefix",
+            boundaries=zip_code_boundaries(4),
+        ),
+        TableLoadSettings(
+            f"{db_name}.order_items", column="order_id", boundaries=uuid_boundaries(4)
+        ),
+        TableLoadSettings(
+            f"{db_name}.order_payments",
+            column="order_id",
+            boundaries=uuid_boundaries(2),
+        ),
+        TableLoadSettings(
+            f"{db_name}.orders", column="order_id", boundaries=uuid_boundaries(2)
+        ),
+        TableLoadSettings(
+            f"{db_name}.order_reviews", column="order_id", boundaries=uuid_boundaries(2)
+        ),
+    ]
+}
+# every other table is loaded in one query
+for table_name in table_names_list:
+    table_load_settings.setdefault(table_name, TableLoadSettings(table_name))
@@ -0,0 +1,608 @@
+"""
+Generates Olist-like datasets of any size, without network access.
+
+Every table of the registry is written as CSV (loadable with COPY, like the
+public datasets) or Parquet, one file per chunk, so memory stays bounded by
+the chunk size however large the scale factor is. Scale factor 1 has the
+size of the public datasets (about 100k orders and 113k items); 10000
+writes about a billion items. Ids are hashes of row numbers, so the tables
+are referentially consistent without sharing state between workers, and the
+same seed, scale factor and chunk size always write the same files.
+
+    python -m data_platform.synthetic_data --output /tmp/olist --scale-factor 10
+"""
+import argparse
+import os
+import posixpath
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as csv
+import pyarrow.parquet as pq
+
+from data_platform.data_definitions import TABLES
+from data_platform.processing.hashing import splitmix64
+from data_platform.processing.storage import resolve
+
+# rows of the public datasets, generated at scale factor 1
+ORDERS = 99_441
+SELLERS = 3_095
+PRODUCTS = 32_951
+GEOLOCATION = 1_000_163
+# zip code prefixes customers and sellers live in, all of them geolocated
+ZIP_PREFIXES = 19_015
+CATEGORIES = 71
+
+FIRST_PURCHASE = np.datetime64("2016-09-04T00:00:00", "s")
+PURCHASE_DAYS = 773
+DAY = 86_400
+
+# states by first zip code digit, the way Brazilian CEPs are allocated
+STATES = (
+    ("SP", "SP", "SP"),
+    ("SP", "SP", "SP"),
+    ("RJ", "RJ", "ES"),
+    ("MG", "MG", "MG"),
+    ("BA", "BA", "SE"),
+    ("PE", "AL", "PB", "RN"),
+    ("CE", "PI", "MA", "PA", "AM", "AP", "RR"),
+    ("DF", "GO", "TO", "MT", "MS", "RO", "AC"),
+    ("PR", "PR", "SC"),
+    ("RS", "RS", "RS"),
+)
+# state of each two digit zip code prefix
+ZIP_STATES = pa.array(
+    [
+        STATES[first][second % len(STATES[first])]
+        for first in range(10)
+        for second in range(10)
+    ]
+)
+CITIES = pa.array([f"cidade {number:04d}" for number in range(5000)])
+CATEGORY_NAMES = pa.array([f"categoria_{number:02d}" for number in range(CATEGORIES)])
+CATEGORY_NAMES_ENGLISH = pa.array(
+    [f"category_{number:02d}" for number in range(CATEGORIES)]
+)
+REVIEW_TITLES = pa.array(["recomendo", "otimo", "bom", "ruim", "nao recebi"])
+REVIEW_MESSAGES = pa.array(
+    [
+        "produto chegou antes do prazo",
+        "muito bom, recomendo",
+        "entrega atrasada",
+        "produto diferente do anunciado",
+        "ainda nao recebi o produto",
+    ]
+)
+
+# (value, probability) distributions measured on the public datasets
+ORDER_STATUSES = (
+    ("delivered", 0.970),
+    ("shipped", 0.011),
+    ("canceled", 0.006),
+    ("unavailable", 0.006),
+    ("invoiced", 0.003),
+    ("processing", 0.003),
+    ("created", 0.0005),
+    ("approved", 0.0005),
+)
+ITEMS_PER_ORDER = ((1, 0.901), (2, 0.076), (3, 0.012), (4, 0.006), (5, 0.005))
+PAYMENTS_PER_ORDER = ((1, 0.960), (2, 0.030), (3, 0.007), (4, 0.003))
+PAYMENT_TYPES = (
+    ("credit_card", 0.739),
+    ("boleto", 0.190),
+    ("voucher", 0.056),
+    ("debit_card", 0.015),
+)
+REVIEW_SCORES = ((1, 0.115), (2, 0.032), (3, 0.082), (4, 0.193), (5, 0.578))
+
+# salts of the ids of each kind of row
+ID_KINDS = {
+    "customer": 1,
+    "person": 2,
+    "order": 3,
+    "review": 4,
+    "product": 5,
+    "seller": 6,
+}
+# tables generated together, from the same order rows
+ORDER_TABLES = ("customers", "orders", "order_items", "order_payments", "order_reviews")
+
+
+class Scale(NamedTuple):
+    orders: int
+    sellers: int
+    products: int
+    geolocation: int
+
+    @classmethod
+    def from_factor(cls, scale_factor: float) -> "Scale":
+        return cls(
+            orders=max(round(ORDERS * scale_factor), 1),
+            sellers=max(round(SELLERS * scale_factor), 1),
+            products=max(round(PRODUCTS * scale_factor), 1),
+            geolocation=max(round(GEOLOCATION * scale_factor), ZIP_PREFIXES),
+        )
+
+    def rows(self, group: str) -> int:
+        if group == "product_category_name_translation":
+            return CATEGORIES
+        return getattr(self, group)
+
+
+class Chunk(NamedTuple):
+    """
+    Rows [start, stop) of a group: "orders" for the tables generated from
+    order rows, or a dimension table
+    """
+
+    group: str
+    part: int
+    start: int
+    stop: int
+
+
+def chunks(scale: Scale, chunk_rows: int, groups: tuple) -> list:
+    return [
+        Chunk(group, part, start, min(start + chunk_rows, scale.rows(group)))
+        for group in groups
+        for part, start in enumerate(range(0, scale.rows(group), chunk_rows))
+    ]
+
+
+def fixed_width_strings(characters: np.ndarray) -> pa.Array:
+    """
+    Arrow strings from a (rows, width) array of ASCII codes, without
+    building Python strings
+    """
+    rows, width = characters.shape
+    offsets = np.arange(0, (rows + 1) * width, width, dtype=np.int32)
+    return pa.StringArray.from_buffers(
+        rows,
+        pa.py_buffer(offsets),
+        pa.py_buffer(np.ascontiguousarray(characters, dtype=np.uint8)),
+    )
+
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+def ids(kind: str, rows: np.ndarray, seed: int) -> pa.Array:
+    """
+    32 hex digit ids (UUIDs without dashes, like the Olist ids) of row numbers
+    """
+    salt = splitmix64(np.array([seed * 64 + ID_KINDS[kind]]))[0]
+    high = splitmix64(rows.astype(np.uint64) ^ salt)
+    low = splitmix64(high ^ salt)
+    octets = np.stack([high, low], axis=1).astype(">u8").view(np.uint8)
+    nibbles = np.empty((len(rows), 32), dtype=np.uint8)
+    nibbles[:, 0::2] = octets >> 4
+    nibbles[:, 1::2] = octets & 15
+    return fixed_width_strings(HEX_DIGITS[nibbles])
+
+
+def zip_codes(prefixes: np.ndarray) -> pa.Array:
+    """
+    Five digit zip code prefixes of zip numbers in [0, ZIP_PREFIXES)
+    """
+    values = prefixes.astype(np.int64) * 100_000 // ZIP_PREFIXES
+    digits = values[:, None] // 10 ** np.arange(4, -1, -1) % 10
+    return fixed_width_strings(digits + ord("0"))
+
+
+def zip_prefix_states(prefixes: np.ndarray) -> pa.Array:
+    values = prefixes.astype(np.int64) * 100_000 // ZIP_PREFIXES
+    return ZIP_STATES.take(pa.array(values // 1000))
+
+
+def zip_prefix_cities(prefixes: np.ndarray) -> pa.Array:
+    return CITIES.take(pa.array(prefixes * len(CITIES) // ZIP_PREFIXES))
+
+
+def skewed(random: np.random.Generator, size: int, values: int, power: float):
+    """
+    Indices in [0, values) where low indices are far more frequent, like
+    best selling products or the largest cities
+    """
+    return (values * random.random(size) ** power).astype(np.int64)
+
+
+def choice(random: np.random.Generator, distribution: tuple, size: int):
+    values, probabilities = zip(*distribution)
+    probabilities = np.array(probabilities) / sum(probabilities)
+    return np.array(values)[random.choice(len(values), size, p=probabilities)]
+
+
+def timestamps(values: np.ndarray, mask: np.ndarray = None) -> pa.Array:
+    return pa.array(values.astype("datetime64[s]"), pa.timestamp("s"), mask=mask)
+
+
+def dates(values: np.ndarray, mask: np.ndarray = None) -> pa.Array:
+    return pa.array(values.astype("datetime64[D]"), pa.date32(), mask=mask)
+
+
+def hours(random: np.random.Generator, mean: float, size: int) -> np.ndarray:
+    return (random.exponential(mean * 3600, size)).astype("timedelta64[s]")
+
+
+def generate_orders(
+    random: np.random.Generator, scale: Scale, chunk: Chunk, seed: int
+) -> dict:
+    """
+    Customers, orders, and the items, payments and reviews of the orders
+    of the chunk. Every order has its own customer, as in the public data.
+    """
+    rows = np.arange(chunk.start, chunk.stop, dtype=np.int64)
+    size = len(rows)
+
+    # customers: a few people come back with a new customer id
+    prefixes = skewed(random, size, ZIP_PREFIXES, 2.0)
+    customers = {
+        "customer_id": ids("customer", rows, seed),
+        "customer_unique_id": ids("person", rows * 29 // 30, seed),
+        "customer_zip_code_prefix": zip_codes(prefixes),
+        "customer_city": zip_prefix_cities(prefixes),
+        "customer_state": zip_prefix_states(prefixes),
+    }
+
+    # orders, with more purchases as the marketplace grows
+    order_ids = ids("order", rows, seed)
+    purchase = FIRST_PURCHASE + (
+        PURCHASE_DAYS * DAY * np.sqrt(random.random(size))
+    ).astype("timedelta64[s]")
+    status = choice(random, ORDER_STATUSES, size)
+    approved = purchase + hours(random, 10, size)
+    carrier = approved + hours(random, 60, size)
+    delivered = carrier + hours(random, 200, size)
+    estimated = purchase.astype("datetime64[D]") + random.integers(15, 40, size)
+    shipped = np.isin(status, ["shipped", "delivered"])
+    orders = {
+        "order_id": order_ids,
+        "customer_id": customers["customer_id"],
+        "order_status": pa.array(status),
+        "order_purchase_timestamp": timestamps(purchase),
+        "order_approved_at": timestamps(approved, mask=status == "created"),
+        "order_delivered_carrier_date": timestamps(carrier, mask=~shipped),
+        "order_delivered_customer_date": timestamps(
+            delivered, mask=status != "delivered"
+        ),
+        "order_estimated_delivery_date": timestamps(estimated),
+    }
+
+    # items: best selling products, each mostly sold by one seller
+    item_counts = choice(random, ITEMS_PER_ORDER, size)
+    item_orders = np.repeat(np.arange(size), item_counts)
+    items = len(item_orders)
+    first_items = np.cumsum(item_counts) - item_counts
+    products = skewed(random, items, scale.products, 3.0)
+    sellers = (splitmix64(products) % np.uint64(scale.sellers)).astype(np.int64)
+    other_seller = random.random(items) < 0.1
+    sellers[other_seller] = random.integers(0, scale.sellers, other_seller.sum())
+    price = np.round(random.lognormal(np.log(80), 0.9, items), 2)
+    freight = np.round(8 + price * random.gamma(2.0, 0.05, items), 2)
+    order_items = {
+        "order_id": order_ids.take(pa.array(item_orders)),
+        "order_item_qty": pa.array(
+            (np.arange(items) - np.repeat(first_items, item_counts) + 1).astype(
+                np.int32
+            )
+        ),
+        "product_id": ids("product", products, seed),
+        "seller_id": ids("seller", sellers, seed),
+        "shipping_limit_date": dates(purchase[item_orders] + hours(random, 150, items)),
+        "price": pa.array(price),
+        "freight_value": pa.array(freight),
+    }
+
+    # payments split the order total, later ones paid with vouchers
+    totals = np.bincount(item_orders, weights=price + freight, minlength=size)
+    payment_counts = choice(random, PAYMENTS_PER_ORDER, size)
+    payment_orders = np.repeat(np.arange(size), payment_counts)
+    payments = len(payment_orders)
+    sequential = (
+        np.arange(payments)
+        - np.repeat(np.cumsum(payment_counts) - payment_counts, payment_counts)
+        + 1
+    )
+    payment_type = np.where(
+        sequential == 1, choice(random, PAYMENT_TYPES, payments), "voucher"
+    )
+    installments = np.where(
+        payment_type == "credit_card", random.geometric(0.35, payments), 1
+    )
+    order_payments = {
+        "order_id": order_ids.take(pa.array(payment_orders)),
+        "payment_sequential": pa.array(sequential.astype(np.int32)),
+        "payment_type": pa.array(payment_type),
+        "payment_installments": pa.array(np.minimum(installments, 24).astype(np.int32)),
+        "payment_value": pa.array(
+            np.round(totals[payment_orders] / payment_counts[payment_orders], 2)
+        ),
+    }
+
+    # reviews: nearly every order gets one, most without comments
+    reviewed = np.flatnonzero(random.random(size) < 0.998)
+    reviews = len(reviewed)
+    created = (
+        np.where(status == "delivered", delivered, estimated.astype("datetime64[s]"))[
+            reviewed
+        ].astype("datetime64[D]")
+        + 1
+    )
+    order_reviews = {
+        "review_id": ids("review", rows[reviewed], seed),
+        "order_id": order_ids.take(pa.array(reviewed)),
+        "review_score": pa.array(
+            choice(random, REVIEW_SCORES, reviews).astype(np.int32)
+        ),
+        "review_comment_title": REVIEW_TITLES.take(
+            pa.array(
+                random.integers(0, len(REVIEW_TITLES), reviews),
+                mask=random.random(reviews) < 0.88,
+            )
+        ),
+        "review_comment_message": REVIEW_MESSAGES.take(
+            pa.array(
+                random.integers(0, len(REVIEW_MESSAGES), reviews),
+                mask=random.random(reviews) < 0.59,
+            )
+        ),
+        "review_creation_date": dates(created),
+        "review_answer_timestamp": timestamps(
+            created.astype("datetime64[s]") + hours(random, 60, reviews)
+        ),
+    }
+    return {
+        "customers": customers,
+        "orders": orders,
+        "order_items": order_items,
+        "order_payments": order_payments,
+        "order_reviews": order_reviews,
+    }
+
+
+def generate_product_category_name_translation(
+    random: np.random.Generator, scale: Scale, chunk: Chunk, seed: int
+) -> dict:
+    rows = pa.array(np.arange(chunk.start, chunk.stop))
+    return {
+        "product_category_name": CATEGORY_NAMES.take(rows),
+        "product_category_name_english": CATEGORY_NAMES_ENGLISH.take(rows),
+    }
+
+
+def generate_sellers(
+    random: np.random.Generator, scale: Scale, chunk: Chunk, seed: int
+) -> dict:
+    rows = np.arange(chunk.start, chunk.stop, dtype=np.int64)
+    prefixes = skewed(random, len(rows), ZIP_PREFIXES, 2.5)
+    return {
+        "seller_id": ids("seller", rows, seed),
+        "seller_zip_code_prefix": zip_codes(prefixes),
+        "seller_city": zip_prefix_cities(prefixes),
+        "seller_state": zip_prefix_states(prefixes),
+    }
+
+
+def generate_products(
+    random: np.random.Generator, scale: Scale, chunk: Chunk, seed: int
+) -> dict:
+    rows = np.arange(chunk.start, chunk.stop, dtype=np.int64)
+    size = len(rows)
+
+    def measures(low: int, high: int, mean: float, sigma: float) -> np.ndarray:
+        return np.clip(np.round(random.lognormal(np.log(mean), sigma, size)), low, high)
+
+    return {
+        "product_id": ids("product", rows, seed),
+        "product_category_name": CATEGORY_NAMES.take(
+            pa.array(
+                skewed(random, size, CATEGORIES, 2.0), mask=random.random(size) < 0.0185
+            )
+        ),
+        "product_name_length": pa.array(
+            np.clip(random.normal(48, 10, size), 5, 76).astype(np.int32)
+        ),
+        "product_description_length": pa.array(
+            measures(4, 3992, 600, 0.8).astype(np.int32)
+        ),
+        "product_photos_qty": pa.array(
+            np.minimum(random.geometric(0.5, size), 20).astype(np.int32)
+        ),
+        "product_weight_g": pa.array(measures(0, 40425, 700, 1.2)),
+        "product_length_cm": pa.array(measures(7, 105, 25, 0.5)),
+        "product_height_cm": pa.array(measures(2, 105, 12, 0.7)),
+        "product_width_cm": pa.array(measures(6, 118, 20, 0.45)),
+    }
+
+
+def generate_geolocation(
+    random: np.random.Generator, scale: Scale, chunk: Chunk, seed: int
+) -> dict:
+    rows = np.arange(chunk.start, chunk.stop, dtype=np.int64)
+    size = len(rows)
+    # the first rows geolocate every zip code prefix, the others repeat them
+    prefixes = np.where(
+        rows < ZIP_PREFIXES,
+        rows,
+        skewed(random, size, ZIP_PREFIXES, 2.0),
+    )
+    position = prefixes / ZIP_PREFIXES
+    return {
+        "geolocation_zip_code_prefix": zip_codes(prefixes),
+        "geolocation_lat": pa.array(
+            -3.0 - 27.0 * position + random.normal(0, 0.05, size)
+        ),
+        "geolocation_lng": pa.array(
+            -35.0
+            - 20.0 * ((prefixes * 7919 % ZIP_PREFIXES) / ZIP_PREFIXES)
+            + random.normal(0, 0.05, size)
+        ),
+        "geolocation_city": zip_prefix_cities(prefixes),
+        "geolocation_state": zip_prefix_states(prefixes),
+    }
+
+
+GENERATORS = {
+    "orders": generate_orders,
+    "product_category_name_translation": generate_product_category_name_translation,
+    "sellers": generate_sellers,
+    "products": generate_products,
+    "geolocation": generate_geolocation,
+}
+GROUPS = list(GENERATORS)
+
+
+def file_schema(table_name: str, file_format: str) -> pa.Schema:
+    """
+    Source columns of a table, with timestamps to the second in CSV files
+    the way the public datasets write them
+    """
+    fields = []
+    for column in TABLES[table_name].source_columns:
+        arrow_type = column.arrow_type()
+        if file_format == "csv" and pa.types.is_timestamp(arrow_type):
+            arrow_type = pa.timestamp("s")
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def part_path(root: str, table_name: str, part: int, file_format: str) -> str:
+    return posixpath.join(root, table_name, f"part-{part:05d}.{file_format}")
+
+
+def write_file(filesystem, path: str, table: pa.Table, file_format: str) -> int:
+    if file_format == "csv":
+        with filesystem.open_output_stream(path) as stream:
+            csv.write_csv(table, stream)
+    else:
+        pq.write_table(table, path, filesystem=filesystem, compression="snappy")
+    return filesystem.get_file_info(path).size
+
+
+def write_chunk(
+    chunk: Chunk,
+    output_uri: str,
+    scale: Scale,
+    seed: int,
+    file_format: str,
+    tables: set,
+) -> dict:
+    """
+    Generates a chunk and writes the tables asked for. Its random numbers
+    only depend on the seed and the chunk, so chunks can be written in any
+    order and process. Returns {table: (rows, bytes)}.
+    """
+    filesystem, root = resolve(output_uri)
+    random = np.random.default_rng([seed, GROUPS.index(chunk.group), chunk.part])
+    generated = GENERATORS[chunk.group](random, scale, chunk, seed)
+    if chunk.group != "orders":
+        generated = {chunk.group: generated}
+    written = {}
+    for table_name, columns in generated.items():
+        if table_name not in tables:
+            continue
+        schema = file_schema(table_name, file_format)
+        table = pa.Table.from_arrays(
+            [columns[field.name].cast(field.type) for field in schema], schema=schema
+        )
+        path = part_path(root, table_name, chunk.part, file_format)
+        written[table_name] = (
+            table.num_rows,
+            write_file(filesystem, path, table, file_format),
+        )
+    return written
+
+
+def generate(
+    output_uri: str,
+    scale_factor: float = 1.0,
+    seed: int = 0,
+    file_format: str = "csv",
+    chunk_rows: int = 1_000_000,
+    workers: int = None,
+    tables: list = None,
+) -> dict:
+    """
+    Writes the tables (by default all of them) under output_uri/<table>/.
+    Returns {table: {"rows", "files", "bytes"}}.
+    """
+    tables = set(tables or TABLES)
+    groups = tuple(
+        group
+        for group in GROUPS
+        if (group == "orders" and tables & set(ORDER_TABLES)) or group in tables
+    )
+    scale = Scale.from_factor(scale_factor)
+    filesystem, root = resolve(output_uri)
+    for table_name in tables:
+        filesystem.create_dir(posixpath.join(root, table_name), recursive=True)
+
+    totals = defaultdict(lambda: {"rows": 0, "files": 0, "bytes": 0})
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                write_chunk, chunk, output_uri, scale, seed, file_format, tables
+            )
+            for chunk in chunks(scale, chunk_rows, groups)
+        ]
+        for future in futures:
+            for table_name, (rows, size) in future.result().items():
+                totals[table_name]["rows"] += rows
+                totals[table_name]["files"] += 1
+                totals[table_name]["bytes"] += size
+    return dict(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate Olist-like ecommerce datasets at any scale"
+    )
+    parser.add_argument(
+        "--output", required=True, help="Bucket uri (s3://...) or directory"
+    )
+    parser.add_argument(
+        "--scale-factor",
+        type=float,
+        default=1.0,
+        help="1 is the size of the public datasets (about 113k order items)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet"])
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=1_000_000,
+        help="Rows generated (and held in memory) per file and worker",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--tables", nargs="+", default=list(TABLES), choices=list(TABLES)
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    totals = generate(
+        args.output,
+        scale_factor=args.scale_factor,
+        seed=args.seed,
+        file_format=args.format,
+        chunk_rows=args.chunk_rows,
+        workers=args.workers,
+        tables=args.tables,
+    )
+    elapsed = time.perf_counter() - start
+    for table_name, written in sorted(totals.items()):
+        print(
+            f"{table_name}: {written['rows']:,} rows, {written['files']} files, "
+            f"{written['bytes'] / 1e6:.1f} MB"
+        )
+    rows = sum(written["rows"] for written in totals.values())
+    print(f"{rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,436 @@
-import boto3
-
-dms = boto3.client("dms")
-replication_tasks = dms.describe_replication_tasks()["ReplicationTasks"]
-task_arn = [
-    each["ReplicationTaskArn"]
-    for each in replication_tasks
-    if each["ReplicationTaskIdentifier"] == "production-dms-task-ecommerce-rds"
-]
-dms.start_replication_task(
-    ReplicationTaskArn=task_arn[0],
-    StartReplicationTaskType="reload-target",
-)
+import argparse
+import datetime
+import logging
+import os
+import time
+from collections import defaultdict
+
+from data_platform.data_definitions import table_names_list
+from data_platform.dms.identifiers import replication_task_identifier
+from data_platform.glue_catalog.identifiers import crawler_name
+from data_platform.instrumentation import Instrumentation
+
+LOADED_TABLE_STATE = "Table completed"
+FAILED_TABLE_STATES = ("Table error", "Table cancelled")
+FAILED_TASK_STATUSES = ("failed",)
+# task statuses the replication task settles in
+STABLE_TASK_STATUSES = ("ready", "running", "stopped", "failed")
+
+
+def split_table_name(table_name: str) -> tuple:
+    """
+    Returns the (schema, table) of "schema.table", or of a bare table name
+    of the replicated database
+    """
+    if "." in table_name:
+        return tuple(table_name.split(".", 1))
+    for full_name in table_names_list:
+        schema, name = full_name.split(".", 1)
+        if name == table_name:
+            return schema, name
+    raise ValueError(f"{table_name} isn't a replicated table")
+
+
+def rows_per_second(statistics: dict) -> float:
+    start = statistics.get("FullLoadStartTime")
+    end = statistics.get("FullLoadEndTime")
+    if not start or not end:
+        return 0.0
+    return statistics.get("FullLoadRows", 0) / max((end - start).total_seconds(), 1.0)
+
+
+class ReplicationTaskRunner:
+    """
+    Operates the replication task without re-extracting the whole database:
+    reloads only some tables, resumes change data capture from a checkpoint,
+    and polls the task until it gets where it was asked to go. Once tables
+    are (re)loaded it starts the bronze crawler, which has no schedule.
+    """
+
+    def __init__(
+        self,
+        dms,
+        task_identifier: str,
+        poll_seconds: float = 30.0,
+        timeout_seconds: float = 6 * 3600,
+        sleep=time.sleep,
+        instrumentation: Instrumentation = None,
+        glue=None,
+        crawler: str = None,
+    ):
+        self.dms = dms
+        self.glue = glue
+        self.crawler = crawler
+        self.task_identifier = task_identifier
+        self.poll_seconds = poll_seconds
+        self.timeout_seconds = timeout_seconds
+        self.sleep = sleep
+        self.instrumentation = instrumentation or Instrumentation()
+
+    def task(self) -> dict:
+        tasks = self.dms.describe_replication_tasks(
+            Filters=[{"Name": "replication-task-id", "Values": [self.task_identifier]}],
+            WithoutSettings=True,
+        )["ReplicationTasks"]
+        if not tasks:
+            raise RuntimeError(f"Replication task {self.task_identifier} not found")
+        return tasks[0]
+
+    def table_statistics(self, tables: list = None) -> dict:
+        """
+        Statistics of the task's tables, by (schema, table)
+        """
+        task_arn = self.task()["ReplicationTaskArn"]
+        filters = []
+        if tables:
+            filters = [
+                {"Name": "table-name", "Values": sorted({name for _, name in tables})}
+            ]
+        statistics = {}
+        marker = None
+        while True:
+            response = self.dms.describe_table_statistics(
+                ReplicationTaskArn=task_arn,
+                Filters=filters,
+                **({"Marker": marker} if marker else {}),
+            )
+            for table in response["TableStatistics"]:
+                key = (table["SchemaName"], table["TableName"])
+                if not tables or key in tables:
+                    statistics[key] = table
+            marker = response.get("Marker")
+            if not marker:
+                return statistics
+
+    def poll(self, done, description: str):
+        """
+        Calls done() every poll_seconds until it returns a value
+        """
+        deadline = time.monotonic() + self.timeout_seconds
+        with self.instrumentation.span("dms_wait", description=description) as span:
+            while True:
+                span.count("polls")
+                result = done()
+                if result is not None:
+                    return result
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for {description}")
+                self.sleep(self.poll_seconds)
+
+    def wait_for_status(self, statuses: tuple) -> dict:
+        def done():
+            task = self.task()
+            if task["Status"] in statuses:
+                return task
+            if task["Status"] in FAILED_TASK_STATUSES:
+                raise RuntimeError(
+                    f"Replication task {self.task_identifier} failed: "
+                    f"{task.get('LastFailureMessage', '')}"
+                )
+            return None
+
+        return self.poll(done, f"{self.task_identifier} to be {'/'.join(statuses)}")
+
+    def reload_tables(self, tables: list) -> dict:
+        """
+        Reloads (full load again) only the given (schema, table) while CDC
+        keeps running for the others, and waits for them to be loaded.
+        Returns their statistics once loaded.
+        """
+        task = self.task()
+        if task["Status"] != "running":
+            raise RuntimeError(
+                f"Tables can only be reloaded while the task runs, "
+                f"{self.task_identifier} is {task['Status']}"
+            )
+        # a reloaded table gets a new full load end time
+        previous = {
+            key: statistics.get("FullLoadEndTime")
+            for key, statistics in self.table_statistics(tables).items()
+        }
+        self.dms.reload_tables(
+            ReplicationTaskArn=task["ReplicationTaskArn"],
+            TablesToReload=[
+                {"SchemaName": schema, "TableName": name} for schema, name in tables
+            ],
+            ReloadOption="data-reload",
+        )
+
+        def done():
+            statistics = self.table_statistics(tables)
+            for key, table in statistics.items():
+                if table["TableState"] in FAILED_TABLE_STATES:
+                    raise RuntimeError(
+                        f"Reload of {'.'.join(key)} failed: {table['TableState']}"
+                    )
+            loaded = all(
+                key in statistics
+                and statistics[key]["TableState"] == LOADED_TABLE_STATE
+                and statistics[key].get("FullLoadEndTime")
+                and statistics[key]["FullLoadEndTime"] != previous.get(key)
+                for key in tables
+            )
+            return statistics if loaded else None
+
+        statistics = self.poll(done, f"the reload of {len(tables)} tables")
+        self.record_statistics(statistics)
+        self.start_crawler()
+        return statistics
+
+    def start_crawler(self) -> None:
+        """
+        Starts the bronze crawler, so the catalog picks up the schema of the
+        loaded tables. A crawl already running will see them too.
+        """
+        if self.glue is None or not self.crawler:
+            return
+        try:
+            self.glue.start_crawler(Name=self.crawler)
+        except Exception as error:
+            if type(error).__name__ != "CrawlerRunningException":
+                raise
+
+    def record_statistics(self, statistics: dict) -> None:
+        """
+        Sends each table's full load as a span timed by DMS, with its row
+        and change counts
+        """
+        for (schema, name), table in sorted(statistics.items()):
+            start = table.get("FullLoadStartTime")
+            end = table.get("FullLoadEndTime")
+            self.instrumentation.record(
+                "dms_full_load",
+                (end - start).total_seconds() if start and end else 0.0,
+                counters={
+                    "rows": table.get("FullLoadRows", 0),
+                    "inserts": table.get("Inserts", 0),
+                    "updates": table.get("Updates", 0),
+                    "deletes": table.get("Deletes", 0),
+                },
+                started_at=start,
+                table=f"{schema}.{name}",
+                state=table["TableState"],
+            )
+
+    def resume(self, checkpoint: str = None) -> dict:
+        """
+        Restarts a stopped task's change data capture from a checkpoint,
+        by default the one DMS recorded when the task stopped, so nothing
+        is extracted again. A task that never ran starts its full load.
+        """
+        task = self.task()
+        if task["Status"] == "running":
+            return task
+        checkpoint = checkpoint or task.get("RecoveryCheckpoint")
+        if task["Status"] == "ready" and not checkpoint:
+            start_type = "start-replication"
+        else:
+            start_type = "resume-processing"
+        self.dms.start_replication_task(
+            ReplicationTaskArn=task["ReplicationTaskArn"],
+            StartReplicationTaskType=start_type,
+            **({"CdcStartPosition": checkpoint} if checkpoint else {}),
+        )
+        return self.wait_for_status(("running",))
+
+
+class CrawlerRunningException(Exception):
+    """
+    Raised by the local Glue, named like the Glue client's exception
+    """
+
+
+class LocalGlue:
+    """
+    In memory stand-in for the Glue client call the runner makes
+    """
+
+    def __init__(self, running: bool = False):
+        self.running = running
+        self.started = []
+
+    def start_crawler(self, Name: str) -> dict:
+        if self.running:
+            raise CrawlerRunningException(f"Crawler with name {Name} is running")
+        self.started.append(Name)
+        self.running = True
+        return {}
+
+
+class LocalDMS:
+    """
+    In memory stand-in for the DMS client calls the runner makes. A reload
+    or a start takes effect after a number of describe calls, like a task
+    that needs a few polls to get there. Reloads of the failing tables end
+    in a table error.
+    """
+
+    def __init__(
+        self,
+        task_identifier: str,
+        tables: dict,
+        polls: int = 2,
+        failing_tables: tuple = (),
+    ):
+        self.polls = polls
+        self.failing_tables = set(failing_tables)
+        self.task = {
+            "ReplicationTaskIdentifier": task_identifier,
+            "ReplicationTaskArn": f"arn:aws:dms:local:task:{task_identifier}",
+            "Status": "running",
+            "RecoveryCheckpoint": "checkpoint:V1#1#000000/000000",
+        }
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.tables = {
+            (schema, name): {
+                "SchemaName": schema,
+                "TableName": name,
+                "TableState": LOADED_TABLE_STATE,
+                "FullLoadRows": rows,
+                "FullLoadStartTime": now - datetime.timedelta(hours=1),
+                "FullLoadEndTime": now,
+            }
+            for (schema, name), rows in tables.items()
+        }
+        self.pending = defaultdict(list)
+        self.calls = defaultdict(list)
+
+    def tick(self) -> None:
+        for callback in self.pending.pop(0, []):
+            callback()
+        self.pending = defaultdict(
+            list, {polls - 1: callbacks for polls, callbacks in self.pending.items()}
+        )
+
+    def describe_replication_tasks(self, Filters: list, WithoutSettings: bool):
+        self.tick()
+        identifiers = Filters[0]["Values"]
+        if self.task["ReplicationTaskIdentifier"] not in identifiers:
+            return {"ReplicationTasks": []}
+        return {"ReplicationTasks": [dict(self.task)]}
+
+    def describe_table_statistics(self, ReplicationTaskArn: str, Filters: list):
+        names = set(Filters[0]["Values"]) if Filters else None
+        return {
+            "TableStatistics": [
+                dict(table)
+                for (_, name), table in self.tables.items()
+                if names is None or name in names
+            ]
+        }
+
+    def reload_tables(self, ReplicationTaskArn, TablesToReload, ReloadOption):
+        self.calls["reload_tables"].append(TablesToReload)
+        for table in TablesToReload:
+            statistics = self.tables[table["SchemaName"], table["TableName"]]
+            statistics["TableState"] = "Table loading"
+            statistics["FullLoadStartTime"] = datetime.datetime.now(
+                datetime.timezone.utc
+            )
+
+            def loaded(statistics=statistics):
+                key = statistics["SchemaName"], statistics["TableName"]
+                if key in self.failing_tables:
+                    statistics["TableState"] = FAILED_TABLE_STATES[0]
+                    return
+                statistics["TableState"] = LOADED_TABLE_STATE
+                statistics["FullLoadEndTime"] = statistics[
+                    "FullLoadStartTime"
+                ] + datetime.timedelta(seconds=10)
+
+            self.pending[self.polls].append(loaded)
+        return {"ReplicationTaskArn": ReplicationTaskArn}
+
+    def start_replication_task(self, ReplicationTaskArn, **kwargs):
+        self.calls["start_replication_task"].append(kwargs)
+        self.task["Status"] = "starting"
+        self.pending[self.polls].append(lambda: self.task.update(Status="running"))
+        return {"ReplicationTask": dict(self.task)}
+
+
+def print_statistics(statistics: dict) -> None:
+    for (schema, name), table in sorted(statistics.items()):
+        print(
+            f"{schema}.{name}: {table['TableState']}, "
+            f"{table.get('FullLoadRows', 0)} rows loaded "
+            f"({rows_per_second(table):,.0f} rows/s), "
+            f"{table.get('Inserts', 0)} inserts, {table.get('Updates', 0)} updates, "
+            f"{table.get('Deletes', 0)} deletes since"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Operate the DMS replication task of the ecommerce database"
+    )
+    parser.add_argument(
+        "--environment",
+        default=os.environ.get("ENVIRONMENT", "PRODUCTION").lower(),
+        help="Environment whose task is operated (default: $ENVIRONMENT)",
+    )
+    parser.add_argument("--poll-seconds", type=float, default=30.0)
+    parser.add_argument("--timeout-seconds", type=float, default=6 * 3600)
+    commands = parser.add_subparsers(dest="command", required=True)
+    reload_parser = commands.add_parser(
+        "reload", help="Full load some tables again, CDC keeps running for the others"
+    )
+    reload_parser.add_argument(
+        "--tables",
+        nargs="+",
+        required=True,
+        help="Table names, optionally schema qualified",
+    )
+    resume_parser = commands.add_parser(
+        "resume",
+        help="Restart a stopped task's CDC from a checkpoint, or start a new task",
+    )
+    resume_parser.add_argument(
+        "--checkpoint", help="CDC start position (default: the task's own checkpoint)"
+    )
+    wait_parser = commands.add_parser("wait", help="Wait for a task status")
+    wait_parser.add_argument(
+        "--status", nargs="+", default=["running"], choices=STABLE_TASK_STATUSES
+    )
+    commands.add_parser("status", help="Print the task's table statistics")
+    commands.add_parser(
+        "crawl",
+        help="Start the bronze crawler, after the first full load or a schema change",
+    )
+    args = parser.parse_args()
+    # where the log sink of the instrumentation writes spans
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    import boto3
+
+    instrumentation = Instrumentation.from_environment()
+    runner = ReplicationTaskRunner(
+        boto3.client("dms"),
+        replication_task_identifier(args.environment),
+        poll_seconds=args.poll_seconds,
+        timeout_seconds=args.timeout_seconds,
+        instrumentation=instrumentation,
+        glue=boto3.client("glue"),
+        crawler=crawler_name(args.environment, "bronze", "ecommerce_rds"),
+    )
+    with instrumentation.span("trigger_dms", command=args.command):
+        if args.command == "reload":
+            tables = [split_table_name(table_name) for table_name in args.tables]
+            print_statistics(runner.reload_tables(tables))
+        elif args.command == "resume":
+            task = runner.resume(args.checkpoint)
+            print(f"{runner.task_identifier}: {task['Status']}")
+        elif args.command == "wait":
+            task = runner.wait_for_status(tuple(args.status))
+            print(f"{runner.task_identifier}: {task['Status']}")
+        elif args.command == "crawl":
+            runner.start_crawler()
+            print(f"{runner.crawler}: started")
+        else:
+            print(f"{runner.task_identifier}: {runner.task()['Status']}")
+            statistics = runner.table_statistics()
+            runner.record_statistics(statistics)
+            print_statistics(statistics)
+
+
+if __name__ == "__main__":
+    main()
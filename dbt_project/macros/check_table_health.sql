@@ -0,0 +1,50 @@
+{#
+    Flags the tables dbt built on Redshift that are skewed across slices
+    (skew_rows is the ratio between the fullest and emptiest slice), have
+    no sort key, or have too large an unsorted region, which incremental
+    delete+insert runs grow until the table is vacuumed.
+    Runs as an on-run-end hook: it logs by default, and fails the run with
+    --vars '{fail_on_unhealthy_tables: true}'.
+#}
+{% macro check_table_health(
+    schemas,
+    max_skew=var('max_table_skew', 4),
+    max_unsorted_percent=var('max_unsorted_percent', 20)
+) %}
+    {% if execute and target.type == 'redshift' and schemas %}
+        {% set query %}
+            select
+                "schema" || '.' || "table" as relation,
+                diststyle,
+                sortkey1,
+                skew_rows,
+                unsorted
+            from svv_table_info
+            where "schema" in ('{{ schemas | join("', '") }}')
+                and (
+                    skew_rows > {{ max_skew }}
+                    or unsorted > {{ max_unsorted_percent }}
+                    or sortkey1 is null
+                )
+            order by 1
+        {% endset %}
+        {% set unhealthy = run_query(query) %}
+        {% for relation, diststyle, sortkey1, skew_rows, unsorted in unhealthy.rows %}
+            {% set problems = [] %}
+            {% if sortkey1 is none %}
+                {% do problems.append('has no sort key') %}
+            {% elif unsorted is not none and unsorted > max_unsorted_percent %}
+                {% do problems.append(unsorted ~ '% unsorted, run VACUUM SORT ONLY') %}
+            {% endif %}
+            {% if skew_rows is not none and skew_rows > max_skew %}
+                {% do problems.append('skewed ' ~ skew_rows ~ 'x across slices with ' ~ diststyle) %}
+            {% endif %}
+            {{ log('Table health: ' ~ relation ~ ' ' ~ problems | join(', '), info=true) }}
+        {% endfor %}
+        {% if unhealthy.rows and var('fail_on_unhealthy_tables', false) %}
+            {{ exceptions.raise_compiler_error(
+                unhealthy.rows | length ~ ' tables are skewed or unsorted, see the log above'
+            ) }}
+        {% endif %}
+    {% endif %}
+{% endmacro %}
@@ -0,0 +1,12 @@
+{#
+    Latest extracted_at already loaded into an incremental model, moved back
+    by a lookback so rows merged into silver late (a table whose CDC merge ran
+    after another's) are still picked up. Reprocessing them is harmless, the
+    incremental models replace whole keys.
+#}
+{% macro incremental_watermark(column='extracted_at', lookback_hours=var('incremental_lookback_hours', 3)) %}
+    (
+        select {{ dbt_utils.dateadd('hour', -lookback_hours, 'max(' ~ column ~ ')') }}
+        from {{ this }}
+    )
+{% endmacro %}
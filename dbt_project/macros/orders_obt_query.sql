@@ -0,0 +1,197 @@
+{#
+    Query behind the orders_obt mart. On incremental runs only the orders
+    with a source row extracted since the last run are rebuilt, every row of
+    each of them, so the delete+insert on order_id replaces them whole.
+    The full refresh equivalence test builds it with incremental=false.
+#}
+{% macro orders_obt_query(incremental=false) %}
+
+with
+
+{% if incremental %}
+changed_orders as (
+
+    {% for model in ['stg__orders', 'stg__order_items', 'stg__order_reviews', 'stg__order_payments'] %}
+    select order_id from {{ ref(model) }}
+    where extracted_at > {{ incremental_watermark() }}
+    union
+    {% endfor %}
+    -- a product's new category changes every order it was sold in
+    select order_items.order_id
+    from {{ ref('stg__order_items') }} as order_items
+    join {{ ref('stg__products') }} as products
+        on order_items.product_id = products.product_id
+    where products.extracted_at > {{ incremental_watermark() }}
+
+),
+{% endif %}
+
+order_items as (
+
+    select * from {{ ref('stg__order_items') }}
+    {% if incremental %}
+    where order_id in (select order_id from changed_orders)
+    {% endif %}
+
+),
+
+products as (
+
+    select * from {{ ref('stg__products') }}
+
+),
+
+summarized_items as (
+
+    select
+        order_items.order_id as order_id,
+        order_items.seller_id as seller_id,
+        products.product_id as product_id,
+        products.product_category_name as product_category,
+        count(*) as item_quantity,
+        sum(order_items.gmv) as gmv,
+        max(greatest(order_items.extracted_at, products.extracted_at)) as extracted_at
+    from order_items
+    join products on order_items.product_id = products.product_id
+    group by
+        order_items.order_id,
+        order_items.seller_id,
+        products.product_id,
+        products.product_category_name
+
+),
+
+
+
+orders as (
+
+    select * from {{ ref('stg__orders') }}
+    {% if incremental %}
+    where order_id in (select order_id from changed_orders)
+    {% endif %}
+
+),
+
+order_reviews as (
+
+    select * from {{ ref('stg__order_reviews') }}
+    {% if incremental %}
+    where order_id in (select order_id from changed_orders)
+    {% endif %}
+
+),
+
+order_payments as (
+
+    select * from {{ ref('stg__order_payments') }}
+    {% if incremental %}
+    where order_id in (select order_id from changed_orders)
+    {% endif %}
+
+),
+
+summarized_reviews as (
+
+    -- the score of each order's latest review
+    select
+        order_id,
+        review_score,
+        extracted_at
+    from (
+        select
+            order_id,
+            review_score,
+            max(extracted_at) over (partition by order_id) as extracted_at,
+            row_number() over (
+                partition by order_id
+                order by review_answer_timestamp desc nulls last, review_id
+            ) as review_rank
+        from order_reviews
+    ) as ranked_reviews
+    where review_rank = 1
+
+),
+
+summarized_payments as (
+
+    -- total value, longest installments and the type that paid the most
+    select
+        order_id,
+        payment_type,
+        payment_installments,
+        payment_value,
+        extracted_at
+    from (
+        select
+            order_id,
+            payment_type,
+            max(payment_installments) over (partition by order_id) as payment_installments,
+            sum(payment_value) over (partition by order_id) as payment_value,
+            max(extracted_at) over (partition by order_id) as extracted_at,
+            row_number() over (
+                partition by order_id
+                order by payment_value desc nulls last, payment_sequential
+            ) as payment_rank
+        from order_payments
+    ) as ranked_payments
+    where payment_rank = 1
+
+),
+
+summarized_orders as (
+
+    -- one row per order: reviews and payments are summarized first, joining
+    -- them as they are would repeat the order's items for each of them
+    select
+        orders.order_id,
+        orders.customer_id,
+        orders.order_status,
+        orders.order_purchase_date,
+        orders.order_purchase_year,
+        orders.order_purchase_month,
+        orders.order_purchase_quarter,
+        summarized_reviews.review_score,
+        summarized_payments.payment_type,
+        summarized_payments.payment_installments,
+        summarized_payments.payment_value,
+        greatest(
+            orders.extracted_at,
+            coalesce(summarized_reviews.extracted_at, orders.extracted_at),
+            coalesce(summarized_payments.extracted_at, orders.extracted_at)
+        ) as extracted_at
+    from orders
+    left join summarized_reviews on orders.order_id = summarized_reviews.order_id
+    left join summarized_payments on orders.order_id = summarized_payments.order_id
+
+),
+
+orders_obt as (
+
+    select
+        summarized_orders.order_id,
+        summarized_orders.customer_id,
+        summarized_orders.order_status,
+        summarized_orders.order_purchase_date,
+        summarized_orders.order_purchase_year,
+        summarized_orders.order_purchase_month,
+        summarized_orders.order_purchase_quarter,
+        summarized_orders.review_score,
+        summarized_orders.payment_type,
+        summarized_orders.payment_installments,
+        summarized_orders.payment_value,
+        summarized_items.seller_id,
+        summarized_items.product_id,
+        summarized_items.product_category,
+        summarized_items.item_quantity,
+        summarized_items.gmv,
+        greatest(
+            summarized_orders.extracted_at, summarized_items.extracted_at
+        ) as extracted_at
+    from summarized_orders
+    join summarized_items on summarized_orders.order_id = summarized_items.order_id
+
+)
+
+select * from orders_obt
+
+{% endmacro %}
@@ -12,5 +12,7 @@ select
     price::float as unit_price,
     freight_value::float as freight_value,
     order_item_id::varchar,
-    ((1.0 * item_quantity * price) + freight_value)::float as gmv
+    -- each row is one item, order_item_qty numbers the items of an order
+    (price + coalesce(freight_value, 0))::float as gmv,
+    extracted_at::timestamp
 from source
\ No newline at end of file
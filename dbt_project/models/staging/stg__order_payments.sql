@@ -5,6 +5,9 @@ with source as (
 )
 select
     order_id::varchar,
+    payment_sequential::int,
     lower(payment_type)::varchar as payment_type,
-    payment_installments::int
+    payment_installments::int,
+    payment_value::float,
+    extracted_at::timestamp
 from source
\ No newline at end of file
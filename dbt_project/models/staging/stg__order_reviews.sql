@@ -10,5 +10,6 @@ select
     review_comment_title::varchar,
     review_comment_message::varchar,
     review_creation_date::date,
-    review_answer_timestamp::timestamp
+    review_answer_timestamp::timestamp,
+    extracted_at::timestamp
 from source
\ No newline at end of file
@@ -15,5 +15,6 @@ select
     order_purchase_date::date,
     extract (year from order_purchase_date)::int as order_purchase_year,
     extract (month from order_purchase_date)::int as order_purchase_month,
-    extract (quarter from order_purchase_date)::int as order_purchase_quarter
+    extract (quarter from order_purchase_date)::int as order_purchase_quarter,
+    extracted_at::timestamp
 from source
@@ -12,5 +12,6 @@ select
     product_weight_g::float,
     product_length_cm::float,
     product_height_cm::float,
-    product_width_cm::float
+    product_width_cm::float,
+    extracted_at::timestamp
 from source
\ No newline at end of file
@@ -0,0 +1,35 @@
+-- Rows that differ between the incrementally built orders_obt and the same
+-- mart built from scratch. Run it after a few incremental runs, with the
+-- local target (see README.md) to check changes to the incremental logic.
+
+with full_refresh as (
+
+    {{ orders_obt_query(incremental=false) }}
+
+),
+
+incremental as (
+
+    select * from {{ ref('orders_obt') }}
+
+),
+
+missing as (
+
+    select * from full_refresh
+    except
+    select * from incremental
+
+),
+
+unexpected as (
+
+    select * from incremental
+    except
+    select * from full_refresh
+
+)
+
+select 'missing' as difference, * from missing
+union all
+select 'unexpected' as difference, * from unexpected
@@ -0,0 +1,30 @@
+-- Fails when orders_obt doesn't have exactly one row per distinct
+-- (order, seller, product) of the order items with a known order and product
+
+with item_grain as (
+
+    select count(*) as rows
+    from (
+        select distinct
+            order_items.order_id,
+            order_items.seller_id,
+            order_items.product_id
+        from {{ ref('stg__order_items') }} as order_items
+        join {{ ref('stg__orders') }} as orders
+            on order_items.order_id = orders.order_id
+        join {{ ref('stg__products') }} as products
+            on order_items.product_id = products.product_id
+    ) as distinct_items
+
+),
+
+mart as (
+
+    select count(*) as rows from {{ ref('orders_obt') }}
+
+)
+
+select item_grain.rows as expected_rows, mart.rows as mart_rows
+from item_grain
+cross join mart
+where item_grain.rows != mart.rows
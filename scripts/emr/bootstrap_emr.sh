@@ -7,4 +7,7 @@
 sudo yum install -y jq
 
 # install some useful python packages
-sudo python3 -m pip install boto3 ec2-metadata unidecode
\ No newline at end of file
+sudo python3 -m pip install boto3 ec2-metadata unidecode
+
+# libraries of the data_platform.processing jobs
+sudo python3 -m pip install pyarrow numpy
\ No newline at end of file
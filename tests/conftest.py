@@ -0,0 +1,4 @@
+import os
+
+# data_platform.active_environment reads it at import time
+os.environ.setdefault("ENVIRONMENT", "PRODUCTION")
@@ -0,0 +1,214 @@
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+
+from data_platform.processing.bronze_to_silver import process_table
+from data_platform.processing import cdc_merge
+from data_platform.processing.cdc_merge import merge_table, touched_directories
+from data_platform.processing.compaction import compact_table
+from data_platform.processing.storage import (
+    BRONZE_PREFIX,
+    QUARANTINE_PREFIX,
+    SILVER_PREFIX,
+    table_path,
+)
+
+TABLE = "orders"
+
+
+def write_bronze(bronze, name, rows):
+    source = table_path(bronze, BRONZE_PREFIX, TABLE)
+    os.makedirs(source, exist_ok=True)
+    columns = ["order_id", "customer_id", "order_status", "order_purchase_timestamp"]
+    table = pa.table(
+        {
+            **{column: [row.get(column) for row in rows] for column in columns},
+            "extracted_at": pa.array(
+                [row["extracted_at"] for row in rows], pa.string()
+            ),
+        }
+    )
+    if not name.startswith("LOAD"):
+        table = table.append_column("Op", pa.array([row["Op"] for row in rows]))
+    pq.write_table(table, f"{source}/{name}")
+
+
+def order(order_id, status, extracted_at, op="U", customer_id="c1", day="2021-05-01"):
+    return {
+        "order_id": order_id,
+        "customer_id": customer_id,
+        "order_status": status,
+        "order_purchase_timestamp": f"{day} 10:00:00",
+        "extracted_at": extracted_at,
+        "Op": op,
+    }
+
+
+def silver_rows(root, prefix=SILVER_PREFIX):
+    path = table_path(root, prefix, TABLE)
+    table = ds.dataset(path, format="parquet", partitioning="hive").to_table()
+    return {row["order_id"]: row for row in table.sort_by("order_id").to_pylist()}
+
+
+@pytest.fixture
+def lake(tmp_path):
+    bronze, silver = str(tmp_path / "bronze"), str(tmp_path / "silver")
+    write_bronze(
+        bronze,
+        "LOAD00000001.parquet",
+        [
+            order("a", "created", "2021-05-01 10:00:00"),
+            order("b", "created", "2021-05-01 10:00:00"),
+        ],
+    )
+    process_table(TABLE, bronze, silver)
+    return bronze, silver
+
+
+def test_changes_replace_the_rows_of_their_keys(lake):
+    bronze, silver = lake
+    write_bronze(
+        bronze,
+        "20210502-100000000.parquet",
+        [
+            order("a", "shipped", "2021-05-02 10:00:00"),
+            order("b", "created", "2021-05-02 10:00:00", op="D"),
+            order("c", "created", "2021-05-02 10:00:00", op="I", day="2021-05-02"),
+        ],
+    )
+
+    stats = merge_table(TABLE, bronze, silver)
+
+    assert stats["changes"] == 3
+    rows = silver_rows(silver)
+    assert sorted(rows) == ["a", "c"]
+    assert rows["a"]["order_status"] == "shipped"
+
+
+def test_invalid_changes_are_quarantined(lake):
+    bronze, silver = lake
+    write_bronze(
+        bronze,
+        "20210502-100000000.parquet",
+        [
+            order("a", "shipped", "2021-05-02 10:00:00"),
+            order("b", "shipped", "2021-05-02 10:00:00", customer_id=None),
+        ],
+    )
+
+    stats = merge_table(TABLE, bronze, silver)
+
+    assert stats["quality"]["quarantined"] == 1
+    assert stats["quality"]["null customer_id"] == 1
+    rows = silver_rows(silver)
+    assert rows["a"]["order_status"] == "shipped"
+    # the rejected update leaves the previous version in place
+    assert rows["b"]["order_status"] == "created"
+    quarantined = silver_rows(silver, QUARANTINE_PREFIX)
+    assert list(quarantined) == ["b"]
+    assert quarantined["b"]["violation"] == "null customer_id"
+
+
+def test_later_files_with_the_last_extracted_at_are_merged(lake):
+    bronze, silver = lake
+    write_bronze(
+        bronze,
+        "20210502-100000000.parquet",
+        [order("a", "approved", "2021-05-02 10:00:00")],
+    )
+    merge_table(TABLE, bronze, silver)
+    write_bronze(
+        bronze,
+        "20210502-100000500.parquet",
+        [order("b", "approved", "2021-05-02 10:00:00")],
+    )
+
+    stats = merge_table(TABLE, bronze, silver)
+
+    assert stats["changes"] == 1
+    assert silver_rows(silver)["b"]["order_status"] == "approved"
+
+
+def test_rows_moving_partition_are_found_outside_it(lake):
+    bronze, silver = lake
+    write_bronze(
+        bronze,
+        "20210502-100000000.parquet",
+        [order("a", "created", "2021-05-02 10:00:00", day="2021-04-30")],
+    )
+
+    merge_table(TABLE, bronze, silver)
+
+    rows = silver_rows(silver)
+    assert sorted(rows) == ["a", "b"]
+    assert str(rows["a"]["order_purchase_date"]) == "2021-04-30"
+
+
+def test_keys_are_searched_in_their_partitions_first(lake, monkeypatch):
+    bronze, silver = lake
+    write_bronze(
+        bronze,
+        "20210502-100000000.parquet",
+        [order("c", "created", "2021-05-02 10:00:00", op="I", day="2021-05-02")],
+    )
+    merge_table(TABLE, bronze, silver)
+    target = table_path(silver, SILVER_PREFIX, TABLE)
+    partition = f"{target}/order_purchase_date=2021-05-01"
+    searched = []
+    key_array = cdc_merge.key_array
+
+    def recording_key_array(table, keys):
+        searched.append(table.num_rows)
+        return key_array(table, keys)
+
+    monkeypatch.setattr(cdc_merge, "key_array", recording_key_array)
+    filesystem, _ = cdc_merge.resolve(silver)
+
+    directories = touched_directories(
+        filesystem, target, ["order_id"], pa.array(["a"]), partitions={partition}
+    )
+
+    assert directories == {partition}
+    # the 2021-05-01 file holds a, the 2021-05-02 one isn't read
+    assert searched == [2]
+
+
+def write_payments(bronze, name, order_ids):
+    source = table_path(bronze, BRONZE_PREFIX, "order_payments")
+    os.makedirs(source, exist_ok=True)
+    rows = len(order_ids)
+    table = pa.table(
+        {
+            "order_id": order_ids,
+            "payment_sequential": [1] * rows,
+            "payment_type": ["credit_card"] * rows,
+            "payment_installments": [1] * rows,
+            "payment_value": [10.0] * rows,
+            "extracted_at": pa.array([f"2021-05-01 1{rows}:00:00"] * rows),
+        }
+    )
+    if not name.startswith("LOAD"):
+        table = table.append_column("Op", pa.array(["I"] * rows))
+    pq.write_table(table, f"{source}/{name}")
+
+
+def test_compacted_changes_are_not_merged_twice(tmp_path):
+    bronze, silver = str(tmp_path / "bronze"), str(tmp_path / "silver")
+    write_payments(bronze, "LOAD00000001.parquet", ["a"])
+    process_table("order_payments", bronze, silver)
+    write_payments(bronze, "20210501-100000000.parquet", ["b"])
+    merge_table("order_payments", bronze, silver)
+    write_payments(bronze, "20210501-110000000.parquet", ["c"])
+
+    compacted = compact_table("order_payments", bronze)
+    merge_table("order_payments", bronze, silver)
+    stats = merge_table("order_payments", bronze, silver)
+
+    assert compacted["removed"] == 2
+    assert stats["files"] == 0
+    path = table_path(silver, SILVER_PREFIX, "order_payments")
+    order_ids = ds.dataset(path, format="parquet").to_table()["order_id"]
+    assert sorted(order_ids.to_pylist()) == ["a", "b", "c"]
@@ -0,0 +1,121 @@
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from data_platform.processing.compaction import (
+    change_key,
+    compact_table,
+    replaced_files,
+    visible_files,
+)
+from data_platform.processing.storage import (
+    BRONZE_PREFIX,
+    list_files,
+    resolve,
+    staging_directory,
+    state_directory,
+    table_path,
+)
+
+TABLE = "orders"
+DAY = "20210520"
+
+
+@pytest.fixture
+def bronze(tmp_path):
+    source = table_path(str(tmp_path), BRONZE_PREFIX, TABLE)
+    os.makedirs(source)
+    for number in range(3):
+        pq.write_table(
+            pa.table({"Op": ["I"], "order_id": [str(number)]}),
+            f"{source}/{DAY}-11000000{number}.parquet",
+        )
+    return str(tmp_path)
+
+
+def visible_names(bronze):
+    filesystem, root = resolve(bronze)
+    return sorted(
+        os.path.basename(info.path) for info in visible_files(filesystem, root, TABLE)
+    )
+
+
+def table_names(bronze):
+    return sorted(os.listdir(table_path(bronze, BRONZE_PREFIX, TABLE)))
+
+
+def manifests(bronze):
+    directory = state_directory(bronze, "compaction", TABLE)
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+
+
+def test_replaced_files_stay_until_the_retention_expires(bronze):
+    filesystem, root = resolve(bronze)
+    stats = compact_table(TABLE, bronze, target_size=1024 * 1024)
+
+    assert stats["removed"] == 3
+    assert stats["added"] == 1
+    assert stats["rows"] == 3
+    # readers that listed the table before the compaction can still read it
+    assert len(table_names(bronze)) == 4
+    compacted = visible_names(bronze)
+    assert len(compacted) == 1 and "-compacted-" in compacted[0]
+    assert not list_files(filesystem, staging_directory(root, "compaction", TABLE))
+
+    stats = compact_table(TABLE, bronze, target_size=1024 * 1024, retention_hours=0)
+
+    assert stats["deleted"] == 3
+    assert table_names(bronze) == compacted
+    assert not os.listdir(state_directory(bronze, "compaction", TABLE))
+
+
+def test_committed_outputs_are_published_by_the_next_run(bronze):
+    compact_table(TABLE, bronze, target_size=1024 * 1024)
+    (path,) = manifests(bronze)
+    with open(path) as stream:
+        manifest = json.load(stream)
+    # as if the run stopped between its commit and the move of its outputs
+    source = table_path(bronze, BRONZE_PREFIX, TABLE)
+    staged = os.path.join(
+        staging_directory(bronze, "compaction", TABLE), manifest["staged"][0]
+    )
+    os.makedirs(os.path.dirname(staged), exist_ok=True)
+    os.rename(os.path.join(source, manifest["added"][0]), staged)
+
+    assert visible_names(bronze) == sorted(
+        os.path.basename(name) for name in manifest["removed"]
+    )
+
+    compact_table(TABLE, bronze, target_size=1024 * 1024)
+
+    assert visible_names(bronze) == [os.path.basename(manifest["added"][0])]
+
+
+def test_uncommitted_outputs_are_never_visible(bronze):
+    staging = staging_directory(bronze, "compaction", TABLE, "20210521T000000")
+    os.makedirs(staging)
+    orphan = os.path.join(staging, f"{DAY}-compacted-20210521T000000-0000.parquet")
+    pq.write_table(pa.table({"Op": ["I"], "order_id": ["x"]}), orphan)
+
+    assert len(visible_names(bronze)) == 3
+
+    compact_table(TABLE, bronze, target_size=1024 * 1024)
+
+    assert not os.path.exists(orphan)
+
+
+def test_compacted_files_sort_after_the_files_they_replace(bronze):
+    filesystem, root = resolve(bronze)
+    compact_table(TABLE, bronze, target_size=1024 * 1024)
+
+    (compacted,) = visible_files(filesystem, root, TABLE)
+
+    name = os.path.basename(compacted.path)
+    assert change_key(f"{DAY}-110000002.parquet") < change_key(name)
+    assert change_key(name) < change_key(f"{DAY}-110000003.parquet")
+    assert replaced_files(filesystem, compacted.path) == [
+        [f"{DAY}-11000000{number}.parquet", 1] for number in range(3)
+    ]
@@ -0,0 +1,213 @@
+import os
+import sqlite3
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from data_platform.processing.bronze_to_silver import process_table
+from data_platform.processing.bronze_to_silver import SILVER_TABLES
+from data_platform.data_definitions import TABLES
+from data_platform.processing.storage import (
+    BRONZE_PREFIX,
+    SILVER_PREFIX,
+    resolve,
+    table_path,
+)
+from data_platform.redshift.copy_loader import (
+    LocalRedshift,
+    RedshiftCopyLoader,
+    signature,
+    silver_partitions,
+)
+
+IAM_ROLE = "arn:aws:iam::123:role/redshift"
+
+
+def write_bronze(bronze, table_name, columns: dict):
+    source = table_path(bronze, BRONZE_PREFIX, table_name)
+    os.makedirs(source, exist_ok=True)
+    rows = len(next(iter(columns.values())))
+    table = pa.table(
+        dict(columns, extracted_at=pa.array(["2021-05-01 10:00:00"] * rows))
+    )
+    pq.write_table(table, f"{source}/LOAD00000001.parquet")
+
+
+@pytest.fixture
+def silver(tmp_path):
+    bronze, silver = str(tmp_path / "bronze"), str(tmp_path / "silver")
+    write_bronze(
+        bronze,
+        "orders",
+        {
+            "order_id": ["a", "b", "c"],
+            "customer_id": ["c1", "c1", "c2"],
+            "order_status": ["created"] * 3,
+            "order_purchase_timestamp": [
+                "2018-01-01 10:00:00",
+                "2018-01-01 11:00:00",
+                "2018-01-02 10:00:00",
+            ],
+        },
+    )
+    write_bronze(
+        bronze,
+        "sellers",
+        {
+            "seller_id": ["s1", "s2"],
+            "seller_zip_code_prefix": ["01000", "02000"],
+            "seller_city": ["sao paulo", "campinas"],
+            "seller_state": ["SP", "SP"],
+        },
+    )
+    for table_name in ("orders", "sellers"):
+        process_table(table_name, bronze, silver, validate=False)
+    return silver
+
+
+class RecordingConnection:
+    """
+    Records the statements the loader sends, answering its load state
+    query with the given {partition value: signature}
+    """
+
+    def __init__(self, loaded: dict = None):
+        self.loaded = loaded or {}
+        self.statements = []
+        self.description = None
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql: str) -> None:
+        self.statements.append(sql)
+        self.description = sql.startswith("select") or None
+        self.result = list(self.loaded.items()) if self.description else []
+
+    def fetchall(self) -> list:
+        return self.result
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+
+def statements_like(connection, *words) -> list:
+    return [
+        sql
+        for sql in connection.statements
+        if all(word in sql.lower() for word in words)
+    ]
+
+
+def test_partitions_are_copied_from_their_prefixes(silver):
+    connection = RecordingConnection()
+    loader = RedshiftCopyLoader(connection, silver, IAM_ROLE)
+
+    stats = loader.load_table("orders")
+
+    assert stats["partitions"] == 2
+    copies = statements_like(connection, "copy silver.orders__staging_files")
+    assert [copy.split("'")[1] for copy in copies] == [
+        f"{table_path(silver, SILVER_PREFIX, 'orders')}/order_purchase_date={day}/"
+        for day in ("2018-01-01", "2018-01-02")
+    ]
+    assert not statements_like(connection, "manifest")
+    inserts = statements_like(connection, "insert into silver.orders__staging ")
+    assert [insert.split("cast(")[1] for insert in inserts] == [
+        "'2018-01-01' as date) from silver.orders__staging_files",
+        "'2018-01-02' as date) from silver.orders__staging_files",
+    ]
+
+
+def test_unchanged_partitions_are_not_copied(silver):
+    filesystem, root = resolve(silver)
+    partitions = silver_partitions(filesystem, root, SILVER_TABLES["orders"])
+    loaded = {value: signature(files, root) for value, files in partitions.items()}
+    loaded["2018-01-02"] = "rewritten since"
+    connection = RecordingConnection(loaded)
+    loader = RedshiftCopyLoader(connection, silver, IAM_ROLE)
+
+    stats = loader.load_table("orders")
+
+    assert stats["partitions"] == 1
+    (copy,) = statements_like(connection, "copy ")
+    assert "order_purchase_date=2018-01-02/" in copy
+    (delete,) = statements_like(connection, "delete from silver.orders ")
+    assert "in (cast('2018-01-02' as date))" in delete
+
+
+def test_unpartitioned_tables_are_copied_once(silver):
+    connection = RecordingConnection()
+    loader = RedshiftCopyLoader(connection, silver, IAM_ROLE)
+
+    loader.load_table("sellers")
+
+    (copy,) = statements_like(connection, "copy silver.sellers__staging")
+    assert "format as parquet manifest" in copy
+    # the manifest is removed once copied
+    assert not os.listdir(os.path.join(silver, "_state", "copy", "sellers"))
+
+
+def test_local_redshift_copies_a_prefix(silver):
+    connection = sqlite3.connect(":memory:")
+    cursor = LocalRedshift(connection, placeholder="?").cursor()
+    prefix = table_path(silver, SILVER_PREFIX, "sellers")
+
+    cursor.execute(TABLES["sellers"].redshift_ddl("sellers"))
+    cursor.execute(
+        f"copy sellers from '{prefix}/' iam_role '{IAM_ROLE}' format as parquet"
+    )
+
+    rows = connection.execute("select * from sellers order by seller_id").fetchall()
+    assert [row[0] for row in rows] == ["s1", "s2"]
+
+
+@pytest.fixture
+def postgres():
+    psycopg2 = pytest.importorskip("psycopg2")
+    dsn = os.environ.get("TEST_POSTGRES_DSN")
+    if not dsn:
+        pytest.skip("TEST_POSTGRES_DSN isn't set")
+    connection = psycopg2.connect(dsn)
+    schemas = [f"test_{uuid.uuid4().hex[:8]}" for _ in range(2)]
+    yield connection, schemas
+    connection.rollback()
+    with connection.cursor() as cursor:
+        for schema in schemas:
+            cursor.execute(f"drop schema if exists {schema} cascade")
+    connection.commit()
+    connection.close()
+
+
+def test_local_redshift_loads_and_skips_unchanged_partitions(silver, postgres):
+    connection, (schema, external_schema) = postgres
+    loader = RedshiftCopyLoader(
+        LocalRedshift(connection),
+        silver,
+        IAM_ROLE,
+        schema=schema,
+        external_schema=external_schema,
+    )
+
+    first = loader.load(["orders", "sellers"])
+    second = loader.load(["orders", "sellers"])
+
+    assert [stats["partitions"] for stats in first] == [2, 1]
+    assert [stats["partitions"] for stats in second] == [0, 0]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"select order_id, cast(order_purchase_date as text) "
+            f"from {schema}.orders order by order_id"
+        )
+        assert cursor.fetchall() == [
+            ("a", "2018-01-01"),
+            ("b", "2018-01-01"),
+            ("c", "2018-01-02"),
+        ]
+        cursor.execute(f"select count(*) from {schema}.sellers")
+        assert cursor.fetchone() == (2,)
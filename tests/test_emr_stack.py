@@ -0,0 +1,82 @@
+import pytest
+
+core = pytest.importorskip("aws_cdk.core")
+
+from data_platform.active_environment import active_environment
+from data_platform.common_stack import CommonResourcesStack
+from data_platform.emr.base import TASK_INSTANCE_TYPES
+from data_platform.emr.stack import EMRStack
+
+
+def resources_of_type(template: dict, resource_type: str) -> list:
+    return [
+        resource["Properties"]
+        for resource in template["Resources"].values()
+        if resource["Type"] == resource_type
+    ]
+
+
+@pytest.fixture(scope="module")
+def template():
+    app = core.App()
+    EMRStack(app, CommonResourcesStack(app), persistent_cluster=True)
+    return (
+        app.synth().get_stack_by_name(f"{active_environment.value}-emr-stack").template
+    )
+
+
+@pytest.fixture(scope="module")
+def cluster(template):
+    (cluster,) = resources_of_type(template, "AWS::EMR::Cluster")
+    return cluster
+
+
+def test_master_and_core_fleets_are_on_demand(cluster):
+    instances = cluster["Instances"]
+
+    assert instances["MasterInstanceFleet"]["TargetOnDemandCapacity"] == 1
+    assert instances["CoreInstanceFleet"]["TargetOnDemandCapacity"] == 2
+    assert instances["CoreInstanceFleet"]["InstanceTypeConfigs"] == [
+        {"InstanceType": "m5.xlarge", "WeightedCapacity": 1}
+    ]
+    assert instances["KeepJobFlowAliveWhenNoSteps"] is True
+
+
+def test_task_fleet_runs_on_spot(template):
+    (fleet,) = resources_of_type(template, "AWS::EMR::InstanceFleetConfig")
+
+    assert fleet["InstanceFleetType"] == "TASK"
+    assert {
+        config["InstanceType"]: config["WeightedCapacity"]
+        for config in fleet["InstanceTypeConfigs"]
+    } == TASK_INSTANCE_TYPES
+    spot = fleet["LaunchSpecifications"]["SpotSpecification"]
+    assert spot["AllocationStrategy"] == "capacity-optimized"
+    assert spot["TimeoutAction"] == "SWITCH_TO_ON_DEMAND"
+
+
+def test_managed_scaling_keeps_core_nodes_on_demand(cluster):
+    limits = cluster["ManagedScalingPolicy"]["ComputeLimits"]
+
+    assert limits == {
+        "UnitType": "InstanceFleetUnits",
+        "MinimumCapacityUnits": 2,
+        "MaximumCapacityUnits": 10,
+        "MaximumCoreCapacityUnits": 2,
+        "MaximumOnDemandCapacityUnits": 2,
+    }
+
+
+def test_cluster_outlives_idle_periods(cluster):
+    # CloudFormation wouldn't recreate a cluster that terminated itself
+    assert "AutoTerminationPolicy" not in cluster
+
+
+def test_nodes_install_the_python_libraries(cluster):
+    (action,) = cluster["BootstrapActions"]
+
+    assert action["Name"] == "install_python_libraries"
+    path = action["ScriptBootstrapAction"]["Path"]
+    parts = path["Fn::Join"][1] if isinstance(path, dict) else [path]
+    assert parts[0] == "s3://"
+    assert parts[-1] == "/bootstrap_emr.sh"
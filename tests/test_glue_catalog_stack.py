@@ -0,0 +1,94 @@
+import pytest
+
+core = pytest.importorskip("aws_cdk.core")
+
+from data_platform.active_environment import active_environment
+from data_platform.data_lake.stack import DataLakeStack
+from data_platform.glue_catalog.stack import GlueCatalogStack
+
+
+def literal(value) -> str:
+    """
+    The text of a template value, with the tokens of an Fn::Join as <token>
+    """
+    if isinstance(value, str):
+        return value
+    parts = value["Fn::Join"][1]
+    return "".join(part if isinstance(part, str) else "<token>" for part in parts)
+
+
+@pytest.fixture(scope="module")
+def tables():
+    app = core.App()
+    data_lake_stack = DataLakeStack(app)
+    GlueCatalogStack(
+        app,
+        data_lake_bronze_bucket=data_lake_stack.data_lake_bronze_bucket,
+        data_lake_silver_bucket=data_lake_stack.data_lake_silver_bucket,
+        data_lake_gold_bucket=data_lake_stack.data_lake_gold_bucket,
+    )
+    template = (
+        app.synth()
+        .get_stack_by_name(f"{active_environment.value}-glue-catalog-stack")
+        .template
+    )
+    return {
+        resource["Properties"]["TableInput"]["Name"]: resource["Properties"][
+            "TableInput"
+        ]
+        for resource in template["Resources"].values()
+        if resource["Type"] == "AWS::Glue::Table"
+    }
+
+
+def test_date_projection(tables):
+    orders = tables["orders"]
+    parameters = orders["Parameters"]
+
+    assert parameters["projection.enabled"] == "true"
+    assert parameters["projection.order_purchase_date.type"] == "date"
+    assert parameters["projection.order_purchase_date.range"] == "2016-01-01,NOW"
+    assert parameters["projection.order_purchase_date.format"] == "yyyy-MM-dd"
+    assert parameters["projection.order_purchase_date.interval"] == "1"
+    assert parameters["projection.order_purchase_date.interval.unit"] == "DAYS"
+    assert literal(parameters["storage.location.template"]) == (
+        "s3://<token>/ecommerce_rds/orders/order_purchase_date=${order_purchase_date}"
+    )
+    assert orders["PartitionKeys"] == [{"Name": "order_purchase_date", "Type": "date"}]
+    # the partition column is a key, not a column of the files
+    columns = [column["Name"] for column in orders["StorageDescriptor"]["Columns"]]
+    assert "order_purchase_date" not in columns
+    assert "order_id" in columns
+
+
+def test_integer_projection(tables):
+    parameters = tables["orders_obt"]["Parameters"]
+
+    assert parameters["projection.enabled"] == "true"
+    assert parameters["projection.order_purchase_year.type"] == "integer"
+    assert parameters["projection.order_purchase_year.range"] == "2016,2030"
+    assert literal(parameters["storage.location.template"]) == (
+        "s3://<token>/ecommerce_rds/orders_obt/_symlink_format_manifest/"
+        "order_purchase_year=${order_purchase_year}"
+    )
+    assert tables["orders_obt"]["PartitionKeys"] == [
+        {"Name": "order_purchase_year", "Type": "int"}
+    ]
+    # gold is read through the symlink manifests of each year
+    storage = tables["orders_obt"]["StorageDescriptor"]
+    assert storage["InputFormat"].endswith("SymlinkTextInputFormat")
+    assert storage["SerdeInfo"]["SerializationLibrary"].endswith("ParquetHiveSerDe")
+
+
+def test_projected_tables_document_the_rows_athena_skips(tables):
+    # the directory of null values isn't in any projected range
+    assert "__HIVE_DEFAULT_PARTITION__" in tables["orders"]["Description"]
+    assert "order_purchase_year is null" in tables["orders_obt"]["Description"]
+    assert "Description" not in tables["sellers"]
+
+
+def test_unpartitioned_tables_have_no_projection(tables):
+    parameters = tables["sellers"]["Parameters"]
+
+    assert parameters == {"classification": "parquet", "EXTERNAL": "TRUE"}
+    assert not tables["sellers"].get("PartitionKeys")
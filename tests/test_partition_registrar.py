@@ -0,0 +1,142 @@
+import json
+
+import pytest
+
+from data_platform.athena.query_client import LocalS3
+from data_platform.glue_catalog.partition_registrar import (
+    DATA_VERSION_PARAMETER,
+    MAX_PARTITIONS_PER_CALL,
+    LocalGlueCatalog,
+    PartitionRegistrar,
+    handler,
+)
+
+BUCKET = "datalake-production-silver-123"
+DATABASE = "glue_ecommerce_production_data_lake_silver"
+STORAGE = {"Location": f"s3://{BUCKET}/ecommerce_rds/orders", "Columns": []}
+
+
+@pytest.fixture
+def glue():
+    glue = LocalGlueCatalog()
+    glue.create_table(
+        DatabaseName=DATABASE,
+        TableInput={
+            "Name": "orders",
+            "PartitionKeys": [{"Name": "order_purchase_date", "Type": "date"}],
+            "StorageDescriptor": STORAGE,
+            "Parameters": {"classification": "parquet"},
+        },
+    )
+    glue.create_table(
+        DatabaseName=DATABASE,
+        TableInput={"Name": "sellers", "StorageDescriptor": STORAGE},
+    )
+    return glue
+
+
+def manifest_event(s3, name: str, files: list) -> dict:
+    key = f"_state/manifests/orders/{name}.json"
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=key,
+        Body=json.dumps({"table": "orders", "files": files}).encode(),
+    )
+    return {"Records": [{"s3": {"bucket": {"name": BUCKET}, "object": {"key": key}}}]}
+
+
+def order_file(day: str, part: int = 0) -> str:
+    return f"ecommerce_rds/orders/order_purchase_date={day}/part-{part}.parquet"
+
+
+def test_manifest_partitions_are_created(glue, monkeypatch):
+    monkeypatch.setenv("DATABASE_NAME", DATABASE)
+    s3 = LocalS3()
+    event = manifest_event(
+        s3,
+        "20210520T110000-a",
+        [
+            order_file("2018-01-01"),
+            order_file("2018-01-01", 1),
+            order_file("2018-01-02"),
+        ],
+    )
+
+    stats = handler(event, None, glue=glue, s3=s3)
+
+    assert stats[BUCKET] == {"created": 2, "existing": 0, "skipped": 0, "versioned": 1}
+    partitions = glue.partitions[DATABASE, "orders"]
+    assert sorted(partitions) == [("2018-01-01",), ("2018-01-02",)]
+    location = partitions[("2018-01-02",)]["StorageDescriptor"]["Location"]
+    assert location == (
+        f"s3://{BUCKET}/ecommerce_rds/orders/order_purchase_date=2018-01-02"
+    )
+    table = glue.get_table(DatabaseName=DATABASE, Name="orders")["Table"]
+    assert table["Parameters"] == {
+        "classification": "parquet",
+        DATA_VERSION_PARAMETER: "20210520T110000-a",
+    }
+
+
+def test_existing_partitions_are_counted_not_replaced(glue, monkeypatch):
+    monkeypatch.setenv("DATABASE_NAME", DATABASE)
+    s3 = LocalS3()
+    handler(
+        manifest_event(s3, "20210520T110000-a", [order_file("2018-01-01")]),
+        None,
+        glue=glue,
+        s3=s3,
+    )
+    first = glue.partitions[DATABASE, "orders"][("2018-01-01",)]
+
+    stats = handler(
+        manifest_event(
+            s3,
+            "20210520T120000-b",
+            [order_file("2018-01-01", 1), order_file("2018-01-03")],
+        ),
+        None,
+        glue=glue,
+        s3=s3,
+    )
+
+    assert stats[BUCKET]["created"] == 1
+    assert stats[BUCKET]["existing"] == 1
+    assert glue.partitions[DATABASE, "orders"][("2018-01-01",)] is first
+    table = glue.get_table(DatabaseName=DATABASE, Name="orders")["Table"]
+    assert table["Parameters"][DATA_VERSION_PARAMETER] == "20210520T120000-b"
+
+
+def test_unknown_and_unpartitioned_tables(glue):
+    registrar = PartitionRegistrar(glue, DATABASE)
+
+    stats = registrar.register(
+        BUCKET,
+        [
+            "ecommerce_rds/sellers/part-0.parquet",
+            "ecommerce_rds/missing/day=2018-01-01/part-0.parquet",
+            "ecommerce_rds/orders/other=1/part-0.parquet",
+        ],
+    )
+
+    # orders files outside a partition of its keys aren't registered
+    assert stats == {"created": 0, "existing": 0, "skipped": 2, "versioned": 0}
+    assert not glue.partitions[DATABASE, "orders"]
+
+
+def test_partitions_are_created_in_batches(glue):
+    class CountingGlue(LocalGlueCatalog):
+        calls = 0
+
+        def batch_create_partition(self, **kwargs):
+            CountingGlue.calls += 1
+            return super().batch_create_partition(**kwargs)
+
+    counting = CountingGlue()
+    counting.tables = glue.tables
+    keys = [order_file(f"2018-01-01-{number}") for number in range(150)]
+
+    stats = PartitionRegistrar(counting, DATABASE).register(BUCKET, keys)
+
+    assert stats["created"] == 150
+    assert CountingGlue.calls == -(-150 // MAX_PARTITIONS_PER_CALL)
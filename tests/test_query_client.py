@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from data_platform.athena.query_client import (
+    AthenaQueryClient,
+    LocalAthena,
+    LocalS3,
+    normalize_sql,
+    referenced_tables,
+)
+from data_platform.glue_catalog.partition_registrar import (
+    DATA_VERSION_PARAMETER,
+    LocalGlueCatalog,
+)
+
+RESULTS_BUCKET = "results"
+
+
+@pytest.mark.parametrize(
+    "sql, tables",
+    [
+        ('select count(*) from "silver"."orders"', [("silver", "orders")]),
+        (
+            'select * from orders o join "order_items" i on o.order_id = i.order_id',
+            [("db", "order_items"), ("db", "orders")],
+        ),
+        ("select extract(year from order_date) from orders", [("db", "orders")]),
+        ("select * from orders where a is distinct from b", [("db", "orders")]),
+        ("select 'from sellers' from orders -- join products", [("db", "orders")]),
+        ("select 1", []),
+    ],
+)
+def test_referenced_tables(sql, tables):
+    assert referenced_tables(normalize_sql(sql), "db") == tables
+
+
+@pytest.fixture
+def client():
+    s3 = LocalS3()
+    athena = LocalAthena(s3, RESULTS_BUCKET)
+    athena.create_table("orders", [{"order_id": "a"}, {"order_id": "b"}])
+    glue = LocalGlueCatalog()
+    glue.create_table(
+        DatabaseName="db",
+        TableInput={"Name": "orders", "Parameters": {DATA_VERSION_PARAMETER: "1"}},
+    )
+    return AthenaQueryClient(
+        athena, glue, s3, workgroup="primary", database="db", results_bucket="results"
+    )
+
+
+def test_unchanged_tables_reuse_results(client):
+    first = asyncio.run(client.query('select count(*) from "orders"'))
+    second = asyncio.run(client.query('SELECT count(*)  FROM "orders";'))
+
+    assert not first.cached
+    assert second.cached
+    assert second.output_location == first.output_location
+    assert client.stats["bytes_avoided"] == first.bytes_scanned > 0
+    assert client.read_result(second) == [{"count(*)": "2"}]
+
+
+def test_new_data_version_runs_again(client):
+    asyncio.run(client.query('select count(*) from "orders"'))
+    table = client.glue.get_table(DatabaseName="db", Name="orders")["Table"]
+    table["Parameters"] = {DATA_VERSION_PARAMETER: "2"}
+    client.glue.update_table(DatabaseName="db", TableInput=table)
+
+    result = asyncio.run(client.query('select count(*) from "orders"'))
+
+    assert not result.cached
+    assert client.stats["executions"] == 2
+
+
+def test_queries_without_catalog_tables_bypass_the_cache(client):
+    asyncio.run(client.query("select 1 as one"))
+    result = asyncio.run(client.query("select 1 as one"))
+
+    assert not result.cached
+    assert client.stats["executions"] == 2
+    assert not [key for _, key in client.s3.objects if key.startswith("query-cache")]
+
+
+def test_tables_without_data_version_bypass_the_cache(client):
+    client.athena.create_table("sellers", [{"seller_id": "s"}])
+    client.glue.create_table(DatabaseName="db", TableInput={"Name": "sellers"})
+    sql = "select * from orders join sellers on order_id = seller_id"
+
+    asyncio.run(client.query(sql))
+    result = asyncio.run(client.query(sql))
+
+    assert not result.cached
+    assert client.stats["executions"] == 2
+
+
+def test_query_many_shares_results(client):
+    results = asyncio.run(
+        client.query_many(["select * from orders", "select * from orders"] * 2)
+    )
+
+    assert len(results) == 4
+    assert client.stats["queries"] == 4
@@ -0,0 +1,100 @@
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from pyarrow import fs
+
+from data_platform.processing.silver_to_gold import (
+    ORDERS_OBT_SCHEMA,
+    RUNS_DIRECTORY,
+    SYMLINK_DIRECTORY,
+    gold_files,
+    write_gold,
+)
+from data_platform.processing.storage import list_files
+
+
+def orders_obt(days: list) -> pa.Table:
+    columns = {
+        "order_id": [f"o{number}" for number in range(len(days))],
+        "order_purchase_date": days,
+        "order_purchase_year": [day.year for day in days],
+    }
+    return pa.Table.from_arrays(
+        [
+            pa.array(columns[field.name], field.type)
+            if field.name in columns
+            else pa.nulls(len(days), field.type)
+            for field in ORDERS_OBT_SCHEMA
+        ],
+        schema=ORDERS_OBT_SCHEMA,
+    )
+
+
+@pytest.fixture
+def target(tmp_path):
+    return str(tmp_path / "ecommerce_rds" / "orders_obt")
+
+
+def runs(target) -> list:
+    return sorted(
+        info.base_name
+        for info in fs.LocalFileSystem().get_file_info(
+            fs.FileSelector(f"{target}/{RUNS_DIRECTORY}")
+        )
+    )
+
+
+def test_manifests_point_at_the_latest_run_only(target):
+    filesystem = fs.LocalFileSystem()
+    days = [datetime.date(2017, 3, 1), datetime.date(2018, 1, 1)]
+    write_gold(orders_obt(days), filesystem, target)
+    first = runs(target)
+
+    manifests = write_gold(orders_obt(days * 2), filesystem, target)
+
+    assert [manifest.split("/")[-2] for manifest in manifests] == [
+        "order_purchase_year=2017",
+        "order_purchase_year=2018",
+    ]
+    # readers see the rows of one run, never both
+    files = gold_files(filesystem, target)
+    assert pq.read_table(files).num_rows == 4
+    assert all(f"/{RUNS_DIRECTORY}/{first[0]}/" not in path for path in files)
+    # the run the manifests pointed to stays for the queries reading it
+    assert first[0] in runs(target)
+    assert len(runs(target)) == 2
+
+    write_gold(orders_obt(days), filesystem, target)
+
+    assert first[0] not in runs(target)
+    assert len(runs(target)) == 2
+
+
+def test_years_missing_from_the_new_run_disappear(target):
+    filesystem = fs.LocalFileSystem()
+    write_gold(
+        orders_obt([datetime.date(2017, 3, 1), datetime.date(2018, 1, 1)]),
+        filesystem,
+        target,
+    )
+
+    write_gold(orders_obt([datetime.date(2018, 1, 1)]), filesystem, target)
+
+    manifests = list_files(filesystem, f"{target}/{SYMLINK_DIRECTORY}", "manifest")
+    assert [info.path.split("/")[-2] for info in manifests] == [
+        "order_purchase_year=2018"
+    ]
+    assert pq.read_table(gold_files(filesystem, target)).num_rows == 1
+
+
+def test_files_of_the_previous_layout_are_removed(target):
+    filesystem = fs.LocalFileSystem()
+    legacy = f"{target}/order_purchase_year=2018"
+    filesystem.create_dir(legacy)
+    pq.write_table(orders_obt([datetime.date(2018, 1, 1)]), f"{legacy}/part.parquet")
+
+    write_gold(orders_obt([datetime.date(2018, 1, 1)]), filesystem, target)
+
+    assert not list_files(filesystem, legacy)
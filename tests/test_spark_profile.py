@@ -0,0 +1,28 @@
+import pytest
+
+from data_platform.emr.spark_profile import YARN_NODE_RESOURCES, SparkProfile
+
+
+@pytest.mark.parametrize("instance_type", sorted(YARN_NODE_RESOURCES))
+def test_executors_leave_room_for_the_driver(instance_type):
+    profile = SparkProfile(instance_type=instance_type)
+    node_memory = YARN_NODE_RESOURCES[instance_type][1]
+
+    profile.validate()
+
+    executors = (
+        profile.executor_memory_mib + profile.memory_overhead_mib
+    ) * profile.executors_per_node
+    assert executors + profile.driver_container_mib <= node_memory
+
+
+def test_driver_settings_match_the_reserved_memory():
+    defaults = SparkProfile(driver_memory_mib=4096).spark_defaults
+
+    assert defaults["spark.driver.memory"] == "4096m"
+    assert defaults["spark.driver.memoryOverhead"] == "409m"
+
+
+def test_driver_larger_than_a_node_is_rejected():
+    with pytest.raises(ValueError, match="don't fit"):
+        SparkProfile(driver_memory_mib=12288).validate()
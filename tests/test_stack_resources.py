@@ -0,0 +1,62 @@
+import pytest
+
+from data_platform.airflow_mwaa.dags import stack_resources
+from data_platform.airflow_mwaa.dags.stack_resources import StackResources
+
+BUCKET = "AWS::S3::Bucket"
+
+
+def bucket(physical_id: str) -> dict:
+    return {
+        "ResourceType": BUCKET,
+        "LogicalResourceId": "Bucket",
+        "PhysicalResourceId": physical_id,
+    }
+
+
+class DescribedStack(StackResources):
+    """
+    Answers describe_stack_resources with the resources the stack has now
+    """
+
+    def __init__(self, stack_name, resources: list):
+        super().__init__(stack_name)
+        self.current = resources
+        self.describes = 0
+
+    def _describe(self):
+        self.describes += 1
+        return list(self.current)
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(stack_resources, "CACHE_DIRECTORY", str(tmp_path))
+
+
+def test_resources_are_cached_across_instances():
+    DescribedStack("stack", [bucket("script-bucket-1")]).find(BUCKET)
+    stack = DescribedStack("stack", [])
+
+    assert stack.find(BUCKET) == "script-bucket-1"
+    assert stack.describes == 0
+
+
+def test_a_miss_describes_the_stack_again():
+    DescribedStack("stack", [bucket("script-bucket-1")]).find(BUCKET)
+    stack = DescribedStack(
+        "stack", [bucket("script-bucket-1"), bucket("silver-bucket-1")]
+    )
+
+    assert stack.find(BUCKET, physical_id_contains="silver") == "silver-bucket-1"
+    assert stack.describes == 1
+    # the refreshed resources replace the cached ones
+    assert DescribedStack("stack", []).find(BUCKET, physical_id_contains="silver")
+
+
+def test_missing_resources_raise_after_one_retry():
+    stack = DescribedStack("stack", [bucket("script-bucket-1")])
+
+    with pytest.raises(LookupError, match="No AWS::S3::Bucket matching gold"):
+        stack.find(BUCKET, physical_id_contains="gold")
+    assert stack.describes == 2
@@ -0,0 +1,137 @@
+import pytest
+
+from data_platform.trigger_dms import (
+    LOADED_TABLE_STATE,
+    LocalDMS,
+    LocalGlue,
+    ReplicationTaskRunner,
+    split_table_name,
+)
+
+TASK = "production-dms-task-ecommerce-rds"
+ORDERS = ("ecommerce", "orders")
+SELLERS = ("ecommerce", "sellers")
+
+
+CRAWLER = "glue-production-bronze-ecommerce_rds-crawler"
+
+
+def runner_for(dms, timeout_seconds=60.0, glue=None):
+    return ReplicationTaskRunner(
+        dms,
+        TASK,
+        poll_seconds=0,
+        timeout_seconds=timeout_seconds,
+        sleep=lambda seconds: None,
+        glue=glue,
+        crawler=CRAWLER,
+    )
+
+
+def test_split_table_name():
+    assert split_table_name("orders") == ORDERS
+    assert split_table_name("other.orders") == ("other", "orders")
+    with pytest.raises(ValueError):
+        split_table_name("missing")
+
+
+def test_reload_waits_for_the_reloaded_tables_only():
+    dms = LocalDMS(TASK, {ORDERS: 100, SELLERS: 10})
+    before = dict(dms.tables[SELLERS])
+
+    statistics = runner_for(dms).reload_tables([ORDERS])
+
+    assert list(statistics) == [ORDERS]
+    assert statistics[ORDERS]["TableState"] == LOADED_TABLE_STATE
+    assert dms.calls["reload_tables"] == [
+        [{"SchemaName": "ecommerce", "TableName": "orders"}]
+    ]
+    assert dms.tables[SELLERS] == before
+
+
+def test_reload_starts_the_bronze_crawler():
+    glue = LocalGlue()
+
+    runner_for(LocalDMS(TASK, {ORDERS: 100}), glue=glue).reload_tables([ORDERS])
+
+    assert glue.started == [CRAWLER]
+
+
+def test_crawl_already_running_is_left_alone():
+    glue = LocalGlue(running=True)
+
+    runner_for(LocalDMS(TASK, {ORDERS: 100}), glue=glue).reload_tables([ORDERS])
+
+    assert glue.started == []
+
+
+def test_reload_raises_when_a_table_fails():
+    dms = LocalDMS(TASK, {ORDERS: 100, SELLERS: 10}, failing_tables=[SELLERS])
+
+    glue = LocalGlue()
+
+    with pytest.raises(RuntimeError, match="ecommerce.sellers failed"):
+        runner_for(dms, glue=glue).reload_tables([ORDERS, SELLERS])
+    assert glue.started == []
+
+
+def test_reload_needs_a_running_task():
+    dms = LocalDMS(TASK, {ORDERS: 100})
+    dms.task["Status"] = "stopped"
+
+    with pytest.raises(RuntimeError, match="only be reloaded while the task runs"):
+        runner_for(dms).reload_tables([ORDERS])
+    assert not dms.calls["reload_tables"]
+
+
+def test_resume_restarts_from_the_recorded_checkpoint():
+    dms = LocalDMS(TASK, {ORDERS: 100})
+    dms.task["Status"] = "stopped"
+
+    task = runner_for(dms).resume()
+
+    assert task["Status"] == "running"
+    assert dms.calls["start_replication_task"] == [
+        {
+            "StartReplicationTaskType": "resume-processing",
+            "CdcStartPosition": "checkpoint:V1#1#000000/000000",
+        }
+    ]
+
+
+def test_resume_starts_a_task_that_never_ran():
+    dms = LocalDMS(TASK, {ORDERS: 100})
+    dms.task.update(Status="ready", RecoveryCheckpoint=None)
+
+    runner_for(dms).resume()
+
+    assert dms.calls["start_replication_task"] == [
+        {"StartReplicationTaskType": "start-replication"}
+    ]
+
+
+def test_resume_leaves_a_running_task_alone():
+    dms = LocalDMS(TASK, {ORDERS: 100})
+
+    assert runner_for(dms).resume()["Status"] == "running"
+    assert not dms.calls["start_replication_task"]
+
+
+def test_wait_for_status_raises_when_the_task_fails():
+    dms = LocalDMS(TASK, {ORDERS: 100})
+    dms.task.update(Status="failed", LastFailureMessage="endpoint unreachable")
+
+    with pytest.raises(RuntimeError, match="endpoint unreachable"):
+        runner_for(dms).wait_for_status(("running",))
+
+
+def test_wait_for_status_times_out():
+    dms = LocalDMS(TASK, {ORDERS: 100})
+
+    with pytest.raises(TimeoutError):
+        runner_for(dms, timeout_seconds=-1).wait_for_status(("stopped",))
+
+
+def test_missing_task():
+    with pytest.raises(RuntimeError, match="not found"):
+        runner_for(LocalDMS("other-task", {ORDERS: 100})).task()